@@ -1,14 +1,24 @@
-from . import parallel
+from . import (
+    arena,
+    labeling,
+    parallel,
+    shards,
+)
 from .measures import *  # noqa: F403
 from .measures import __all__ as __all_measures__
 from .study import Study
+from .thresholds import ThresholdSweep
 from .version import __version__
 
 __all__ = __all_measures__ + [
     '__version__',
     'Study',
+    'ThresholdSweep',
     'VERSION',
+    'arena',
+    'labeling',
     'parallel',
+    'shards',
 ]
 
 
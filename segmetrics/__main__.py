@@ -3,6 +3,7 @@ import glob
 import inspect
 import pathlib
 import re
+import sys
 
 import skimage.io
 
@@ -11,6 +12,10 @@ from . import (
     measures,
 )
 from .measure import Measure
+from .shards import (
+    reduce_shards,
+    write_shard,
+)
 
 # Build dictionary of measures
 measures_dict = dict()
@@ -19,8 +24,67 @@ for measure_name in dir(measures):
     if inspect.isclass(measure) and issubclass(measure, Measure):
         measures_dict[measure_name] = measure
 
+
+def reduce_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m segmetrics reduce',
+        description='combines the results of several shard files',
+    )
+    parser.add_argument(
+        'output_file',
+        help='filepath where the results are to be written (CSV)',
+    )
+    parser.add_argument(
+        'shard_files',
+        nargs='+',
+        help='shard files written using the --shard option',
+    )
+    parser.add_argument(
+        '--fanout',
+        type=int,
+        default=16,
+        help='number of shards which are combined at once',
+    )
+    parser.add_argument(
+        '--num-workers',
+        type=int,
+        default=None,
+        help='number of processes used to combine the shards',
+    )
+    parser.add_argument(
+        '--shard',
+        default=None,
+        help='filepath where the combined shard is to be written',
+    )
+    parser.add_argument(
+        '--semicolon',
+        action='store_true',
+        help='uses semi-colon instead of comma to write the results',
+    )
+    args = parser.parse_args(argv)
+
+    print(f'Combining {len(args.shard_files)} shards')
+    study = reduce_shards(
+        args.shard_files,
+        fanout=args.fanout,
+        num_workers=args.num_workers,
+    )
+    if args.shard is not None:
+        write_shard(study, args.shard)
+        print(f'Shard written to: {args.shard}')
+
+    csv_delimiter = ';' if args.semicolon else ','
+    with open(args.output_file, 'w') as fout:
+        study.write_csv(fout, delimiter=csv_delimiter)
+    print(f'Results written to: {args.output_file}')
+
+
 if __name__ == '__main__':
 
+    if sys.argv[1:2] == ['reduce']:
+        reduce_main(sys.argv[2:])
+        sys.exit()
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'seg_dir',
@@ -68,6 +132,14 @@ if __name__ == '__main__':
         action='store_true',
         help='uses semi-colon instead of comma to write the results',
     )
+    parser.add_argument(
+        '--shard',
+        default=None,
+        help=(
+            'filepath where the results are additionally written as a shard'
+            ' (to be combined using the "reduce" command)'
+        ),
+    )
     args = parser.parse_args()
 
     print(f'')
@@ -80,6 +152,8 @@ if __name__ == '__main__':
     print(f' Is ground truth data uniquely labeled? {args.gt_unique}')
     print(f' Is segmentation result data uniquely labeled? {args.seg_unique}')
     print(f' Results will be written to: {args.output_file}')
+    if args.shard is not None:
+        print(f' Shard will be written to: {args.shard}')
     print(f' The following performance measures will be used:')
 
     # Build study
@@ -125,5 +199,8 @@ if __name__ == '__main__':
     with open(args.output_file, 'w') as fout:
         study.write_csv(fout, delimiter=csv_delimiter)
 
+    if args.shard is not None:
+        write_shard(study, args.shard)
+
     print(f'')
     print(f'Results written to: {args.output_file}')
@@ -1,25 +1,334 @@
+import math
+import weakref
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
 import numpy as np
+from scipy import ndimage
+
+from segmetrics import _cache
+from segmetrics.arena import scratch
+from segmetrics.typing import (
+    BinaryImage,
+    Image,
+    LabelImage,
+)
+
+Slice = Tuple[slice, ...]
+
+#: Images with at least this number of pixels are represented by packed bit
+#: arrays when counting foreground pixels (see :func:`foreground_counts`).
+#: Use ``0`` to always use packed bit arrays, or ``None`` to never use them.
+PACKED_MIN_SIZE: Optional[int] = 2 ** 22
+
+#: Pixel-level passes over large images (e.g., counting label pairs) are
+#: carried out in chunks along the first axis (e.g., the z-axis of volumes),
+#: so that their temporary arrays are limited to about this number of pixels.
+#: This does not bound the cached full-size artifacts, like foreground masks
+#: (one byte per pixel) and the distance maps of the contour measures (eight
+#: bytes per pixel, since an exact distance transform cannot be chunked).
+CHUNK_SIZE: int = 2 ** 24
+
+# Number of pixels packed at once (must be a multiple of 64)
+_PACK_CHUNK_SIZE = 2 ** 24
+
+# Number of set bits for each byte value (used if np.bitwise_count is not
+# available, which requires NumPy 2.0 or later)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+
+
+def chunks(shape: Sequence[int]) -> List[slice]:
+    """
+    Returns the slices along the first axis, which split an image of the
+    given ``shape`` into chunks of at most :data:`CHUNK_SIZE` pixels (or
+    single slices along the first axis, if those are larger).
+    """
+    if len(shape) == 0 or shape[0] == 0:
+        return [slice(None)]
+    step = max((CHUNK_SIZE // max((int(np.prod(shape[1:])), 1)), 1))
+    return [slice(pos, pos + step) for pos in range(0, shape[0], step)]
+
+
+def foreground(image: Image) -> BinaryImage:
+    """
+    Returns the binary foreground mask of a label image (cached).
+    """
+    if image.dtype == bool:
+        return cast(BinaryImage, image)
+    return _cache.get((image,), 'foreground', lambda: image > 0)
+
+
+def compact_labels(image: LabelImage) -> LabelImage:
+    """
+    Returns ``image`` with its labels mapped monotonically to the dense range
+    :math:`0, \\dots, n` (cached).
+
+    Images with non-negative labels which do not exceed the number of pixels
+    are returned unchanged. Otherwise, the labels are mapped chunk-wise, so
+    that the memory required does not depend on the magnitude of the labels.
+    """
+    if image.size == 0 or image.min() < 0 or image.max() <= image.size:
+        return image
+
+    def compact() -> LabelImage:
+        labels = np.union1d(np.unique(image), [0])
+        compacted = np.empty(image.shape, np.min_scalar_type(len(labels) - 1))
+        for chunk in chunks(image.shape):
+            compacted[chunk] = np.searchsorted(labels, image[chunk])
+        return compacted
+    return _cache.get((image,), 'compact_labels', compact)
+
+
+def packed_foreground(image: Image) -> np.ndarray:
+    """
+    Returns the binary foreground mask of a label image as a packed bit array
+    of 64-bit words (cached).
+
+    The foreground mask is packed in chunks along the first axis, so that no
+    full-size temporary is created (also if the image is not contiguous in
+    memory). The padding bits at the end are zero.
+    """
+    def pack() -> np.ndarray:
+        words = np.zeros((image.size + 63) // 64, np.uint64)
+        if image.size == 0:
+            return words
+        packed = words.view(np.uint8)
+        images = image.reshape(1, -1) if image.ndim == 0 else image
+
+        # Chunks span a multiple of 64 pixels, so that they are packed into
+        # whole words (except for the last chunk)
+        row_size = images.size // images.shape[0]
+        align = 64 // math.gcd(row_size, 64)
+        step = max((_PACK_CHUNK_SIZE // row_size // align, 1)) * align
+        for start in range(0, images.shape[0], step):
+            chunk = images[start:start + step]
+            mask = chunk if chunk.dtype == bool else chunk > 0
+            pos = start * row_size
+            packed[pos // 8:(pos + mask.size + 7) // 8] = np.packbits(
+                mask.reshape(-1),
+            )
+        return words
+    return _cache.get((image,), 'packed_foreground', pack)
+
+
+def popcount(words: np.ndarray) -> int:
+    """
+    Returns the number of set bits in an array of packed bits.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum(dtype=np.uint64))
+    else:
+        return int(_POPCOUNT_TABLE[words.view(np.uint8)].sum(dtype=np.uint64))
+
+
+def foreground_counts(
+    expected: Image,
+    actual: Image,
+) -> Tuple[int, int, int]:
+    """
+    Returns the numbers of foreground pixels of two label images, and the
+    number of pixels where the foregrounds intersect (cached).
+
+    For images with at least :data:`PACKED_MIN_SIZE` pixels, the counts are
+    computed using packed bit arrays (one bit per pixel) and word-level
+    operations, instead of boolean masks (one byte per pixel).
+    """
+    assert expected.shape == actual.shape
+
+    def count() -> Tuple[int, int, int]:
+        if PACKED_MIN_SIZE is not None and expected.size >= PACKED_MIN_SIZE:
+            ref = packed_foreground(expected)
+            res = packed_foreground(actual)
+            return (
+                popcount(ref),
+                popcount(res),
+                popcount(np.bitwise_and(ref, res)),
+            )
+        else:
+            ref = foreground(expected)
+            res = foreground(actual)
+            with scratch(ref.shape, bool) as intersection:
+                np.logical_and(ref, res, out=intersection)
+                return (
+                    int(np.count_nonzero(ref)),
+                    int(np.count_nonzero(res)),
+                    int(np.count_nonzero(intersection)),
+                )
+    return _cache.get((expected, actual), 'foreground_counts', count)
+
+
+class ObjectIndex:
+    """
+    Index of the objects of a label image.
+
+    The bounding boxes of all objects are determined in a single pass using
+    ``scipy.ndimage.find_objects``. Per-object computations can then be
+    carried out on the crops given by the bounding boxes, instead of the
+    whole image.
+
+    :param image:
+        An image containing uniquely labeled object masks.
+    """
+
+    def __init__(self, image: LabelImage) -> None:
+        # The index is cached along with the image, so it must not keep the
+        # image alive
+        self._image = weakref.ref(image)
+        self.shape = image.shape
+
+        if image.dtype == bool:
+            image = image.view(np.uint8)
+        slices = ndimage.find_objects(image)
+
+        #: The object labels (sorted in ascending order).
+        self.labels = np.array(
+            [label for label, sl in enumerate(slices, start=1) if sl],
+            dtype=np.int64,
+        )
+
+        #: The bounding slices of the objects, indexed by label.
+        self.slices: Dict[int, Slice] = {
+            int(label): slices[label - 1] for label in self.labels
+        }
+
+        bounds = np.array(
+            [[(s.start, s.stop) for s in sl] for sl in slices if sl],
+            dtype=np.int64,
+        ).reshape(-1, image.ndim, 2)
+
+        #: The bounding box starts of the objects (ordered like the labels).
+        self.starts = bounds[:, :, 0]
+
+        #: The bounding box ends of the objects (exclusive, ordered like the
+        #: labels).
+        self.stops = bounds[:, :, 1]
+
+        # Compute the object areas
+        self._areas: Dict[int, int] = dict()
+        if len(self.labels) > 0 and np.can_cast(image.dtype, np.intp):
+            areas = np.zeros(self.labels[-1] + 1, np.int64)
+            for chunk in chunks(image.shape):
+                areas += np.bincount(
+                    image[chunk].reshape(-1),
+                    minlength=len(areas),
+                )
+            self._areas = {
+                int(label): int(areas[label]) for label in self.labels
+            }
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def area(self, label: int) -> int:
+        """
+        Returns the number of pixels of an object.
+        """
+        if label not in self._areas:
+            self._areas[label] = int(np.count_nonzero(self.mask(label)[1]))
+        return self._areas[label]
+
+    def mask(self, label: int) -> Tuple[Slice, BinaryImage]:
+        """
+        Returns the bounding slice of an object, and the binary mask of the
+        object cropped to that slice.
+        """
+        image = self._image()
+        assert image is not None, 'the indexed image no longer exists'
+        sl = self.slices[label]
+        return sl, image[sl] == label
+
+    def coordinates(self, label: int) -> np.ndarray:
+        """
+        Returns the pixel coordinates of an object (one row per pixel).
+        """
+        sl, mask = self.mask(label)
+        return np.argwhere(mask) + [s.start for s in sl]
+
+
+def object_index(image: LabelImage) -> ObjectIndex:
+    """
+    Returns the :class:`ObjectIndex` of a label image (cached).
+    """
+    return _cache.get((image,), 'object_index', lambda: ObjectIndex(image))
+
+
+def count_objects(image: LabelImage) -> int:
+    """
+    Returns the number of objects of a label image (cached).
+
+    The :class:`ObjectIndex` of the image is used if it is available, and
+    otherwise the present labels are counted.
+    """
+    def count() -> int:
+        index = _cache.peek((image,), 'object_index')
+        if index is not None:
+            return len(index)
+        max_label = int(image.max(initial=0))
+        if image.dtype == bool or max_label > image.size:
+            return int(np.count_nonzero(np.unique(image)))
+        presence = np.zeros(max_label + 1, bool)
+        for chunk in chunks(image.shape):
+            presence[image[chunk].reshape(-1)] = True
+        return int(np.count_nonzero(presence[1:]))
+    return _cache.get((image,), 'num_objects', count)
+
+
+def bbox(
+    shape: Sequence[int],
+    slices: Sequence[Slice],
+    margin: int = 0,
+) -> Slice:
+    """
+    Returns the bounding slice which encloses all given ``slices``, enlarged
+    by ``margin`` and clipped to the image ``shape``.
+    """
+    assert len(slices) > 0
+    return tuple(
+        slice(
+            max(min(sl[dim].start for sl in slices) - margin, 0),
+            min(max(sl[dim].stop for sl in slices) + margin, shape[dim]),
+        )
+        for dim in range(len(shape))
+    )
+
+
+def relative_slice(sl: Slice, window: Slice) -> Slice:
+    """
+    Returns the slice ``sl`` relative to the start of ``window``.
+    """
+    return tuple(
+        slice(s.start - w.start, s.stop - w.start) for s, w in zip(sl, window)
+    )
+
 
+def bbox_distances(
+    start: np.ndarray,
+    stop: np.ndarray,
+    starts: np.ndarray,
+    stops: np.ndarray,
+    spacing: Optional[Sequence[float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns lower and upper bounds of the Euclidean distances between the
+    pixels within the bounding box given by ``start`` and ``stop``, and the
+    pixels within each of the bounding boxes given by ``starts`` and
+    ``stops`` (exclusive ends).
 
-def bbox(*masks, margin=0):
-    assert len(masks) > 0
-    assert len(masks) == 1 or all(
-        masks[0].shape == mask.shape for mask in masks[1:]
+    The distances are scaled by the pixel ``spacing`` along each axis, if
+    given.
+    """
+    gaps = np.maximum(np.maximum(starts - stop, start - stops) + 1, 0)
+    spans = np.maximum(np.abs(stops - 1 - start), np.abs(stop - 1 - starts))
+    if spacing is not None:
+        gaps = gaps * np.asarray(spacing, float)
+        spans = spans * np.asarray(spacing, float)
+    return (
+        np.sqrt((gaps ** 2).sum(axis=1)),
+        np.sqrt((spans ** 2).sum(axis=1)),
     )
-    _rmin, _rmax = np.inf, -np.inf
-    _cmin, _cmax = np.inf, -np.inf
-    for mask in masks:
-        rows = np.any(mask, axis=1)
-        cols = np.any(mask, axis=0)
-        rmin, rmax  = np.where(rows)[0][[0, -1]]
-        cmin, cmax  = np.where(cols)[0][[0, -1]]
-        _rmin, _rmax = min((_rmin, rmin)), max((_rmax, rmax))
-        _cmin, _cmax = min((_cmin, cmin)), max((_cmax, cmax))
-    _rmin -= margin
-    _rmax += margin
-    _cmin -= margin
-    _cmax += margin
-    _rmin, _rmax = max((_rmin, 0)), min((_rmax, mask.shape[0] - 1))
-    _cmin, _cmax = max((_cmin, 0)), min((_cmax, mask.shape[1] - 1))
-    sel = np.s_[_rmin:_rmax + 1, _cmin:_cmax + 1]
-    return sel, (_rmin, _rmax), (_cmin, _cmax)
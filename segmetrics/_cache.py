@@ -0,0 +1,197 @@
+import contextlib
+import threading
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+
+# Artifacts derived from images (e.g., binary masks, contours, distance maps)
+# are cached by the identity of the images they were derived from. Each entry
+# holds weak references to its images, so that entries are dropped as soon as
+# any of the images is garbage collected. Images must not be modified in-place
+# while artifacts derived from them are in use.
+#
+# Caching only takes effect within an activated :class:`Scope` (e.g., the
+# scope of a study, which evaluates a new view of each image passed by the
+# caller, see ``study._evaluation_view``). Measures used directly compute the
+# artifacts from scratch, so that modified images never yield stale results.
+
+_Key = Tuple[int, ...]
+_Entry = Tuple[Tuple[weakref.ref, ...], Dict[Hashable, Any]]
+
+# The scopes activated by the current thread (see :meth:`Scope.activate`)
+_active = threading.local()
+
+
+class Scope:
+    """
+    Cache of the artifacts derived from images, which is used while the
+    scope is activated. Pickled scopes are empty.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[_Key, _Entry] = dict()
+        self._finalized: Set[int] = set()
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return dict()
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__()  # type: ignore[misc]
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator['Scope']:
+        """
+        Context manager which makes this the scope used by :func:`get`,
+        :func:`put`, and :func:`peek` in the current thread.
+        """
+        stack = _active.__dict__.setdefault('stack', list())
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+
+    def _discard(self, image_id: int) -> None:
+        with self._lock:
+            self._finalized.discard(image_id)
+            for key in [key for key in self._entries if image_id in key]:
+                del self._entries[key]
+
+    def _register(self, image: np.ndarray) -> None:
+        if id(image) not in self._finalized:
+            self._finalized.add(id(image))
+            weakref.finalize(image, _discard, weakref.ref(self), id(image))
+
+    def _lookup(self, images: Sequence[np.ndarray]) -> Optional[_Entry]:
+        entry = self._entries.get(tuple(id(image) for image in images))
+        if entry is not None and all(
+            ref() is image for ref, image in zip(entry[0], images)
+        ):
+            return entry
+        return None
+
+    def peek(self, images: Sequence[np.ndarray], name: Hashable) -> Any:
+        with self._lock:
+            entry = self._lookup(images)
+            return None if entry is None else entry[1].get(name)
+
+    def put(
+        self,
+        images: Sequence[np.ndarray],
+        name: Hashable,
+        value: Any,
+    ) -> None:
+        with self._lock:
+            entry = self._lookup(images)
+            if entry is None:
+                for image in images:
+                    self._register(image)
+                entry = (tuple(weakref.ref(image) for image in images), dict())
+                self._entries[tuple(id(image) for image in images)] = entry
+            entry[1][name] = value
+
+    def evict(self, image: np.ndarray) -> None:
+        """
+        Drops the artifacts derived from ``image`` (also together with other
+        images).
+        """
+        with self._lock:
+            for key in [key for key in self._entries if id(image) in key]:
+                if any(ref() is image for ref in self._entries[key][0]):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        """
+        Drops all cached artifacts.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def _discard(scope_ref: 'weakref.ref[Scope]', image_id: int) -> None:
+    scope = scope_ref()
+    if scope is not None:
+        scope._discard(image_id)
+
+
+# Data assigned to images (e.g., object classes), which is kept as long as the
+# images exist, regardless of the active scope
+_assigned = Scope()
+
+
+def _current() -> Optional[Scope]:
+    stack = _active.__dict__.get('stack')
+    return stack[-1] if stack else None
+
+
+def peek(images: Sequence[np.ndarray], name: Hashable) -> Any:
+    """
+    Returns the artifact ``name`` derived from ``images``, or ``None`` if it
+    was not computed before for the same image objects within the active
+    scope (or if no scope is active).
+    """
+    scope = _current()
+    return None if scope is None else scope.peek(images, name)
+
+
+def get(
+    images: Sequence[np.ndarray],
+    name: Hashable,
+    factory: Callable[[], Any],
+) -> Any:
+    """
+    Returns the artifact ``name`` derived from ``images``.
+
+    The artifact is obtained by calling ``factory`` if it was not computed
+    before for the same image objects within the active scope (always if no
+    scope is active).
+    """
+    scope = _current()
+    if scope is None:
+        return factory()
+    with scope._lock:
+        entry = scope._lookup(images)
+        if entry is not None and name in entry[1]:
+            return entry[1][name]
+    value = factory()
+    scope.put(images, name, value)
+    return value
+
+
+def put(images: Sequence[np.ndarray], name: Hashable, value: Any) -> None:
+    """
+    Stores ``value`` as the artifact ``name`` derived from ``images`` in the
+    active scope (replacing any previous value). Nothing is stored if no
+    scope is active.
+    """
+    scope = _current()
+    if scope is not None:
+        scope.put(images, name, value)
+
+
+def assign(image: np.ndarray, name: Hashable, value: Any) -> None:
+    """
+    Assigns ``value`` as the data ``name`` to ``image`` (replacing any
+    previous value), regardless of the active scope.
+    """
+    _assigned.put((image,), name, value)
+
+
+def assigned(image: np.ndarray, name: Hashable) -> Any:
+    """
+    Returns the data ``name`` assigned to ``image`` (see :func:`assign`), or
+    ``None`` if nothing was assigned.
+    """
+    return _assigned.peek((image,), name)
@@ -0,0 +1,200 @@
+import contextlib
+import threading
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+
+_Key = Tuple[Tuple[int, ...], str]
+
+# The arenas activated by the current thread (see :meth:`BufferArena.activate`)
+_active = threading.local()
+
+
+class BufferArena:
+    """
+    Pool of scratch buffers, which are reused across the evaluation of
+    images of the same shape.
+
+    Scratch buffers are requested by the performance measures using
+    :func:`scratch` (e.g., for binary masks or keys of label pairs, which
+    are only required temporarily). Buffers are looked up by their shape and
+    data type, so that consecutive images of the same shape do not allocate
+    new temporaries.
+
+    A :class:`~segmetrics.study.Study` owns an arena (see
+    :attr:`segmetrics.study.Study.arena`), which is activated while images
+    are evaluated. Pickled arenas (e.g., the arena of a study sent to a
+    worker process) are empty.
+
+    :param max_bytes:
+        The maximum total size of the buffers kept for reuse. Released
+        buffers are dropped (least recently released first) if this size
+        would be exceeded. Use ``None`` for no limit.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = 2 ** 28) -> None:
+
+        #: The maximum total size of the buffers kept for reuse (or ``None``
+        #: for no limit).
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._free: Dict[_Key, List[np.ndarray]] = dict()
+        self._stats = _empty_stats()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return dict(max_bytes=self.max_bytes)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.max_bytes = state['max_bytes']
+        self._lock = threading.Lock()
+        self._free = dict()
+        self._stats = _empty_stats()
+
+    def acquire(self, shape: Sequence[int], dtype: Any) -> np.ndarray:
+        """
+        Returns an uninitialized buffer of the given ``shape`` and ``dtype``,
+        which is either reused or newly allocated.
+
+        The buffer should be returned using :meth:`release` when it is no
+        longer needed.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buffer = free.pop()
+                self._stats['hits'] += 1
+                self._stats['pooled_bytes'] -= buffer.nbytes
+            else:
+                buffer = np.empty(key[0], key[1])
+                self._stats['allocations'] += 1
+                self._stats['allocated_bytes'] += buffer.nbytes
+            self._stats['in_use_bytes'] += buffer.nbytes
+            self._stats['peak_bytes'] = max((
+                self._stats['peak_bytes'],
+                self._stats['in_use_bytes'] + self._stats['pooled_bytes'],
+            ))
+            return buffer
+
+    def release(self, buffer: np.ndarray) -> None:
+        """
+        Returns a buffer obtained by :meth:`acquire` to the arena.
+        """
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            self._stats['in_use_bytes'] -= buffer.nbytes
+            if self.max_bytes is not None and buffer.nbytes > self.max_bytes:
+                self._stats['evictions'] += 1
+                return
+            self._free.setdefault(key, list()).append(buffer)
+            self._free[key] = self._free.pop(key)  # most recently released
+            self._stats['pooled_bytes'] += buffer.nbytes
+            self._evict()
+
+    def _evict(self) -> None:
+        while (
+            self.max_bytes is not None
+            and self._stats['pooled_bytes'] > self.max_bytes
+        ):
+            key = next(iter(self._free))
+            buffer = self._free[key].pop(0)
+            if len(self._free[key]) == 0:
+                del self._free[key]
+            self._stats['pooled_bytes'] -= buffer.nbytes
+            self._stats['evictions'] += 1
+
+    @contextlib.contextmanager
+    def buffer(self, shape: Sequence[int], dtype: Any) -> Iterator[np.ndarray]:
+        """
+        Context manager which acquires a buffer, and releases it on exit.
+        """
+        buffer = self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator['BufferArena']:
+        """
+        Context manager which makes this the arena used by :func:`scratch`
+        in the current thread.
+        """
+        stack = _active.__dict__.setdefault('stack', list())
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+
+    def clear(self) -> None:
+        """
+        Drops all buffers kept for reuse.
+        """
+        with self._lock:
+            self._free.clear()
+            self._stats['pooled_bytes'] = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the allocation statistics of this arena:
+
+        - ``hits``: The number of requests served by reused buffers.
+        - ``allocations``: The number of newly allocated buffers.
+        - ``allocated_bytes``: The total size of the newly allocated buffers.
+        - ``evictions``: The number of released buffers which were dropped
+          due to :attr:`max_bytes`.
+        - ``in_use_bytes``: The total size of the currently acquired buffers.
+        - ``pooled_bytes``: The total size of the buffers kept for reuse.
+        - ``peak_bytes``: The largest total size of the acquired and kept
+          buffers so far.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+def _empty_stats() -> Dict[str, int]:
+    return dict(
+        hits=0,
+        allocations=0,
+        allocated_bytes=0,
+        evictions=0,
+        in_use_bytes=0,
+        pooled_bytes=0,
+        peak_bytes=0,
+    )
+
+
+def active_arena() -> Optional[BufferArena]:
+    """
+    Returns the arena activated by the current thread (or ``None``).
+    """
+    stack = getattr(_active, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def scratch(shape: Sequence[int], dtype: Any) -> Iterator[np.ndarray]:
+    """
+    Context manager which yields an uninitialized scratch buffer of the
+    given ``shape`` and ``dtype``.
+
+    The buffer is drawn from the active arena of the current thread (see
+    :meth:`BufferArena.activate`), or newly allocated if there is none. It
+    must not be used after the context is left.
+    """
+    arena = active_arena()
+    if arena is None:
+        yield np.empty(shape, dtype)
+    else:
+        with arena.buffer(shape, dtype) as buffer:
+            yield buffer
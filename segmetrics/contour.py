@@ -1,13 +1,24 @@
+from __future__ import annotations
+
 from typing import (
     List,
+    Optional,
     Sequence,
+    Tuple,
+    Union,
 )
 
 import numpy as np
 import scipy.ndimage as ndi
-from skimage import morphology as morph
 
+from segmetrics import _cache
+from segmetrics._aux import (
+    chunks,
+    foreground,
+)
+from segmetrics.arena import scratch
 from segmetrics.measure import (
+    AsymmetricMeasureMixin,
     CorrespondanceFunction,
     ImageMeasureMixin,
     Measure,
@@ -17,30 +28,130 @@ from segmetrics.typing import (
     LabelImage,
 )
 
+Spacing = Optional[Tuple[float, ...]]
+
+
+def _ball(ndim: int, radius: int) -> BinaryImage:
+    """
+    Returns the Euclidean ball of the given ``radius`` as a binary
+    structuring element (e.g., a disk for ``ndim=2``).
+    """
+    grid = np.indices((2 * radius + 1,) * ndim) - radius
+    return (grid ** 2).sum(axis=0) <= radius ** 2
+
 
 def _compute_binary_contour(mask: BinaryImage, width: int = 1) -> BinaryImage:
-    dilation = ndi.binary_dilation(mask, morph.disk(width))
-    return np.logical_and(dilation, np.logical_not(mask))
+    with scratch(mask.shape, bool) as dilation:
+        ndi.binary_dilation(mask, _ball(mask.ndim, width), output=dilation)
+        return np.greater(dilation, mask)
+
+
+def _get_contour(image: LabelImage) -> BinaryImage:
+    """
+    Returns the binary contour of the foreground of a label image (cached).
+    """
+    return _cache.get(
+        (image,),
+        'contour',
+        lambda: _compute_binary_contour(foreground(image)),
+    )
+
+
+def _get_contour_distance_map(
+    image: LabelImage,
+    spacing: Spacing = None,
+) -> np.ndarray:
+    """
+    Returns the distance map of the foreground contour of a label image
+    (cached), using the pixel ``spacing`` along each axis (if given).
+    """
+    def compute() -> np.ndarray:
+        indices_shape = (image.ndim,) + image.shape
+        with scratch(image.shape, bool) as outside:
+            np.logical_not(_get_contour(image), out=outside)
+
+            # The feature transform is computed anyway, so it is written to a
+            # scratch buffer instead of a temporary array
+            with scratch(indices_shape, np.int32) as indices:
+                return ndi.distance_transform_edt(
+                    outside,
+                    sampling=spacing,
+                    return_indices=True,
+                    indices=indices,
+                )
+    return _cache.get((image,), ('contour_distance_map', spacing), compute)
+
+
+def _get_sorted_contour_distances(
+    expected: LabelImage,
+    actual: LabelImage,
+    spacing: Spacing = None,
+) -> np.ndarray:
+    """
+    Returns the sorted distances of the contour of ``actual`` to the contour
+    of ``expected`` (cached, so that different quantiles can be obtained from
+    a single computation).
+    """
+    return _cache.get(
+        (expected, actual),
+        ('sorted_contour_distances', spacing),
+        lambda: np.sort(
+            _get_contour_distance_map(expected, spacing)[_get_contour(actual)]
+        ),
+    )
+
+
+def _get_boundary_band(
+    image: LabelImage,
+    width: float,
+    spacing: Spacing = None,
+) -> BinaryImage:
+    """
+    Returns the band of the foreground of a label image, which is within
+    distance ``width`` of the foreground contour (cached).
+    """
+    def compute() -> BinaryImage:
+        with scratch(image.shape, bool) as near:
+            np.less_equal(
+                _get_contour_distance_map(image, spacing),
+                width,
+                out=near,
+            )
+            return np.logical_and(foreground(image), near)
+    return _cache.get((image,), ('boundary_band', width, spacing), compute)
 
 
-def _quantile_max(quantile: float, values: Sequence[float]) -> float:
+def _quantile_max(
+    quantile: float,
+    values: Union[Sequence[float], np.ndarray],
+    is_sorted: bool = False,
+) -> float:
     if quantile == 1:
         return np.max(values)
     else:
-        values = list(sorted(values))
+        if not is_sorted:
+            values = np.sort(values)
         return values[int(quantile * (len(values) - 1))]
 
 
-class ContourMeasure(ImageMeasureMixin, Measure):
+class ContourMeasure(AsymmetricMeasureMixin, ImageMeasureMixin, Measure):
     """
     Defines a performance measure which is based on the spatial distances of
     binary volumes (images).
+
+    :param spacing:
+        The pixel spacing along each axis (e.g., the voxel size of
+        anisotropic volumes), which is used for the computation of the
+        distances, or ``None`` for unit spacing.
     """
 
+    crop_invariant = True
+
     def __init__(
         self,
         *args,
         correspondance_function: CorrespondanceFunction = 'min',
+        spacing: Optional[Sequence[float]] = None,
         **kwargs,
     ) -> None:
         super().__init__(
@@ -48,6 +159,9 @@ class ContourMeasure(ImageMeasureMixin, Measure):
             correspondance_function=correspondance_function,
             **kwargs,
         )
+        self.spacing: Spacing = None
+        if spacing is not None:
+            self.spacing = tuple(float(s) for s in spacing)
 
 
 class Hausdorff(ContourMeasure):
@@ -73,35 +187,69 @@ class Hausdorff(ContourMeasure):
       distance." International Journal of computer vision 24.3 (1997): 251-270.
     """
 
+    state_attributes = ContourMeasure.state_attributes + (
+        'expected_contour',
+        'expected_contour_distance_map',
+    )
+
     def __init__(self, quantile: float = 1, **kwargs):
         super().__init__(**kwargs)
         assert 0 < quantile <= 1
         self.quantile = quantile
 
     def set_expected(self, expected: LabelImage) -> None:
-        self.expected_contour = _compute_binary_contour(expected > 0)
-        self.expected_contour_distance_map = ndi.distance_transform_edt(
-            np.logical_not(self.expected_contour)
+        super().set_expected(expected)
+        self.expected_contour = _get_contour(expected)
+        self.expected_contour_distance_map = _get_contour_distance_map(
+            expected,
+            self.spacing,
         )
 
     def compute(self, actual: LabelImage) -> List[float]:
-        actual_contour = _compute_binary_contour(actual > 0)
+        actual_contour = _get_contour(actual)
         if not self.expected_contour.any() or not actual_contour.any():
             return []
 
         return [
-            self._quantile_max(
-                self.expected_contour_distance_map[actual_contour]
+            _quantile_max(
+                self.quantile,
+                _get_sorted_contour_distances(
+                    self.expected,
+                    actual,
+                    self.spacing,
+                ),
+                is_sorted=True,
             )
         ]
 
+    @classmethod
+    def sweep(cls, quantiles: Sequence[float], **kwargs) -> List[Hausdorff]:
+        """
+        Returns a Hausdorff distance measure for each of the given
+        ``quantiles``.
+
+        The sorted contour distances are computed only once per sample and
+        are shared by all returned measures, so that each quantile only adds
+        negligible costs. Sharing relies on the cache of intermediate
+        results, which is tied to the images of a single call of
+        :meth:`Study.process <segmetrics.study.Study.process>`. Each measure
+        is reported under its own name when added to a
+        :class:`~segmetrics.study.Study`.
+
+        Keyword arguments are passed through to the constructor.
+        """
+        return [cls(quantile=quantile, **kwargs) for quantile in quantiles]
+
     def default_name(self) -> str:
         if self.quantile == 1:
             return 'HSD'
         else:
             return f'HSD (Q={self.quantile:g})'
 
-    def _quantile_max(self, values: Sequence[float]) -> float:
+    def _quantile_max(
+        self,
+        values: Union[Sequence[float], np.ndarray],
+    ) -> float:
         return _quantile_max(self.quantile, values)
 
 
@@ -129,19 +277,209 @@ class NSD(ContourMeasure):
     :math:`1`. Lower values correspond to better segmentation performance.
     """
 
+    state_attributes = ContourMeasure.state_attributes + (
+        'expected_binary',
+        'expected_contour',
+        'expected_contour_distance_map',
+        'expected_binary_distance_sum',
+    )
+
     def set_expected(self, expected: LabelImage) -> None:
-        self.expected_binary: BinaryImage = (expected > 0)
-        self.expected_contour = _compute_binary_contour(self.expected_binary)
-        self.expected_contour_distance_map = ndi.distance_transform_edt(
-            np.logical_not(self.expected_contour)
+        super().set_expected(expected)
+        self.expected_binary: BinaryImage = foreground(expected)
+        self.expected_contour = _get_contour(expected)
+        self.expected_contour_distance_map = _get_contour_distance_map(
+            expected,
+            self.spacing,
+        )
+        self.expected_binary_distance_sum = (
+            self.expected_contour_distance_map.sum(where=self.expected_binary)
         )
 
     def compute(self, actual: LabelImage) -> List[float]:
-        actual_binary: BinaryImage = (actual > 0)
-        union         = np.logical_or(self.expected_binary, actual_binary)
-        intersection  = np.logical_and(self.expected_binary, actual_binary)
-        denominator   = self.expected_contour_distance_map[union].sum()
-        nominator     = self.expected_contour_distance_map[
-            np.logical_and(union, np.logical_not(intersection))
-        ].sum()
-        return [nominator / (0. + denominator)]
+        actual_binary: BinaryImage = foreground(actual)
+        ref_sum = self.expected_binary_distance_sum
+        res_sum = self.expected_contour_distance_map.sum(where=actual_binary)
+
+        # The mask of the intersection is only required chunk-wise
+        distance_map = self.expected_contour_distance_map
+        intersection_sum = 0.
+        for chunk in chunks(actual.shape):
+            with scratch(distance_map[chunk].shape, bool) as intersection:
+                np.logical_and(
+                    self.expected_binary[chunk],
+                    actual_binary[chunk],
+                    out=intersection,
+                )
+                intersection_sum += distance_map[chunk].sum(
+                    where=intersection,
+                )
+        denominator   = ref_sum + res_sum - intersection_sum
+        nominator     = ref_sum + res_sum - 2 * intersection_sum
+        return [max((nominator, 0.)) / (0. + denominator)]
+
+
+class BoundaryF1(ContourMeasure):
+    r"""
+    Defines the boundary F1 score of two binary images.
+
+    Let :math:`\partial R` be the contour of the ground truth segmentation,
+    and :math:`\partial S` the contour of the segmentation result. The
+    boundary precision :math:`P` is the fraction of the pixels of
+    :math:`\partial S` within the distance :math:`d` of :math:`\partial R`,
+    and the boundary recall :math:`R` is the fraction of the pixels of
+    :math:`\partial R` within the distance :math:`d` of :math:`\partial S`.
+    Then, the boundary F1 score is defined as
+
+    .. math:: \mathrm{BF1} = \frac{2 \cdot P \cdot R}{P + R}.
+
+    The boundary F1 score attains values between :math:`0` and :math:`1`.
+    Higher values correspond to better segmentation performance.
+
+    The contour distances are shared with :class:`Hausdorff` (and its
+    reversed and symmetric variants), so that using both measures adds only
+    negligible costs.
+
+    :param tolerance:
+        The distance :math:`d` (in pixels, or in the units of the
+        ``spacing``, if given), up to which contour pixels are considered as
+        correctly detected.
+
+    References:
+
+    - G\. Csurka, D. Larlus, and F. Perronnin, "What is a good evaluation
+      measure for semantic segmentation?" in Proc. British Machine Vision
+      Conf., 2013, pp. 32.1-32.11.
+    """
+
+    def __init__(
+        self,
+        tolerance: float = 2,
+        correspondance_function: CorrespondanceFunction = 'max',
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            correspondance_function=correspondance_function,
+            **kwargs,
+        )
+        assert tolerance >= 0
+        self.tolerance = tolerance
+
+    def compute(self, actual: LabelImage) -> List[float]:
+        precision = self._fraction(
+            _get_sorted_contour_distances(
+                self.expected,
+                actual,
+                self.spacing,
+            ),
+        )
+        recall = self._fraction(
+            _get_sorted_contour_distances(
+                actual,
+                self.expected,
+                self.spacing,
+            ),
+        )
+        if precision + recall > 0:
+            return [2 * precision * recall / (precision + recall)]
+        else:
+            return [0.]
+
+    def _fraction(self, sorted_distances: np.ndarray) -> float:
+        """
+        Returns the fraction of the sorted contour distances which are within
+        the tolerance.
+        """
+        if len(sorted_distances) == 0:
+            return 1.  # result of zero/zero division
+        hits = np.searchsorted(sorted_distances, self.tolerance, side='right')
+        return hits / len(sorted_distances)
+
+    def default_name(self) -> str:
+        if self.tolerance == 2:
+            return 'BF1'
+        else:
+            return f'BF1 (d={self.tolerance:g})'
+
+
+class BoundaryIoU(ContourMeasure):
+    r"""
+    Defines the boundary intersection over union of two binary images.
+
+    Let :math:`R_d` and :math:`S_d` be the pixels of the ground truth
+    segmentation and of the segmentation result, respectively, which are
+    within the distance :math:`d` of the respective contour (i.e. the inner
+    boundary bands of width :math:`d`). Then, the boundary IoU is defined as
+
+    .. math:: \mathrm{BIoU} = \frac
+        {\left|R_d \cap S_d\right|}
+        {\left|R_d \cup S_d\right|}.
+
+    The boundary IoU attains values between :math:`0` and :math:`1`. Higher
+    values correspond to better segmentation performance. The boundary bands
+    are derived from the contour distance maps, which are shared with
+    :class:`Hausdorff` and :class:`NSD`.
+
+    :param width:
+        The width :math:`d` of the boundary bands (in pixels, or in the units
+        of the ``spacing``, if given).
+
+    References:
+
+    - B\. Cheng, R. Girshick, P. Dollár, A. C. Berg, and A. Kirillov,
+      "Boundary IoU: Improving object-centric image segmentation evaluation,"
+      in Proc. IEEE Conf. Comput. Vis. Pattern Recognit., 2021,
+      pp. 15334-15342.
+    """
+
+    state_attributes = ContourMeasure.state_attributes + (
+        'expected_band',
+        'expected_band_area',
+    )
+
+    def __init__(
+        self,
+        width: float = 2,
+        correspondance_function: CorrespondanceFunction = 'max',
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            correspondance_function=correspondance_function,
+            **kwargs,
+        )
+        assert width > 0
+        self.width = width
+
+    def set_expected(self, expected: LabelImage) -> None:
+        super().set_expected(expected)
+        self.expected_band = _get_boundary_band(
+            expected,
+            self.width,
+            self.spacing,
+        )
+        self.expected_band_area = np.count_nonzero(self.expected_band)
+
+    def compute(self, actual: LabelImage) -> List[float]:
+        actual_band = _get_boundary_band(actual, self.width, self.spacing)
+        with scratch(actual_band.shape, bool) as intersection_band:
+            np.logical_and(
+                self.expected_band,
+                actual_band,
+                out=intersection_band,
+            )
+            intersection = np.count_nonzero(intersection_band)
+        union = (
+            self.expected_band_area
+            + np.count_nonzero(actual_band)
+            - intersection
+        )
+        if union > 0:
+            return [intersection / union]
+        else:
+            return [1.]  # result of zero/zero division
+
+    def default_name(self) -> str:
+        if self.width == 2:
+            return 'BIoU'
+        else:
+            return f'BIoU (d={self.width:g})'
@@ -3,6 +3,7 @@
 import numpy as np
 from deprecated import deprecated
 
+from segmetrics._aux import object_index
 from segmetrics.measure import Measure
 
 
@@ -16,7 +17,8 @@ class COCOmAP(Measure):
        The implementation of this measure has not undergone any testing or
        development since version 1.0, since the contributor of this measure is
        not involved in segmetrics any longer. This measure will be removed in a
-       future version, unless someone finds the time to maintain it.
+       future version, unless someone finds the time to maintain it. Use
+       :class:`segmetrics.detection.AveragePrecision` instead.
     """
 
     @deprecated(version='1.0', reason='This measure will be removed in a future version, unless someone finds the time to maintain it.')
@@ -36,11 +38,16 @@ class COCOmAP(Measure):
         self.min_ref_size = min_ref_size
 
     def _find_match_for_label(self, ref, actual, ref_label, iou_threshold):
-        ref_cc = (ref == ref_label)
-        for actual_candidate_label in set(actual[ref_cc]) - {0}:
-            actual_candidate_cc = (actual == actual_candidate_label)
-            overlap = float(np.logical_and(actual_candidate_cc, ref_cc).sum())
-            union = np.logical_or(ref_cc, actual_candidate_cc).sum()
+        ref_index = object_index(ref)
+        if ref_label not in ref_index.slices:
+            return False
+        ref_slice, ref_cc = ref_index.mask(ref_label)
+        candidate_labels, overlaps = np.unique(actual[ref_slice][ref_cc], return_counts=True)
+        for actual_candidate_label, overlap in zip(candidate_labels, overlaps):
+            if actual_candidate_label == 0:
+                continue
+            overlap = float(overlap)
+            union = ref_index.area(ref_label) + object_index(actual).area(actual_candidate_label) - overlap
             if union == 0:
                 continue
             elif overlap/union > iou_threshold:
@@ -62,8 +69,8 @@ class COCOmAP(Measure):
                     fp += 1
 
             for ref_label in range(1, self.expected.max() + 1):
-                ref_cc = (self.expected == ref_label)  # the reference connected component
-                ref_cc_size = ref_cc.sum()
+                ref_index = object_index(self.expected)
+                ref_cc_size = ref_index.area(ref_label) if ref_label in ref_index.slices else 0
                 if ref_cc_size < self.min_ref_size: continue
                 found_match = self._find_match_for_label(self.expected, actual, ref_label, iou_threshold)
                 if found_match:                    
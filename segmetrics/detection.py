@@ -3,16 +3,22 @@
     Dict,
     List,
     Optional,
+    Sequence,
     Set,
+    Tuple,
 )
 
 import numpy as np
 
-from segmetrics.measure import Measure
-from segmetrics.typing import (
-    BinaryImage,
-    LabelImage,
+from segmetrics import _cache
+from segmetrics._aux import object_index
+from segmetrics.matching import matching
+from segmetrics.measure import (
+    Measure,
+    MultiMeasure,
 )
+from segmetrics.overlap import overlap_table
+from segmetrics.typing import LabelImage
 
 
 def _assign(
@@ -30,21 +36,25 @@ def _compute_seg_by_ref_assignments(
     ref: LabelImage,
     include_background: bool = False,
 ) -> Dict[int, Set[int]]:
-    seg_by_ref: Dict[int, Set[int]] = dict()
-
-    if include_background:
-        seg_by_ref[0] = set()
-
-    for seg_label in range(1, seg.max() + 1):
-        seg_cc: BinaryImage = (seg == seg_label)
-
-        if not seg_cc.any():
-            continue
-
-        ref_label = np.bincount(ref[seg_cc]).argmax()
-        _assign(seg_by_ref, ref_label, seg_label)
-
-    return seg_by_ref
+    def compute() -> Dict[int, Set[int]]:
+        seg_by_ref: Dict[int, Set[int]] = {0: set()}
+        seg_index = object_index(seg)
+        for seg_label in seg_index.labels:
+            seg_slice, seg_cc = seg_index.mask(seg_label)
+            ref_labels, overlaps = np.unique(
+                ref[seg_slice][seg_cc],
+                return_counts=True,
+            )
+            ref_label = ref_labels[overlaps.argmax()]
+            _assign(seg_by_ref, ref_label, seg_label)
+        return seg_by_ref
+
+    # The assignments are cached with the background included
+    seg_by_ref = _cache.get((seg, ref), 'seg_by_ref_assignments', compute)
+    if include_background or len(seg_by_ref[0]) > 0:
+        return seg_by_ref
+    else:
+        return {key: seg_by_ref[key] for key in seg_by_ref if key > 0}
 
 
 def _compute_ref_by_seg_assignments(
@@ -111,9 +121,12 @@ class FalsePositive(Measure):
       algorithms," in Proc. Int. Symp. Biomed. Imag., 2009, pp. 518–521.
     """
 
-    def __init__(self, **kwargs) -> None:
-        super().__init__(**kwargs)
-        self.result: Optional[LabelImage] = None
+    output_attributes = ('result',)
+
+    #: Label image of the spurious objects of the last evaluated segmentation
+    #: result (not pickled, see
+    #: :attr:`~segmetrics.measure.SampleStateMixin.output_attributes`).
+    result: Optional[LabelImage] = None
 
     def compute(self, actual: LabelImage) -> List[float]:
         seg_by_ref = _compute_seg_by_ref_assignments(
@@ -122,8 +135,10 @@ class FalsePositive(Measure):
             include_background=True,
         )
         self.result = np.zeros_like(actual)
+        seg_index = object_index(actual)
         for seg_label in seg_by_ref[0]:
-            self.result[actual == seg_label] = seg_label
+            seg_slice, seg_cc = seg_index.mask(seg_label)
+            self.result[seg_slice][seg_cc] = seg_label
         return [len(seg_by_ref[0])]
 
     def default_name(self) -> str:
@@ -141,9 +156,12 @@ class FalseNegative(Measure):
       algorithms," in Proc. Int. Symp. Biomed. Imag., 2009, pp. 518–521.
     """
 
-    def __init__(self, **kwargs) -> None:
-        super().__init__(**kwargs)
-        self.result: Optional[LabelImage] = None
+    output_attributes = ('result',)
+
+    #: Label image of the missing objects of the last evaluated segmentation
+    #: result (not pickled, see
+    #: :attr:`~segmetrics.measure.SampleStateMixin.output_attributes`).
+    result: Optional[LabelImage] = None
 
     def compute(self, actual: LabelImage) -> List[float]:
         ref_by_seg = _compute_ref_by_seg_assignments(
@@ -152,9 +170,345 @@ class FalseNegative(Measure):
             include_background=True,
         )
         self.result = np.zeros_like(self.expected)
+        ref_index = object_index(self.expected)
         for ref_label in ref_by_seg[0]:
-            self.result[self.expected == ref_label] = ref_label
+            ref_slice, ref_cc = ref_index.mask(ref_label)
+            self.result[ref_slice][ref_cc] = ref_label
         return [len(ref_by_seg[0])]
 
     def default_name(self) -> str:
         return 'Missing'
+
+
+class DetectionErrors(MultiMeasure):
+    r"""
+    Yields the numbers of falsely split objects (output ``Split``, see
+    :class:`FalseSplit`), falsely merged objects (output ``Merge``, see
+    :class:`FalseMerge`), spurious objects (output ``Spurious``, see
+    :class:`FalsePositive`), and missing objects (output ``Missing``, see
+    :class:`FalseNegative`) from a single computation of the object
+    assignments in each direction.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.add_output('Split')
+        self.add_output('Merge')
+        self.add_output('Spurious')
+        self.add_output('Missing')
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[float]]:
+        seg_by_ref = _compute_seg_by_ref_assignments(
+            actual,
+            self.expected,
+            include_background=True,
+        )
+        ref_by_seg = _compute_ref_by_seg_assignments(
+            actual,
+            self.expected,
+            include_background=True,
+        )
+        return {
+            'Split': [
+                sum(len(seg_by_ref[ref_label]) > 1
+                    for ref_label in seg_by_ref.keys() if ref_label > 0)
+            ],
+            'Merge': [
+                sum(len(ref_by_seg[seg_label]) > 1
+                    for seg_label in ref_by_seg.keys() if seg_label > 0)
+            ],
+            'Spurious': [len(seg_by_ref[0])],
+            'Missing': [len(ref_by_seg[0])],
+        }
+
+
+class AveragePrecision(Measure):
+    r"""
+    Defines the average precision for a range of IoU thresholds (mAP).
+
+    For an IoU threshold :math:`t`, a ground truth object :math:`R` and a
+    segmented object :math:`S` are considered matching if and only if
+    :math:`\left|R \cap S\right| / \left|R \cup S\right| > t`. Since only
+    thresholds :math:`t \geq 0.5` are permitted, each object has at most one
+    matching object. The matching objects are the true positives
+    :math:`\mathrm{TP}_t`, the remaining segmented objects are the false
+    positives :math:`\mathrm{FP}_t`, and the remaining ground truth objects
+    are the false negatives :math:`\mathrm{FN}_t`. Then, the average
+    precision is defined as
+
+    .. math:: \mathrm{mAP} = \frac{1}{\left|T\right|} \sum_{t \in T}
+        \frac
+        {\mathrm{TP}_t}
+        {\mathrm{TP}_t + \mathrm{FP}_t + \mathrm{FN}_t},
+
+    where :math:`T` is the set of IoU thresholds. The measure attains values
+    between :math:`0` and :math:`1`. Higher values correspond to better
+    performance. This is the measure used in the 2018 Data Science Bowl.
+
+    The IoU values are computed once from the sparse overlap counts of the
+    objects, and all thresholds are evaluated at once. The numbers of true
+    positives, false positives, and false negatives are accumulated across
+    all images by the :meth:`postprocess` method.
+
+    :param iou_thresholds:
+        The IoU thresholds (each must be at least :math:`0.5`).
+    """
+
+    def __init__(
+        self,
+        iou_thresholds: Sequence[float] = (
+            0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95,
+        ),
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        assert len(iou_thresholds) > 0
+        assert min(iou_thresholds) >= 0.5, (
+            'matching objects are only unique for IoU thresholds of 0.5 or'
+            ' larger'
+        )
+        self.iou_thresholds = np.asarray(iou_thresholds, float)
+
+    def compute(
+        self,
+        actual: LabelImage,
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Computes the numbers of true positives, false positives, and false
+        negatives for each IoU threshold.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of these numbers.
+        """
+        table = overlap_table(self.expected, actual)
+        iou = table.iou()[2]
+        matches = np.sort(iou[iou > 0.5])
+        tp = len(matches) - np.searchsorted(
+            matches,
+            self.iou_thresholds,
+            side='right',
+        )
+        fp = table.num_seg_objects - tp
+        fn = table.num_ref_objects - tp
+        return [(tp, fp, fn)]
+
+    def compute_precisions(
+        self,
+        values: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    ) -> np.ndarray:
+        """
+        Returns the precision for each IoU threshold, based on the numbers of
+        true positives, false positives, and false negatives accumulated for
+        a list of images.
+        """
+        tp, fp, fn = (np.sum(counts, axis=0) for counts in zip(*values))
+        denominator = tp + fp + fn
+        return np.divide(
+            tp,
+            denominator,
+            out=np.ones(len(self.iou_thresholds)),  # result of zero/zero
+            where=(denominator > 0),
+        )
+
+    def postprocess(
+        self,
+        values: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    ) -> List[float]:
+        if len(values) == 0:
+            return list()
+        else:
+            return [float(np.mean(self.compute_precisions(values)))]
+
+    def default_name(self) -> str:
+        if len(self.iou_thresholds) == 1:
+            return f'AP@{self.iou_thresholds[0]:g}'
+        else:
+            return 'mAP'
+
+
+class MatchingMeasure(Measure):
+    """
+    Defines a performance measure which is based on a globally optimal
+    one-to-one matching of the ground truth and the segmented objects (see
+    :func:`segmetrics.matching.match_objects`).
+
+    The numbers of true positives (matched objects), false positives
+    (unmatched segmented objects), false negatives (unmatched ground truth
+    objects), and the sum of the IoU values of the matched objects are
+    accumulated across all images by the :meth:`postprocess` method. The
+    matching is shared by all measures using the same IoU threshold.
+
+    :param iou_threshold:
+        Only objects with an IoU larger than this threshold are matched.
+    """
+
+    def __init__(self, iou_threshold: float = 0.5, **kwargs) -> None:
+        super().__init__(**kwargs)
+        assert 0 <= iou_threshold < 1
+        self.iou_threshold = iou_threshold
+
+    def compute(
+        self,
+        actual: LabelImage,
+    ) -> List[Tuple[int, int, int, float]]:
+        """
+        Computes the numbers of true positives, false positives, false
+        negatives, and the sum of the IoU values of the matched objects.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of these values.
+        """
+        iou = matching(self.expected, actual, self.iou_threshold)[2]
+        table = overlap_table(self.expected, actual)
+        tp = len(iou)
+        fp = table.num_seg_objects - tp
+        fn = table.num_ref_objects - tp
+        return [(tp, fp, fn, float(iou.sum()))]
+
+    def postprocess(
+        self,
+        values: List[Tuple[int, int, int, float]],
+    ) -> List[float]:
+        if len(values) == 0:
+            return list()
+        else:
+            tp, fp, fn, iou_sum = (sum(counts) for counts in zip(*values))
+            return [self.compute_value(tp, fp, fn, iou_sum)]
+
+    def compute_value(
+        self,
+        tp: int,
+        fp: int,
+        fn: int,
+        iou_sum: float,
+    ) -> float:
+        """
+        Computes the performance value from the numbers of true positives,
+        false positives, false negatives, and the sum of the IoU values of the
+        matched objects.
+        """
+        return NotImplemented
+
+    def _name_suffix(self) -> str:
+        return f'@{self.iou_threshold:g}'
+
+
+class F1Score(MatchingMeasure):
+    r"""
+    Defines the object-level F1 score.
+
+    The F1 score is the harmonic mean of the object-level precision and
+    recall,
+
+    .. math:: \mathrm{F1} = \frac
+        {2 \cdot \mathrm{TP}}
+        {2 \cdot \mathrm{TP} + \mathrm{FP} + \mathrm{FN}},
+
+    where the true positives are the objects matched by a globally optimal
+    one-to-one matching (see :class:`MatchingMeasure`). The F1 score attains
+    values between :math:`0` and :math:`1`. Higher values correspond to
+    better performance.
+    """
+
+    def compute_value(
+        self,
+        tp: int,
+        fp: int,
+        fn: int,
+        iou_sum: float,
+    ) -> float:
+        denominator = 2 * tp + fp + fn
+        return 2 * tp / denominator if denominator > 0 else 1.
+
+    def default_name(self) -> str:
+        return 'F1' + self._name_suffix()
+
+
+class Precision(MatchingMeasure):
+    r"""
+    Defines the object-level precision,
+    :math:`\mathrm{TP} / \left(\mathrm{TP} + \mathrm{FP}\right)`.
+
+    The true positives are the objects matched by a globally optimal
+    one-to-one matching (see :class:`MatchingMeasure`).
+    """
+
+    def compute_value(
+        self,
+        tp: int,
+        fp: int,
+        fn: int,
+        iou_sum: float,
+    ) -> float:
+        return tp / (tp + fp) if tp + fp > 0 else 1.
+
+    def default_name(self) -> str:
+        return 'Precision' + self._name_suffix()
+
+
+class Recall(MatchingMeasure):
+    r"""
+    Defines the object-level recall,
+    :math:`\mathrm{TP} / \left(\mathrm{TP} + \mathrm{FN}\right)`.
+
+    The true positives are the objects matched by a globally optimal
+    one-to-one matching (see :class:`MatchingMeasure`).
+    """
+
+    def compute_value(
+        self,
+        tp: int,
+        fp: int,
+        fn: int,
+        iou_sum: float,
+    ) -> float:
+        return tp / (tp + fn) if tp + fn > 0 else 1.
+
+    def default_name(self) -> str:
+        return 'Recall' + self._name_suffix()
+
+
+class PanopticQuality(MatchingMeasure):
+    r"""
+    Defines the panoptic quality (PQ) proposed by Kirillov et al. (2019).
+
+    The panoptic quality is the product of the segmentation quality (SQ),
+    which is the mean IoU of the matched objects, and the recognition quality
+    (RQ), which is the object-level F1 score,
+
+    .. math:: \mathrm{PQ} =
+        \underbrace{\frac
+            {\sum_{(R, S) \in \mathrm{TP}} \mathrm{IoU}(R, S)}
+            {\left|\mathrm{TP}\right|}
+        }_{\mathrm{SQ}}
+        \cdot
+        \underbrace{\frac
+            {\left|\mathrm{TP}\right|}
+            {\left|\mathrm{TP}\right| + \frac{1}{2}\left|\mathrm{FP}\right|
+            + \frac{1}{2}\left|\mathrm{FN}\right|}
+        }_{\mathrm{RQ}}.
+
+    The true positives are the objects matched by a globally optimal
+    one-to-one matching (see :class:`MatchingMeasure`). The panoptic quality
+    attains values between :math:`0` and :math:`1`. Higher values correspond
+    to better performance.
+
+    References:
+
+    - A\. Kirillov, K. He, R. Girshick, C. Rother, and P. Dollár, "Panoptic
+      segmentation," in Proc. IEEE/CVF Conf. Comput. Vis. Pattern Recognit.,
+      2019, pp. 9404–9413.
+    """
+
+    def compute_value(
+        self,
+        tp: int,
+        fp: int,
+        fn: int,
+        iou_sum: float,
+    ) -> float:
+        denominator = tp + 0.5 * fp + 0.5 * fn
+        return iou_sum / denominator if denominator > 0 else 1.
+
+    def default_name(self) -> str:
+        return 'PQ' + self._name_suffix()
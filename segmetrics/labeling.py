@@ -0,0 +1,155 @@
+import concurrent.futures
+import itertools
+import os
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+from scipy import ndimage
+
+from segmetrics.typing import (
+    Image,
+    LabelImage,
+)
+
+#: The minimum number of pixels of a tile (see :func:`label`), so that small
+#: images are not split into more tiles than worth the costs of merging.
+MIN_TILE_SIZE: int = 2 ** 18
+
+
+def label(
+    image: Image,
+    neighbors: int = 4,
+    num_threads: Optional[int] = None,
+) -> LabelImage:
+    """
+    Labels the connected components of the foreground of an image.
+
+    The image is split along the first axis into one tile per thread (but
+    tiles of at least :data:`MIN_TILE_SIZE` pixels), which are labeled in
+    parallel using ``scipy.ndimage.label`` (which releases the GIL). The
+    components which touch across the seams between adjacent tiles are then
+    merged by computing the connected components of the graph of touching
+    tile labels. The result is identical to labeling the whole image at once,
+    including the order of the labels.
+
+    :param image:
+        The image to be labeled (non-zero pixels are foreground).
+
+    :param neighbors:
+        The connectivity used to determine the connected components (``4``
+        or ``8``). For volumetric images, ``8`` also connects pixels which
+        are diagonally adjacent within a plane (but not across three axes).
+
+    :param num_threads:
+        The number of threads used to label the tiles (defaults to the
+        number of CPUs).
+
+    :returns:
+        The labeled image, where the background is labeled with 0 and the
+        connected components are labeled from 1 to :math:`n` (in raster
+        order), using the smallest sufficient unsigned integer data type.
+    """
+    assert neighbors in (4, 8)
+    connectivity = 1 if neighbors == 4 else 2
+    structure = ndimage.generate_binary_structure(image.ndim, connectivity)
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    tiles = _tiles(image.shape, num_threads)
+    num_threads = len(tiles)
+
+    def label_tile(tile: slice) -> Tuple[np.ndarray, int]:
+        tile_labels, num_labels = ndimage.label(image[tile], structure)
+        return tile_labels.astype(np.min_scalar_type(num_labels)), num_labels
+
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        results = list(executor.map(label_tile, tiles))
+        tile_labels = [result[0] for result in results]
+        offsets = np.cumsum([0] + [result[1] for result in results])
+        del results
+        if len(tiles) == 1:
+            return tile_labels[0]
+
+        # Merge the labels across the seams between adjacent tiles
+        lut = _merge_seams(tile_labels, offsets, connectivity)
+        dtype = np.min_scalar_type(lut.max(initial=0))
+        lut = lut.astype(dtype)
+        labeled = np.empty(image.shape, dtype)
+
+        def write_tile(tile_idx: int) -> None:
+            tile_lut = lut[offsets[tile_idx]:offsets[tile_idx + 1] + 1].copy()
+            tile_lut[0] = 0
+            tile_lut.take(tile_labels[tile_idx], out=labeled[tiles[tile_idx]])
+
+        list(executor.map(write_tile, range(len(tiles))))
+    return labeled
+
+
+def _tiles(shape: Tuple[int, ...], num_threads: int) -> List[slice]:
+    """
+    Returns the slices along the first axis, which split an image of the
+    given ``shape`` into at most ``num_threads`` tiles of about equal size,
+    each of at least :data:`MIN_TILE_SIZE` pixels (or of a single slice).
+    """
+    if len(shape) == 0 or shape[0] == 0:
+        return [slice(None)]
+    size = int(np.prod(shape))
+    num_tiles = min((num_threads, size // max((MIN_TILE_SIZE, 1)), shape[0]))
+    bounds = np.linspace(0, shape[0], max((num_tiles, 1)) + 1).astype(int)
+    return [slice(start, stop) for start, stop in zip(bounds, bounds[1:])]
+
+
+def _merge_seams(
+    tile_labels: List[np.ndarray],
+    offsets: np.ndarray,
+    connectivity: int,
+) -> np.ndarray:
+    """
+    Determines the merged label of each tile label (tile labels are offset
+    by the number of labels of the preceding tiles).
+
+    :returns:
+        The merged labels, indexed by the offset tile labels (0 for the
+        background).
+    """
+    num_labels = int(offsets[-1])
+    if len(tile_labels) == 1:
+        return np.arange(num_labels + 1)
+
+    # Pixels of adjacent tiles are connected if they are adjacent along the
+    # first axis, and at most ``connectivity - 1`` of the remaining
+    # coordinates differ (by one)
+    ndim = tile_labels[0].ndim
+    shifts = [
+        shift for shift in itertools.product((-1, 0, 1), repeat=ndim - 1)
+        if np.count_nonzero(shift) <= connectivity - 1
+    ]
+    pairs: List[Tuple[np.ndarray, np.ndarray]] = list()
+    for tile_idx in range(1, len(tile_labels)):
+        last = tile_labels[tile_idx - 1][-1]
+        first = tile_labels[tile_idx][0]
+        for shift in shifts:
+            last_slab = last[tuple(slice(max(-s, 0), None) for s in shift)]
+            first_slab = first[tuple(slice(max(s, 0), None) for s in shift)]
+            last_slab = last_slab[tuple(slice(n) for n in first_slab.shape)]
+            first_slab = first_slab[tuple(slice(n) for n in last_slab.shape)]
+            touching = np.logical_and(last_slab > 0, first_slab > 0)
+            pairs.append((
+                last_slab[touching] + offsets[tile_idx - 1],
+                first_slab[touching] + offsets[tile_idx],
+            ))
+    ref = np.concatenate([pair[0] for pair in pairs]).astype(np.intp)
+    seg = np.concatenate([pair[1] for pair in pairs]).astype(np.intp)
+
+    # The components are numbered in the order of their smallest tile
+    # label, which preserves the raster order (the background is node 0)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(ref), bool), (ref, seg)),
+        shape=(num_labels + 1, num_labels + 1),
+    )
+    return scipy.sparse.csgraph.connected_components(graph, directed=False)[1]
@@ -0,0 +1,134 @@
+from typing import Tuple
+
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from segmetrics import _cache
+from segmetrics.overlap import (
+    OverlapTable,
+    overlap_table,
+)
+from segmetrics.typing import LabelImage
+
+
+def match_objects(
+    table: OverlapTable,
+    min_iou: float = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes a globally optimal one-to-one matching of ground truth and
+    segmented objects.
+
+    Only pairs of objects with an intersection over union (IoU) larger than
+    ``min_iou`` are eligible for matching. Among all one-to-one matchings of
+    eligible pairs, the matching with the largest total IoU is determined.
+
+    To this end, the bipartite graph of the eligible pairs is decomposed into
+    its connected components (see :func:`assign_pairs`). Since the
+    components are usually tiny, this remains tractable for large numbers of
+    objects.
+
+    :param table:
+        The overlap table of the ground truth and the segmented objects.
+
+    :param min_iou:
+        Pairs of objects with an IoU of ``min_iou`` or less are not matched.
+
+    :returns:
+        The labels of the matched ground truth objects, the labels of the
+        corresponding segmented objects, and the IoU of each matched pair.
+    """
+    ref, seg, iou = table.iou()
+    eligible = iou > min_iou
+    ref, seg, iou = ref[eligible], seg[eligible], iou[eligible]
+    selected = assign_pairs(ref, seg, iou)
+    return ref[selected], seg[selected], iou[selected]
+
+
+def assign_pairs(
+    ref: np.ndarray,
+    seg: np.ndarray,
+    weights: np.ndarray,
+) -> np.ndarray:
+    """
+    Selects a one-to-one subset of the pairs of ground truth and segmented
+    items, so that the total weight of the selected pairs is maximal.
+
+    To this end, the bipartite graph of the pairs is decomposed into its
+    connected components, and an assignment problem is solved for each
+    component with more than one edge separately (using
+    ``scipy.optimize.linear_sum_assignment``).
+
+    :param ref:
+        The ground truth items (one per pair).
+
+    :param seg:
+        The segmented items (one per pair).
+
+    :param weights:
+        The weight of each pair (must be positive).
+
+    :returns:
+        The indices of the selected pairs.
+    """
+    if len(weights) == 0:
+        return np.zeros(0, np.intp)
+
+    # Build the bipartite graph (ground truth items first)
+    ref_nodes, ref_idx = np.unique(ref, return_inverse=True)
+    seg_nodes, seg_idx = np.unique(seg, return_inverse=True)
+    num_nodes = len(ref_nodes) + len(seg_nodes)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(weights)), (ref_idx, len(ref_nodes) + seg_idx)),
+        shape=(num_nodes, num_nodes),
+    )
+    _, components = scipy.sparse.csgraph.connected_components(
+        graph,
+        directed=False,
+    )
+    edge_components = components[ref_idx]
+    edges_per_component = np.bincount(edge_components)
+
+    # Components with a single edge are selected trivially
+    trivial = edges_per_component[edge_components] == 1
+    selected = [np.flatnonzero(trivial)]
+
+    # Solve an assignment problem for each remaining component
+    edges = np.flatnonzero(~trivial)
+    edges = edges[np.argsort(edge_components[edges], kind='stable')]
+    boundaries = np.flatnonzero(np.diff(edge_components[edges])) + 1
+    for component_edges in np.split(edges, boundaries):
+        if len(component_edges) == 0:
+            continue
+        _, c_ref_idx = np.unique(ref[component_edges], return_inverse=True)
+        _, c_seg_idx = np.unique(seg[component_edges], return_inverse=True)
+        c_weights = np.zeros((c_ref_idx.max() + 1, c_seg_idx.max() + 1))
+        c_edges = np.full(c_weights.shape, -1, np.intp)
+        c_weights[c_ref_idx, c_seg_idx] = weights[component_edges]
+        c_edges[c_ref_idx, c_seg_idx] = component_edges
+        rows, cols = scipy.optimize.linear_sum_assignment(
+            c_weights,
+            maximize=True,
+        )
+        assigned = c_edges[rows, cols]
+        selected.append(assigned[assigned >= 0])
+
+    return np.concatenate(selected)
+
+
+def matching(
+    expected: LabelImage,
+    actual: LabelImage,
+    min_iou: float = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the optimal one-to-one matching of the objects of two label
+    images (cached, see :func:`match_objects`).
+    """
+    return _cache.get(
+        (expected, actual),
+        ('matching', min_iou),
+        lambda: match_objects(overlap_table(expected, actual), min_iou),
+    )
@@ -1,16 +1,30 @@
+import copy
 from typing import (
     Any,
     Callable,
+    Dict,
     List,
     Literal,
+    Optional,
     Protocol,
+    Sequence,
+    Tuple,
     get_args,
     runtime_checkable,
 )
 
+import numpy as np
 from scipy import ndimage
 
-from segmetrics._aux import bbox
+from segmetrics import _cache
+from segmetrics._aux import (
+    ObjectIndex,
+    Slice,
+    bbox,
+    bbox_distances,
+    object_index,
+    relative_slice,
+)
 from segmetrics.typing import LabelImage
 
 AggregationType = Literal[
@@ -89,7 +103,52 @@ class MeasureProtocol(Protocol):
         ...
 
 
-class Measure(MeasureProtocol):
+class SampleStateMixin:
+    """
+    Separates the per-sample state of a performance measure from its
+    configuration.
+
+    The per-sample state (e.g., the ground truth set by ``set_expected``, or
+    full-size artifacts derived from the images) is held by the attributes
+    listed in :attr:`state_attributes`. These are dropped by :meth:`release`
+    and are not pickled, so that the memory footprint and serialization cost
+    of a measure are proportional to its configuration, not to the image
+    size. The ground truth must be set again after the state was released.
+    """
+
+    #: The names of the attributes which hold the per-sample state.
+    state_attributes: Tuple[str, ...] = ('expected',)
+
+    #: The names of the attributes which hold per-sample outputs for
+    #: inspection (e.g., :attr:`segmetrics.detection.FalsePositive.result`).
+    #: Unlike the per-sample state, these are kept by :meth:`release` (until
+    #: the next sample is evaluated), but they are not pickled either.
+    output_attributes: Tuple[str, ...] = ()
+
+    def release(self) -> None:
+        """
+        Releases the per-sample state of this measure.
+        """
+        for name in self.state_attributes:
+            self.__dict__.pop(name, None)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        for name in self.state_attributes + self.output_attributes:
+            state.pop(name, None)
+        return state
+
+
+def release(measure: Any) -> None:
+    """
+    Releases the per-sample state of a performance measure (see
+    :class:`SampleStateMixin`), if the measure supports it.
+    """
+    if isinstance(measure, SampleStateMixin):
+        measure.release()
+
+
+class Measure(SampleStateMixin, MeasureProtocol):
     """
     Defines a performance measure.
 
@@ -101,6 +160,22 @@ class Measure(MeasureProtocol):
         (``object-mean``).
     """
 
+    #: Whether the ground truth can be given by an array of points instead
+    #: of a label image (see
+    #: :meth:`segmetrics.study.Study.set_expected_points`).
+    accepts_points: bool = False
+
+    #: Whether the labels of the images must be retained (e.g., class
+    #: labels), so that a :class:`~segmetrics.study.Study` does not map them
+    #: to a dense range (see :attr:`segmetrics.study.Study.relabel`).
+    retains_labels: bool = False
+
+    #: Whether the values of the measure do not depend on the extent of the
+    #: background around the objects, so that object-based evaluation can
+    #: use a single crop for all candidates of a ground truth object (see
+    #: :class:`ObjectMeasureAdapter`).
+    crop_invariant: bool = False
+
     def __init__(self, aggregation: AggregationType = 'mean') -> None:
         assert aggregation in get_args(AggregationType)
         self._aggregation: AggregationType = aggregation
@@ -122,6 +197,171 @@ class Measure(MeasureProtocol):
         return type(self).__name__
 
 
+@runtime_checkable
+class MultiMeasureProtocol(Protocol):
+    """
+    Type protocol of performance measures which yield several named results
+    (outputs) from a single computation.
+
+    Each output is represented by a measure which implements
+    :class:`MeasureProtocol` (e.g., with its own aggregation), so that the
+    outputs can be used like any other performance measures.
+    """
+
+    def outputs(self) -> Dict[str, MeasureProtocol]:
+        """
+        Returns the outputs of this performance measure, indexed by key.
+        """
+        ...
+
+    def set_expected(self, expected: LabelImage) -> None:
+        """
+        Sets the expected result for evaluation (see
+        :meth:`MeasureProtocol.set_expected`).
+        """
+        ...
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[Any]]:
+        """
+        Computes the values of all outputs (see
+        :meth:`MeasureProtocol.compute`), indexed by key.
+        """
+        ...
+
+
+class MultiMeasure(SampleStateMixin, MultiMeasureProtocol):
+    """
+    Defines a performance measure which yields several named results
+    (outputs) from a single computation.
+
+    The outputs are obtained by the :meth:`outputs` method, and are
+    :class:`OutputMeasure` objects which can be added to a study like any
+    other performance measures (see
+    :meth:`segmetrics.study.Study.add_multi_measure`). The values of all
+    outputs are computed by a single call of :meth:`compute_outputs` for each
+    pair of images.
+
+    :param aggregation:
+        The default aggregation of the outputs (see :class:`Measure`).
+    """
+
+    #: Whether the ground truth can be given by an array of points instead
+    #: of a label image (see :attr:`Measure.accepts_points`).
+    accepts_points: bool = False
+
+    #: Whether the labels of the images must be retained (see
+    #: :attr:`Measure.retains_labels`).
+    retains_labels: bool = False
+
+    def __init__(self, aggregation: AggregationType = 'mean') -> None:
+        assert aggregation in get_args(AggregationType)
+        self.aggregation: AggregationType = aggregation
+        self._outputs: Dict[str, 'OutputMeasure'] = dict()
+
+        # Identifies the results of this measure in the artifact cache
+        self._token = object()
+
+    def add_output(
+        self,
+        key: str,
+        aggregation: Optional[AggregationType] = None,
+        postprocess: Optional[Callable[[List[Any]], List[float]]] = None,
+    ) -> 'OutputMeasure':
+        """
+        Declares an output of this performance measure.
+
+        :param key:
+            The key of the output (also used as its default name).
+
+        :param aggregation:
+            The aggregation of the output, or ``None`` to use the default
+            aggregation of this measure.
+
+        :param postprocess:
+            Function used to postprocess the values of the output (see
+            :meth:`MeasureProtocol.postprocess`), or ``None`` if the values
+            need no postprocessing.
+        """
+        self._outputs[key] = OutputMeasure(
+            self,
+            key,
+            aggregation=aggregation or self.aggregation,
+            postprocess=postprocess,
+        )
+        return self._outputs[key]
+
+    def outputs(self) -> Dict[str, MeasureProtocol]:
+        return dict(self._outputs)
+
+    def set_expected(self, expected: LabelImage) -> None:
+        self.expected = expected
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[Any]]:
+        return NotImplemented
+
+    def compute_output(self, actual: LabelImage, key: str) -> List[Any]:
+        """
+        Returns the values of an output. The values of all outputs are
+        computed at once and cached (while evaluated by a study), until any
+        of the images is released.
+        """
+        return _cache.get(
+            (self.expected, actual),
+            ('outputs', self._token),
+            lambda: self.compute_outputs(actual),
+        )[key]
+
+
+class OutputMeasure(Measure):
+    """
+    Represents one of the outputs of a :class:`MultiMeasure`.
+
+    :param measure:
+        The performance measure which yields the output.
+
+    :param key:
+        The key of the output.
+
+    :param postprocess:
+        Function used to postprocess the values of the output, or ``None``.
+    """
+
+    def __init__(
+        self,
+        measure: MultiMeasure,
+        key: str,
+        postprocess: Optional[Callable[[List[Any]], List[float]]] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.measure = measure
+        self.key = key
+        self.accepts_points = measure.accepts_points
+        self.retains_labels = measure.retains_labels
+        self._postprocess = postprocess
+
+    def set_expected(self, expected: LabelImage) -> None:
+        if getattr(self.measure, 'expected', None) is not expected:
+            self.measure.set_expected(expected)
+        super().set_expected(expected)
+
+    def compute(self, actual: LabelImage) -> List[Any]:
+        return self.measure.compute_output(actual, self.key)
+
+    def release(self) -> None:
+        super().release()
+        release(self.measure)
+
+    def postprocess(self, values: List[Any]) -> List[float]:
+        if self._postprocess is None:
+            return values
+        else:
+            return self._postprocess(values)
+
+    def default_name(self) -> str:
+        return self.key
+
+
 class ImageMeasureMixin(MeasureProtocol):
     """
     Defines an image-level performance measure.
@@ -208,6 +448,71 @@ class AsymmetricMeasureMixin(MeasureProtocol):
         return SymmetricMeasureAdapter(self, self.reversed(), **kwargs)
 
 
+class _ObjectDistances:
+    """
+    Distances of the pixels of segmented objects to a reference object.
+
+    The distance map of the reference object is only computed for the crop
+    which encloses the reference object and the segmented objects.
+    """
+
+    def __init__(
+        self,
+        expected: LabelImage,
+        ref_label: int,
+        ref_slice: Slice,
+        seg_index: ObjectIndex,
+        seg_labels: Sequence[int],
+        spacing: Optional[Sequence[float]] = None,
+    ) -> None:
+        self.expected  = expected
+        self.ref_label = ref_label
+        self.ref_slice = ref_slice
+        self.seg_index = seg_index
+        self.labels    = seg_labels
+        self.spacing   = spacing
+        self.window    = self._get_window(seg_labels)
+        self.distancemap = ndimage.distance_transform_edt(
+            expected[self.window] != ref_label,
+            sampling=spacing,
+        )
+
+    def _get_window(self, seg_labels: Sequence[int]) -> Slice:
+        return bbox(
+            self.expected.shape,
+            [self.ref_slice] + [
+                self.seg_index.slices[seg_label] for seg_label in seg_labels
+            ],
+        )
+
+    def select(self, seg_labels: Sequence[int]) -> '_ObjectDistances':
+        """
+        Returns the distances for a different set of segmented objects. The
+        distance map is re-used, if it encloses those objects.
+        """
+        window = self._get_window(seg_labels)
+        if all(
+            w1.start <= w2.start and w2.stop <= w1.stop
+            for w1, w2 in zip(self.window, window)
+        ):
+            distances = copy.copy(self)
+            distances.labels = seg_labels
+            return distances
+        else:
+            return _ObjectDistances(
+                self.expected,
+                self.ref_label,
+                self.ref_slice,
+                self.seg_index,
+                seg_labels,
+                self.spacing,
+            )
+
+    def __getitem__(self, seg_label: int) -> np.ndarray:
+        sl, seg_cc = self.seg_index.mask(seg_label)
+        return self.distancemap[relative_slice(sl, self.window)][seg_cc]
+
+
 class ObjectMeasureAdapter(AsymmetricMeasureMixin, Measure):
     """
     Adapter to use image-level measures on a per-object level.
@@ -217,6 +522,13 @@ class ObjectMeasureAdapter(AsymmetricMeasureMixin, Measure):
     established by choosing the segmented object for each ground truth object,
     for which the obtained scores are either minimal or maximal.
 
+    Each score is computed for a crop which encloses the ground truth object
+    and the segmented object. For measures which do not depend on the
+    extent of the background (see :attr:`Measure.crop_invariant`), a single
+    crop which encloses all candidates of a ground truth object is used
+    instead, so that the state of the underlying measure derived from the
+    ground truth object is computed only once.
+
     :param measure:
         The underlying image-level measure.
 
@@ -238,14 +550,16 @@ class ObjectMeasureAdapter(AsymmetricMeasureMixin, Measure):
 
     def compute(self, actual: LabelImage) -> List[float]:
         results: List[float] = list()
-        seg_labels = frozenset(actual.reshape(-1)) - {0}
+        ref_index = object_index(self.expected)
+        seg_index = object_index(actual)
+        spacing = getattr(self.measure, 'spacing', None)
 
-        for ref_label in set(self.expected.flatten()) - {0}:
-            ref_cc = (self.expected == ref_label)
+        for ref_label in ref_index.labels:
+            ref_slice = ref_index.slices[ref_label]
 
             # If there were no detections, then there are no correspondances,
             # and thus no object-level scores can be determined:
-            if len(seg_labels) == 0:
+            if len(seg_index) == 0:
                 if self.nodetections >= 0:
                     results.append(self.nodetections)
                 continue
@@ -254,43 +568,140 @@ class ObjectMeasureAdapter(AsymmetricMeasureMixin, Measure):
             # to a meaningful region. To do so, we first determine the
             # distance within which potentially corresponding objects will
             # be considered. This is the distance to the furthest point of
-            # the closest object:
-            ref_distancemap = ndimage.distance_transform_edt(~ref_cc)
+            # the closest object. Bounds of the distances are obtained from
+            # the bounding boxes, so that distance maps only need to be
+            # computed for crops which enclose the closest candidates:
+            lower_bounds, upper_bounds = bbox_distances(
+                np.array([s.start for s in ref_slice]),
+                np.array([s.stop for s in ref_slice]),
+                seg_index.starts,
+                seg_index.stops,
+                spacing,
+            )
+            distances = _ObjectDistances(
+                self.expected,
+                ref_label,
+                ref_slice,
+                seg_index,
+                seg_index.labels[lower_bounds <= upper_bounds.min()],
+                spacing,
+            )
             closest_seg_label = min(
-                seg_labels,
-                key=lambda seg_label: ref_distancemap[
-                        actual == seg_label
-                    ].min(),
+                distances.labels,
+                key=lambda seg_label: distances[seg_label].min(),
             )
-            max_correspondance_candidates_distance = ref_distancemap[
-                actual == closest_seg_label
+            max_correspondance_candidates_distance = distances[
+                closest_seg_label
             ].max()
 
             # Second, narrow the set of potentially corresponding objects
             # by finding the labels of objects within the maximum distance:
+            distances = distances.select(
+                seg_index.labels[
+                    lower_bounds <= max_correspondance_candidates_distance
+                ],
+            )
             correspondance_candidates = [
-                seg_label for seg_label in seg_labels
-                if ref_distancemap[
-                    actual == seg_label
+                seg_label for seg_label in distances.labels
+                if distances[
+                    seg_label
                 ].min() <= max_correspondance_candidates_distance
             ]
 
-            scores: List[float] = list()
-            for seg_label in correspondance_candidates:
-                seg_cc = (actual == seg_label)
-                _bbox  = bbox(ref_cc, seg_cc, margin=1)[0]
-                self.measure.set_expected(ref_cc[_bbox].astype('uint8'))
-                score = self.measure.compute(seg_cc[_bbox].astype('uint8'))
-                assert len(score) == 1
-                scores.append(score[0])
+            if getattr(self.measure, 'crop_invariant', False):
+                scores = self._compute_shared_crop(
+                    actual,
+                    ref_label,
+                    ref_slice,
+                    seg_index,
+                    correspondance_candidates,
+                )
+            else:
+                scores = self._compute_pair_crops(
+                    actual,
+                    ref_label,
+                    ref_slice,
+                    seg_index,
+                    correspondance_candidates,
+                )
             results.append(self.correspondance_function(scores))
+
+        # The state of the underlying measure only refers to the last crop
+        release(self.measure)
         return results
 
+    def _compute_shared_crop(
+        self,
+        actual: LabelImage,
+        ref_label: int,
+        ref_slice: Tuple[slice, ...],
+        seg_index: ObjectIndex,
+        seg_labels: List[int],
+    ) -> List[float]:
+        """
+        Computes the scores of the candidates using a single crop which
+        encloses all of them, so that the reference-side state of the
+        underlying measure (e.g., contours and distance maps) is computed
+        only once (see :attr:`Measure.crop_invariant`).
+        """
+        _bbox = bbox(
+            actual.shape,
+            [ref_slice] + [seg_index.slices[label] for label in seg_labels],
+            margin=1,
+        )
+        actual_crop = actual[_bbox]
+        self.measure.set_expected(self.expected[_bbox] == ref_label)
+        scores: List[float] = list()
+        for seg_label in seg_labels:
+            score = self.measure.compute(actual_crop == seg_label)
+            assert len(score) == 1
+            scores.append(score[0])
+        return scores
+
+    def _compute_pair_crops(
+        self,
+        actual: LabelImage,
+        ref_label: int,
+        ref_slice: Tuple[slice, ...],
+        seg_index: ObjectIndex,
+        seg_labels: List[int],
+    ) -> List[float]:
+        """
+        Computes the score of each candidate using a crop which encloses
+        only the reference object and the candidate (for measures which
+        depend on the extent of the background).
+        """
+        scores: List[float] = list()
+        for seg_label in seg_labels:
+            _bbox = bbox(
+                actual.shape,
+                [ref_slice, seg_index.slices[seg_label]],
+                margin=1,
+            )
+            self.measure.set_expected(self.expected[_bbox] == ref_label)
+            score = self.measure.compute(actual[_bbox] == seg_label)
+            assert len(score) == 1
+            scores.append(score[0])
+        return scores
+
+    def release(self) -> None:
+        super().release()
+        release(self.measure)
+
     def default_name(self):
         return f'Ob. {self.measure.default_name()}'
 
 
 class ReverseMeasureAdapter(Measure):
+    """
+    Adapter to use an asymmetric measure in the opposite direction.
+
+    Artifacts derived from the images (e.g., binary masks, contours, or
+    distance maps) are cached per image, so that swapping the roles of the
+    actual and the expected segmentation masks for each sample does not
+    repeat their computation. This also applies if the same images are
+    used in both directions by :class:`SymmetricMeasureAdapter`.
+    """
 
     def __init__(self, measure: MeasureProtocol, **kwargs) -> None:
         super().__init__(aggregation=measure.aggregation, **kwargs)
@@ -298,13 +709,27 @@ class ReverseMeasureAdapter(Measure):
 
     def compute(self, actual: LabelImage) -> List[float]:
         self.measure.set_expected(actual)
-        return self.measure.compute(self.expected)
+        try:
+            return self.measure.compute(self.expected)
+        finally:
+            release(self.measure)
+
+    def release(self) -> None:
+        super().release()
+        release(self.measure)
 
     def default_name(self) -> str:
         return f'Rev. {self.measure.default_name()}'
 
 
 class SymmetricMeasureAdapter(Measure):
+    """
+    Adapter to use an asymmetric measure in both directions.
+
+    The results of both measures are concatenated. Direction-independent
+    artifacts are shared between both measures (see
+    :class:`ReverseMeasureAdapter`).
+    """
 
     def __init__(
         self,
@@ -327,5 +752,10 @@ class SymmetricMeasureAdapter(Measure):
         results2 = self.measure2.compute(actual)
         return results1 + results2
 
+    def release(self) -> None:
+        super().release()
+        release(self.measure1)
+        release(self.measure2)
+
     def default_name(self) -> str:
         return f'Sym. {self.measure1.default_name()}'
@@ -1,35 +1,83 @@
 from .contour import (
     NSD,
+    BoundaryF1,
+    BoundaryIoU,
     Hausdorff,
 )
 from .detection import (
+    AveragePrecision,
+    DetectionErrors,
+    F1Score,
     FalseMerge,
     FalseNegative,
     FalsePositive,
     FalseSplit,
+    PanopticQuality,
+    Precision,
+    Recall,
 )
+from .panoptic import ClassInstanceMeasures
+from .points import PointDetection
 from .regional import (
     AdjustedRandIndex,
     AggregatedJaccardCoefficient,
+    CenterlineDice,
     Dice,
+    InstanceAdjustedRandIndex,
+    InstanceRandIndex,
     ISBIScore,
     JaccardCoefficient,
     JaccardIndex,
+    PairCounting,
+    PixelOverlap,
     RandIndex,
+    VariationOfInformation,
+)
+from .semantic import (
+    MultiClassAccuracy,
+    MultiClassDice,
+    MultiClassIoU,
+    SemanticOverlap,
+)
+from .tracking import (
+    DetectionAccuracy,
+    TrackingAccuracy,
 )
 
 __all__ = [
     'AdjustedRandIndex',
     'AggregatedJaccardCoefficient',
+    'AveragePrecision',
+    'BoundaryF1',
+    'BoundaryIoU',
+    'CenterlineDice',
+    'ClassInstanceMeasures',
+    'DetectionAccuracy',
+    'DetectionErrors',
     'Dice',
+    'F1Score',
     'FalseMerge',
     'FalseNegative',
     'FalsePositive',
     'FalseSplit',
     'Hausdorff',
     'ISBIScore',
+    'InstanceAdjustedRandIndex',
+    'InstanceRandIndex',
     'JaccardCoefficient',
     'JaccardIndex',
+    'MultiClassAccuracy',
+    'MultiClassDice',
+    'MultiClassIoU',
     'NSD',
+    'PairCounting',
+    'PanopticQuality',
+    'PixelOverlap',
+    'PointDetection',
+    'Precision',
     'RandIndex',
+    'Recall',
+    'SemanticOverlap',
+    'TrackingAccuracy',
+    'VariationOfInformation',
 ]
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+from typing import (
+    List,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+
+from segmetrics import _cache
+from segmetrics._aux import chunks
+from segmetrics.arena import scratch
+from segmetrics.typing import LabelImage
+
+# Label pairs are counted using ``np.bincount`` if the number of possible
+# pairs does not exceed this factor times the number of pixels (otherwise,
+# the pairs are counted using ``np.unique``)
+_BINCOUNT_MAX_PAIRS_FACTOR = 4
+
+
+def _count_pairs(
+    ref: np.ndarray,
+    seg: np.ndarray,
+    num_ref_labels: int,
+    num_seg_labels: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts the label pairs of two flattened label images.
+
+    :returns:
+        The keys of the label pairs which occur (ground truth label times
+        ``num_seg_labels`` plus segmented label, in ascending order), and the
+        number of occurrences of each label pair.
+    """
+    num_pairs = num_ref_labels * num_seg_labels
+    if num_pairs <= _BINCOUNT_MAX_PAIRS_FACTOR * max((ref.size, 1)):
+        with scratch(ref.shape, np.intp) as pair_keys:
+            np.multiply(
+                ref,
+                num_seg_labels,
+                out=pair_keys,
+                dtype=np.intp,
+                casting='unsafe',
+            )
+            np.add(pair_keys, seg, out=pair_keys, casting='unsafe')
+            counts = np.bincount(pair_keys, minlength=num_pairs)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        with scratch(ref.shape, np.uint64) as pair_keys:
+            np.multiply(
+                ref,
+                np.uint64(num_seg_labels),
+                out=pair_keys,
+                dtype=np.uint64,
+                casting='unsafe',
+            )
+            np.add(pair_keys, seg, out=pair_keys, casting='unsafe')
+            keys, counts = np.unique(pair_keys, return_counts=True)
+        keys = keys.astype(np.int64)
+    return keys, counts
+
+
+class OverlapTable:
+    """
+    Sparse table of the numbers of pixels shared by the objects of two label
+    images (i.e. a sparse contingency table).
+
+    The table only contains the label pairs which actually overlap. The
+    background (label 0) is included, so that the row and column sums
+    correspond to the areas of the objects. The labels are expected to be
+    dense (see :attr:`segmetrics.study.Study.relabel`).
+
+    :param ref:
+        The labels of the ground truth objects (one per label pair).
+
+    :param seg:
+        The labels of the segmented objects (one per label pair).
+
+    :param counts:
+        The numbers of pixels shared by the objects (one per label pair).
+    """
+
+    def __init__(
+        self,
+        ref: np.ndarray,
+        seg: np.ndarray,
+        counts: np.ndarray,
+    ) -> None:
+        assert len(ref) == len(seg) == len(counts)
+
+        #: The labels of the ground truth objects (one per label pair).
+        self.ref = np.asarray(ref, np.int64)
+
+        #: The labels of the segmented objects (one per label pair).
+        self.seg = np.asarray(seg, np.int64)
+
+        #: The numbers of pixels shared by the objects (one per label pair).
+        self.counts = np.asarray(counts, np.int64)
+
+        #: The areas of the ground truth objects (indexed by label).
+        self.ref_areas = np.bincount(
+            self.ref, weights=self.counts, minlength=1,
+        ).astype(np.int64)
+
+        #: The areas of the segmented objects (indexed by label).
+        self.seg_areas = np.bincount(
+            self.seg, weights=self.counts, minlength=1,
+        ).astype(np.int64)
+
+    @staticmethod
+    def compute(expected: LabelImage, actual: LabelImage) -> OverlapTable:
+        """
+        Computes the overlap table of two label images in a single pass.
+
+        Large images are processed in chunks along the first axis (see
+        :data:`segmetrics._aux.CHUNK_SIZE`), so that the temporary arrays
+        do not scale with the size of the images.
+        """
+        assert expected.shape == actual.shape
+        num_ref_labels = int(expected.max(initial=0)) + 1
+        num_seg_labels = int(actual.max(initial=0)) + 1
+        keys_list: List[np.ndarray] = list()
+        counts_list: List[np.ndarray] = list()
+        for chunk in chunks(expected.shape):
+            keys, counts = _count_pairs(
+                expected[chunk].reshape(-1),
+                actual[chunk].reshape(-1),
+                num_ref_labels,
+                num_seg_labels,
+            )
+            keys_list.append(keys)
+            counts_list.append(counts)
+        if len(keys_list) == 1:
+            keys, counts = keys_list[0], counts_list[0]
+        else:
+            keys, inverse = np.unique(
+                np.concatenate(keys_list),
+                return_inverse=True,
+            )
+            counts = np.bincount(
+                inverse.reshape(-1),
+                weights=np.concatenate(counts_list),
+            ).astype(np.int64)
+        return OverlapTable(
+            keys // num_seg_labels,
+            keys %  num_seg_labels,
+            counts,
+        )
+
+    @staticmethod
+    def concatenate(tables: Sequence[OverlapTable]) -> OverlapTable:
+        """
+        Merges the overlap tables of multiple pairs of images into the
+        overlap table of the concatenated images.
+
+        The object labels of each table are offset, so that the objects of
+        different images are distinct, whereas the background is shared.
+        """
+        ref_offsets = np.cumsum([0] + [len(t.ref_areas) - 1 for t in tables])
+        seg_offsets = np.cumsum([0] + [len(t.seg_areas) - 1 for t in tables])
+        background = sum(
+            int(table.counts[(table.ref == 0) & (table.seg == 0)].sum())
+            for table in tables
+        )
+        refs = [np.zeros(1, np.int64)]
+        segs = [np.zeros(1, np.int64)]
+        counts = [np.array([background], np.int64)]
+        for table, ref_offset, seg_offset in zip(
+            tables,
+            ref_offsets,
+            seg_offsets,
+        ):
+            ref, seg = table.ref, table.seg
+            mask = np.logical_or(ref > 0, seg > 0)
+            refs.append(np.where(ref[mask] > 0, ref[mask] + ref_offset, 0))
+            segs.append(np.where(seg[mask] > 0, seg[mask] + seg_offset, 0))
+            counts.append(table.counts[mask])
+        table = OverlapTable(
+            np.concatenate(refs),
+            np.concatenate(segs),
+            np.concatenate(counts),
+        )
+        return table.select(table.counts > 0)
+
+    @property
+    def num_ref_objects(self) -> int:
+        """
+        The number of ground truth objects.
+        """
+        return int(np.count_nonzero(self.ref_areas[1:]))
+
+    @property
+    def num_seg_objects(self) -> int:
+        """
+        The number of segmented objects.
+        """
+        return int(np.count_nonzero(self.seg_areas[1:]))
+
+    def transpose(self) -> OverlapTable:
+        """
+        Returns the overlap table with the roles of the images swapped.
+        """
+        return OverlapTable(self.seg, self.ref, self.counts)
+
+    def objects(self) -> OverlapTable:
+        """
+        Returns the overlap table restricted to pairs of objects (i.e. without
+        the background pairs). The object areas are retained.
+        """
+        return self.select(np.logical_and(self.ref > 0, self.seg > 0))
+
+    def select(self, mask: np.ndarray) -> OverlapTable:
+        """
+        Returns the overlap table restricted to the label pairs selected by
+        the boolean ``mask`` (one value per label pair). The object areas are
+        retained.
+        """
+        table = OverlapTable.__new__(OverlapTable)
+        table.ref = self.ref[mask]
+        table.seg = self.seg[mask]
+        table.counts = self.counts[mask]
+        table.ref_areas = self.ref_areas
+        table.seg_areas = self.seg_areas
+        return table
+
+    def iou(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the labels of all overlapping pairs of objects, and the
+        intersection over union (Jaccard coefficient) of each pair.
+        """
+        table = self.objects()
+        unions = (
+            table.ref_areas[table.ref] + table.seg_areas[table.seg]
+            - table.counts
+        )
+        return table.ref, table.seg, table.counts / unions
+
+
+def overlap_table(expected: LabelImage, actual: LabelImage) -> OverlapTable:
+    """
+    Returns the :class:`OverlapTable` of two label images (cached).
+
+    If the overlap table was already computed with the roles of the images
+    swapped, the transposed table is returned.
+    """
+    def compute() -> OverlapTable:
+        transposed = _cache.peek((actual, expected), 'overlap_table')
+        if transposed is None:
+            return OverlapTable.compute(expected, actual)
+        else:
+            return transposed.transpose()
+    return _cache.get((expected, actual), 'overlap_table', compute)
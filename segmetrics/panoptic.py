@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+
+from segmetrics import _cache
+from segmetrics.detection import PanopticQuality
+from segmetrics.matching import match_objects
+from segmetrics.measure import MultiMeasure
+from segmetrics.overlap import (
+    OverlapTable,
+    overlap_table,
+)
+from segmetrics.regional import AggregatedJaccardCoefficient
+from segmetrics.typing import LabelImage
+
+
+def compute_object_classes(
+    image: LabelImage,
+    classes: LabelImage,
+) -> np.ndarray:
+    """
+    Determines the class of each object of a label image, which is the most
+    frequent class of its pixels in the class map ``classes``.
+
+    :returns:
+        The class of each object, indexed by label (``-1`` for labels which
+        do not correspond to an object, including the background).
+    """
+    assert image.shape == classes.shape, 'class map has wrong shape'
+    assert classes.min(initial=0) >= 0, 'class labels must be non-negative'
+    table = OverlapTable.compute(image, classes).objects()
+    object_classes = np.full(len(table.ref_areas), -1, np.int64)
+    if len(table.counts) > 0:
+        # Sort by label and count (descending), ties favor the lower class
+        order = np.lexsort((table.seg, -table.counts, table.ref))
+        ref, seg = table.ref[order], table.seg[order]
+        first = np.ones(len(ref), bool)
+        first[1:] = ref[1:] != ref[:-1]
+        object_classes[ref[first]] = seg[first]
+    return object_classes
+
+
+def set_object_classes(image: LabelImage, classes: LabelImage) -> None:
+    """
+    Assigns classes to the objects of a label image, using the class map
+    ``classes`` (see :func:`compute_object_classes`).
+
+    The object classes are kept as long as the image exists, and used by the
+    class-restricted measures (see :class:`ClassInstanceMeasures`).
+    """
+    _cache.assign(
+        image,
+        'object_classes',
+        compute_object_classes(image, classes),
+    )
+
+
+def get_object_classes(image: LabelImage) -> np.ndarray:
+    """
+    Returns the object classes assigned to the objects of a label image (see
+    :func:`set_object_classes`).
+    """
+    object_classes = _cache.assigned(image, 'object_classes')
+    if object_classes is None:
+        raise ValueError('No class map was provided for the image')
+    return object_classes
+
+
+class ClassInstanceMeasures(MultiMeasure):
+    r"""
+    Yields the panoptic quality (output ``PQ@t[c]`` for the IoU threshold
+    :math:`t`, see :class:`~segmetrics.detection.PanopticQuality`), the SEG
+    measure (output ``SEG[c]``, see :class:`~segmetrics.regional.ISBIScore`),
+    and the Aggregated Jaccard Coefficient (output ``AJC[c]``, see
+    :class:`~segmetrics.regional.AggregatedJaccardCoefficient`) restricted
+    to the objects of each class :math:`c`.
+
+    The class-restricted values are the values obtained for the label images
+    which only contain the objects of class :math:`c` (in both the ground
+    truth and the segmentation result). They are all derived from the joint
+    overlap table of the label images (see
+    :func:`segmetrics.overlap.overlap_table`), which is computed in a single
+    pass, instead of masking the images for each class.
+
+    The classes of the objects are determined from the class maps passed to
+    :meth:`segmetrics.study.Study.set_expected` and
+    :meth:`segmetrics.study.Study.process` (see :func:`set_object_classes`).
+
+    :param classes:
+        The classes for which the measures are computed.
+
+    :param iou_threshold:
+        The IoU threshold used for the panoptic quality.
+    """
+
+    def __init__(
+        self,
+        classes: Sequence[int],
+        iou_threshold: float = 0.5,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.classes = list(classes)
+        self.iou_threshold = iou_threshold
+        pq = PanopticQuality(iou_threshold)
+        ajc = AggregatedJaccardCoefficient()
+        self._pq_name = pq.default_name()
+        for c in self.classes:
+            self.add_output(
+                f'{self._pq_name}[{c}]',
+                postprocess=pq.postprocess,
+            )
+            self.add_output(f'SEG[{c}]')
+            self.add_output(f'AJC[{c}]', postprocess=ajc.postprocess)
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[Any]]:
+        table = overlap_table(self.expected, actual).objects()
+        ref_classes = get_object_classes(self.expected)
+        seg_classes = get_object_classes(actual)
+        pair_ref_classes = ref_classes[table.ref]
+        pair_seg_classes = seg_classes[table.seg]
+        results: Dict[str, List[Any]] = dict()
+        for c in self.classes:
+            class_table = table.select(
+                np.logical_and(pair_ref_classes == c, pair_seg_classes == c),
+            )
+            ref_labels = np.flatnonzero(ref_classes == c)
+            seg_labels = np.flatnonzero(seg_classes == c)
+            results[f'{self._pq_name}[{c}]'] = [
+                self._compute_pq(class_table, ref_labels, seg_labels),
+            ]
+            results[f'SEG[{c}]'] = self._compute_seg(class_table, ref_labels)
+            results[f'AJC[{c}]'] = [
+                self._compute_ajc(class_table, ref_labels, seg_labels),
+            ]
+        return results
+
+    def _compute_pq(
+        self,
+        table: OverlapTable,
+        ref_labels: np.ndarray,
+        seg_labels: np.ndarray,
+    ) -> Tuple[int, int, int, float]:
+        iou = match_objects(table, self.iou_threshold)[2]
+        tp = len(iou)
+        fp = len(seg_labels) - tp
+        fn = len(ref_labels) - tp
+        return (tp, fp, fn, float(iou.sum()))
+
+    def _compute_seg(
+        self,
+        table: OverlapTable,
+        ref_labels: np.ndarray,
+    ) -> List[float]:
+        matches = table.counts > 0.5 * table.ref_areas[table.ref]
+        jaccards = np.zeros(len(table.ref_areas))
+        ref, seg, iou = table.iou()
+        jaccards[ref[matches]] = iou[matches]
+        return jaccards[ref_labels].tolist()
+
+    def _compute_ajc(
+        self,
+        table: OverlapTable,
+        ref_labels: np.ndarray,
+        seg_labels: np.ndarray,
+    ) -> Tuple[float, float]:
+        ref, seg, iou = table.iou()
+
+        # Choose the segmented object with the largest IoU for each ground
+        # truth object (ties favor the lower label)
+        order = np.lexsort((seg, -iou, ref))
+        ref, seg = ref[order], seg[order]
+        counts = table.counts[order]
+        first = np.ones(len(ref), bool)
+        first[1:] = ref[1:] != ref[:-1]
+        ref, seg, counts = ref[first], seg[first], counts[first]
+
+        c = counts.sum()
+        u = (
+            table.ref_areas[ref_labels].sum()
+            + table.seg_areas[seg_labels].sum()
+            - table.seg_areas[np.unique(seg)].sum()
+            + (table.seg_areas[seg] - counts).sum()
+        )
+        return (float(c), float(u))
@@ -1,16 +1,272 @@
+import collections
+import concurrent.futures
+import contextlib
 import multiprocessing
+import multiprocessing.connection
+import pickle
 import signal
+import threading
+import time
+import traceback
 from typing import (
     Any,
     Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Literal,
     Optional,
     Sequence,
+    Tuple,
+    Union,
 )
 
 import dill
+import numpy as np
 
+from segmetrics._aux import count_objects
 from segmetrics.study import Study
-from segmetrics.typing import Image
+from segmetrics.typing import (
+    Image,
+    LabelImage,
+)
+
+try:
+    import pandas as pd
+except ImportError:
+    pass
+
+#: The estimated cost of evaluating a single object, relative to the cost of
+#: a single pixel (see :func:`image_cost`).
+OBJECT_COST: float = 1000
+
+# The study of the current worker (see :func:`process` and :func:`pipeline`),
+# which is reused for all samples processed by the worker (including its
+# buffer arena)
+_worker = threading.local()
+
+
+FailureKind = Literal[
+    'error',
+    'timeout',
+    'crash',
+]
+
+
+class SampleFailure:
+    """
+    Record of a sample which could not be evaluated.
+
+    Failed samples are isolated from the remaining samples (see the
+    ``failures`` parameter of :func:`process`).
+    """
+
+    def __init__(
+        self,
+        sample_id: Any,
+        kind: FailureKind,
+        error_type: str,
+        message: str,
+        details: str,
+        attempts: int,
+    ) -> None:
+
+        #: The identifier of the failed sample.
+        self.sample_id = sample_id
+
+        #: Either ``'error'`` (an exception was raised), ``'timeout'`` (the
+        #: evaluation exceeded the time limit), or ``'crash'`` (the worker
+        #: process died, e.g., killed due to lack of memory).
+        self.kind = kind
+
+        #: The name of the type of the exception.
+        self.error_type = error_type
+
+        #: The message of the exception.
+        self.message = message
+
+        #: The formatted traceback of the exception (empty for timeouts and
+        #: crashes, which are detected by the parent process).
+        self.details = details
+
+        #: The number of attempts made to evaluate the sample.
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return (
+            f'SampleFailure({self.sample_id!r}, {self.kind!r}, '
+            f'{self.error_type}: {self.message})'
+        )
+
+
+class SampleError(Exception):
+    """
+    Raised if a sample could not be evaluated, and failures are not isolated.
+    """
+
+    def __init__(self, failure: SampleFailure) -> None:
+        super().__init__(f'Failed to evaluate sample: {failure}')
+
+        #: The record of the failure.
+        self.failure = failure
+
+
+# The result of evaluating a sample (see :func:`_evaluate_sample`): the
+# sample identifier, the study, the run time, the cost, and the failure
+_SampleResult = Tuple[
+    Any,
+    Optional[Study],
+    float,
+    Optional[float],
+    Optional[SampleFailure],
+]
+
+
+def image_cost(image: LabelImage) -> float:
+    """
+    Estimates the cost of evaluating a label image, which is the number of
+    pixels plus :data:`OBJECT_COST` times the number of objects.
+    """
+    return _estimate_cost(image.size, count_objects(image))
+
+
+def _estimate_cost(num_pixels: int, num_objects: int) -> float:
+    return float(num_pixels + OBJECT_COST * num_objects)
+
+
+class CostScheduler:
+    """
+    Schedules the samples in the order of decreasing estimated cost (longest
+    processing time first), and records the actual run time of each sample.
+
+    The workers take the next sample from a shared queue whenever they
+    become idle, so that expensive samples are started early and the cheap
+    samples at the end of the queue fill the remaining gaps (instead of a
+    few expensive samples at the end of the input keeping a single worker
+    busy while the others idle).
+
+    :param costs:
+        The estimated costs of the samples, either as a sequence (ordered
+        like the sample identifiers), or as a function of the sample
+        identifier (e.g., based on the image sizes read from the file
+        headers). If ``None``, the samples are dispatched in the order of
+        loading, and the cost of each sample is determined when its ground
+        truth is evaluated (see :func:`image_cost`), so that the run times
+        can still be predicted.
+    """
+
+    def __init__(
+        self,
+        costs: Union[Sequence[float], Callable[[Any], float], None] = None,
+    ) -> None:
+        self.costs = costs
+
+        #: The estimated cost of each sample (by sample identifier, ``NaN``
+        #: if not known yet).
+        self.sample_costs: Dict[Any, float] = dict()
+
+        #: The actual run time of each processed sample (in seconds, by
+        #: sample identifier).
+        self.run_times: Dict[Any, float] = dict()
+
+        #: The run time predicted for each processed sample, using only the
+        #: samples processed before (in seconds, by sample identifier, see
+        #: :meth:`record`).
+        self.predictions: Dict[Any, float] = dict()
+
+    def order(self, sample_ids: Sequence[Any]) -> List[Any]:
+        """
+        Returns the sample identifiers in the order of decreasing estimated
+        cost (ties keep the order of ``sample_ids``), or in the given order
+        if no ``costs`` were given.
+        """
+        if self.costs is None:
+            costs = [np.nan] * len(sample_ids)
+        elif callable(self.costs):
+            costs = [self.costs(sample_id) for sample_id in sample_ids]
+        else:
+            costs = list(self.costs)
+            assert len(costs) == len(sample_ids), 'wrong number of costs'
+        order = np.argsort(-np.asarray(costs, float), kind='stable')
+        for idx in order:
+            self.sample_costs[sample_ids[idx]] = costs[idx]
+        return [sample_ids[idx] for idx in order]
+
+    def record(
+        self,
+        sample_id: Any,
+        run_time: float,
+        cost: Optional[float] = None,
+    ) -> None:
+        """
+        Records the actual run time of a sample (in seconds), and its cost
+        determined during the evaluation (used if the cost was not known
+        before).
+
+        Before, the run time of the sample is predicted from the samples
+        processed so far (see :meth:`predicted_times`), so that the
+        predictions are never fitted to the run times they are compared to.
+        """
+        if cost is not None and np.isnan(self.sample_costs[sample_id]):
+            self.sample_costs[sample_id] = cost
+        self.predictions[sample_id] = (
+            self._rate() * self.sample_costs[sample_id]
+        )
+        self.run_times[sample_id] = run_time
+
+    def predicted_times(self) -> Dict[Any, float]:
+        """
+        Returns the predicted run time of each sample (in seconds).
+
+        The run times are predicted proportionally to the estimated costs,
+        using the ratio of the total run time and the total cost of the
+        samples processed before (``NaN`` if there are none, or if the cost
+        is not known). For samples which were not processed yet, all
+        processed samples are used.
+        """
+        rate = self._rate()
+        return {
+            sample_id: self.predictions.get(sample_id, rate * cost)
+            for sample_id, cost in self.sample_costs.items()
+        }
+
+    def _rate(self) -> float:
+        """
+        Returns the ratio of the total run time and the total cost of the
+        processed samples with known costs (``NaN`` if there are none).
+        """
+        known = [
+            sample_id for sample_id in self.run_times
+            if not np.isnan(self.sample_costs[sample_id])
+        ]
+        total_cost = sum(self.sample_costs[sample_id] for sample_id in known)
+        if total_cost > 0:
+            return sum(self.run_times[sample_id] for sample_id in known) / (
+                total_cost
+            )
+        else:
+            return np.nan
+
+    def todf(self) -> pd.DataFrame:
+        """
+        Returns the estimated cost, the predicted run time, and the actual
+        run time of each sample as a pandas dataframe (in the order of
+        scheduling, ``NaN`` for samples which were not processed).
+        """
+        predicted_times = self.predicted_times()
+        return pd.DataFrame(
+            [
+                [
+                    sample_id,
+                    cost,
+                    predicted_times[sample_id],
+                    self.run_times.get(sample_id, np.nan),
+                ]
+                for sample_id, cost in self.sample_costs.items()
+            ],
+            columns=['Sample', 'Cost', 'Predicted time', 'Actual time'],
+        )
 
 
 def process(
@@ -22,25 +278,84 @@ def process(
     is_actual_unique: bool = True,
     is_expected_unique: bool = True,
     callback: Optional[Callable[[int, int], None]] = None,
+    scheduler: Optional[CostScheduler] = None,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    failures: Optional[List[SampleFailure]] = None,
 ):
+    """
+    Evaluates samples in parallel using a pool of ``num_forks`` processes,
+    and yields the identifiers of the processed samples (in the order of
+    completion, including failed samples).
+
+    :param scheduler:
+        Determines the order in which the samples are dispatched, and
+        records the run times of the samples (see :class:`CostScheduler`).
+
+    :param timeout:
+        The wall-clock time limit for the evaluation of a single sample (in
+        seconds, including loading the images), or ``None``. The limit is
+        enforced by the parent process, which terminates the worker process
+        evaluating the sample (and starts a new one), so that it also takes
+        effect within native code. If a limit is given, the samples are
+        always evaluated by worker processes (also for ``num_forks=1``).
+
+    :param retries:
+        The number of times the evaluation of a sample is repeated if an
+        exception is raised (timeouts and crashes are not retried).
+
+    :param failures:
+        If a list is given, failing samples are recorded in this list (see
+        :class:`SampleFailure`), and the remaining samples are processed as
+        usual. Otherwise, a :class:`SampleError` is raised for the first
+        failing sample. In both cases, the results of the samples completed
+        before are kept. Samples whose worker process died are recorded as
+        failures too.
+    """
     if num_forks is None:
         num_forks = multiprocessing.cpu_count()
     num_forks = min([num_forks, len(sample_ids)])
-    generator = _fork.imap_unordered(
-        num_forks,
-        _process_sample,
-        study,
+    assert retries >= 0
+    if scheduler is not None:
+        sample_ids = scheduler.order(sample_ids)
+    args = (
         dill.dumps(get_actual_func),
         dill.dumps(get_expected_func),
-        _unroll(sample_ids),
         is_actual_unique,
         is_expected_unique,
+        retries,
     )
+    generator: Iterator[
+        _SampleResult
+    ]
+    if (num_forks >= 2 or timeout is not None) and not _fork.DEBUG:
+
+        # The workers receive a copy of the study when they are started, so
+        # that the study is not serialized while results are merged into it
+        generator = _imap_supervised(
+            num_forks,
+            timeout,
+            _process_sample,
+            sample_ids,
+            (None,) + args,
+            initializer=_init_worker,
+            initargs=(pickle.dumps(study),),
+        )
+    else:
+        generator = (
+            _process_sample(sample_id, study, *args)
+            for sample_id in sample_ids
+        )
     for sample_idx, sample_result in enumerate(generator):
-        sample_id, sample_study = sample_result
+        sample_id, sample_study, run_time, cost, failure = sample_result
+        if scheduler is not None:
+            scheduler.record(sample_id, run_time, cost)
+        if failure is not None:
+            _handle_failure(failure, failures)
 
         # This happens when parallelization is off:
-        if study is not sample_study:
+        elif study is not sample_study:
+            assert sample_study is not None
             study.merge(sample_study, sample_ids=[sample_id])
 
         if callback is not None:
@@ -53,19 +368,608 @@ def process_all(*args, **kwargs):
         pass
 
 
-def _process_sample(
+def pipeline(
     study: Study,
     get_actual_func: Callable[[Any], Image],
     get_expected_func: Callable[[Any], Image],
+    sample_ids: Sequence[Any],
+    num_workers: Optional[int] = None,
+    num_loaders: int = 2,
+    max_pending: Optional[int] = None,
+    max_pending_bytes: Optional[int] = None,
+    use_threads: bool = False,
+    is_actual_unique: bool = True,
+    is_expected_unique: bool = True,
+    callback: Optional[Callable[[int, int], None]] = None,
+    scheduler: Optional[CostScheduler] = None,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    failures: Optional[List[SampleFailure]] = None,
+) -> Iterator[Any]:
+    """
+    Evaluates samples in parallel using a staged pipeline, and yields the
+    identifiers of the processed samples (in the order of completion).
+
+    Unlike :func:`process`, loading the images is separated from evaluating
+    them. The images are loaded by an I/O stage (a pool of ``num_loaders``
+    threads, which call ``get_actual_func`` and ``get_expected_func``), and
+    evaluated by a compute stage (a pool of ``num_workers`` processes, or
+    threads if ``use_threads`` is ``True``). Each compute worker keeps its
+    own copy of the study (and its buffer arena) for all samples.
+
+    The loaded samples wait in a bounded queue between the stages, so that
+    the number of samples in flight (loaded or being evaluated) is limited
+    by ``max_pending``, and their total size by ``max_pending_bytes``. Loading
+    is paused while either limit is reached (backpressure). Samples which are
+    being loaded are accounted for by the size of the largest sample loaded
+    so far (so the first sample is loaded alone). A sample is always
+    admitted if no other sample is in flight, so that a single sample larger
+    than ``max_pending_bytes`` is still processed. With process workers, the
+    images of each sample are counted twice, since they are kept by the
+    I/O stage until the evaluation is completed, and copied to the compute
+    worker.
+
+    :param num_workers:
+        The number of compute workers (defaults to the number of CPUs).
+
+    :param num_loaders:
+        The number of threads used to load the images.
+
+    :param max_pending:
+        The maximum number of samples in flight (defaults to twice the
+        number of compute workers).
+
+    :param max_pending_bytes:
+        The maximum total size of the images of the samples in flight,
+        including their copies sent to process workers (in bytes, or
+        ``None`` for no limit).
+
+    :param use_threads:
+        Whether the compute workers are threads instead of processes.
+
+    :param scheduler:
+        Determines the order in which the samples are loaded, and records
+        the run times of their evaluation (see :class:`CostScheduler`).
+
+    :param timeout:
+        The wall-clock time limit for the evaluation of a single sample,
+        excluding loading the images (see :func:`process`, requires process
+        workers).
+
+    :param retries:
+        The number of times the evaluation of a sample is repeated if an
+        exception is raised (see :func:`process`).
+
+    :param failures:
+        The list of failed samples (see :func:`process`). Loading errors are
+        treated like evaluation errors, and samples whose compute worker
+        process died are recorded as failures too.
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * num_workers
+    assert num_workers >= 1 and num_loaders >= 1 and max_pending >= 1
+    assert retries >= 0
+    assert timeout is None or not use_threads, (
+        'timeouts require process workers'
+    )
+    workers: Union[concurrent.futures.ThreadPoolExecutor, _WorkerPool]
+    if use_threads:
+        workers = concurrent.futures.ThreadPoolExecutor(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(pickle.dumps(study),),
+        )
+    else:
+        workers = _WorkerPool(
+            num_workers,
+            timeout,
+            initializer=_init_worker,
+            initargs=(pickle.dumps(study),),
+        )
+
+    # The arguments submitted to process workers are kept by the pool until
+    # the result is available, in addition to the copy of the worker
+    num_copies = 1 if use_threads else 2
+
+    def load(sample_id: Any) -> Tuple[Any, Optional[SampleFailure]]:
+        return _run_isolated(
+            sample_id,
+            lambda: (get_expected_func(sample_id), get_actual_func(sample_id)),
+            retries,
+        )
+
+    if scheduler is not None:
+        sample_ids = scheduler.order(sample_ids)
+    pending_ids = iter(sample_ids)
+    loading: Dict[concurrent.futures.Future, Any] = dict()
+    loaded: Deque[Tuple[Any, Image, Image, int]] = collections.deque()
+    computing: Dict[concurrent.futures.Future, int] = dict()
+    pending_bytes = 0
+    max_sample_bytes: Optional[int] = None
+    num_processed = 0
+    with concurrent.futures.ThreadPoolExecutor(num_loaders) as loaders, \
+            workers:
+        while True:
+
+            # Admit samples to the I/O stage, unless the limits are reached
+            # (samples which are being loaded are accounted for by the size
+            # of the largest sample loaded so far)
+            while len(loading) < num_loaders and (
+                len(loading) + len(loaded) + len(computing) == 0 or (
+                    len(loading) + len(loaded) + len(computing) < max_pending
+                    and (
+                        max_pending_bytes is None or (
+                            max_sample_bytes is not None
+                            and pending_bytes
+                            + (len(loading) + 1) * max_sample_bytes
+                            <= max_pending_bytes
+                        )
+                    )
+                )
+            ):
+                sample_id = next(pending_ids, _END)
+                if sample_id is _END:
+                    break
+                loading[loaders.submit(load, sample_id)] = sample_id
+
+            # Pass loaded samples to idle compute workers
+            while loaded and len(computing) < num_workers:
+                sample_id, expected, actual, nbytes = loaded.popleft()
+                computing[workers.submit(
+                    _process_pipeline_sample,
+                    sample_id,
+                    expected,
+                    actual,
+                    is_actual_unique,
+                    is_expected_unique,
+                    retries,
+                )] = nbytes
+
+            if len(loading) + len(computing) == 0:
+                break
+            done, _ = concurrent.futures.wait(
+                list(loading) + list(computing),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                if future in loading:
+                    sample_id = loading.pop(future)
+                    images, failure = future.result()
+                    if failure is not None:
+                        _handle_failure(failure, failures)
+                        num_processed += 1
+                        if callback is not None:
+                            callback(num_processed, len(sample_ids))
+                        yield sample_id
+                        continue
+                    expected, actual = images
+                    nbytes = num_copies * (expected.nbytes + actual.nbytes)
+                    loaded.append((sample_id, expected, actual, nbytes))
+                    pending_bytes += nbytes
+                    max_sample_bytes = max((max_sample_bytes or 0, nbytes))
+
+            for future in done:
+                if future in computing:
+                    pending_bytes -= computing.pop(future)
+                    result = future.result()
+                    sample_id, sample_study, run_time, cost, failure = result
+                    if scheduler is not None:
+                        scheduler.record(sample_id, run_time, cost)
+                    if failure is not None:
+                        _handle_failure(failure, failures)
+                    else:
+                        assert sample_study is not None
+                        study.merge(sample_study, sample_ids=[sample_id])
+                    num_processed += 1
+                    if callback is not None:
+                        callback(num_processed, len(sample_ids))
+                    yield sample_id
+
+
+def pipeline_all(*args, **kwargs):
+    for _ in pipeline(*args, **kwargs):
+        pass
+
+
+# Marks the end of the sample identifiers
+_END = object()
+
+
+def _init_worker(study_data: bytes) -> None:
+    _worker.study = pickle.loads(study_data)
+
+
+def _process_pipeline_sample(
+    sample_id: Any,
+    expected: Image,
+    actual: Image,
+    is_actual_unique: bool,
+    is_expected_unique: bool,
+    retries: int,
+) -> _SampleResult:
+    return _evaluate_sample(
+        sample_id,
+        None,
+        lambda: (expected, actual),
+        is_actual_unique,
+        is_expected_unique,
+        retries,
+    )
+
+
+def _process_sample(
+    sample_id: Any,
+    study: Optional[Study],
+    get_actual_func: Callable[[Any], Image],
+    get_expected_func: Callable[[Any], Image],
+    is_actual_unique: bool,
+    is_expected_unique: bool,
+    retries: int,
+) -> _SampleResult:
+    return _evaluate_sample(
+        sample_id,
+        study,
+        lambda: (
+            dill.loads(get_expected_func)(sample_id),
+            dill.loads(get_actual_func)(sample_id),
+        ),
+        is_actual_unique,
+        is_expected_unique,
+        retries,
+    )
+
+
+def _evaluate_sample(
     sample_id: Any,
+    study: Optional[Study],
+    load: Callable[[], Tuple[Image, Image]],
     is_actual_unique: bool,
     is_expected_unique: bool,
-):
-    actual   = dill.loads(get_actual_func  )(sample_id)
-    expected = dill.loads(get_expected_func)(sample_id)
-    study.set_expected(expected, unique=is_expected_unique)
-    study.process(sample_id, actual, unique=is_actual_unique)
-    return sample_id, study
+    retries: int,
+) -> _SampleResult:
+    """
+    Evaluates a sample using ``study``, or using the study of the current
+    worker if ``None`` (see :func:`_init_worker`).
+
+    :returns:
+        Tuple of the sample identifier, the study with the results, the run
+        time, the cost of the sample (see :func:`image_cost`), and the
+        failure record (the study and the cost are ``None`` for failures).
+    """
+    started_at = time.perf_counter()
+
+    def evaluate() -> Tuple[Study, float]:
+        expected, actual = load()
+        if study is not None:
+            study.set_expected(expected, unique=is_expected_unique)
+            study.process(sample_id, actual, unique=is_actual_unique)
+            return study, _estimate_cost(expected.size, study.expected_objects)
+
+        # The study of the worker is reused, so the results are passed on
+        # using a separate study
+        worker_study: Study = _worker.study
+        worker_study.reset()
+        worker_study.set_expected(expected, unique=is_expected_unique)
+        worker_study.process(sample_id, actual, unique=is_actual_unique)
+        sample_study = Study()
+        sample_study.merge(worker_study, sample_ids=[sample_id])
+        return sample_study, _estimate_cost(
+            expected.size,
+            worker_study.expected_objects,
+        )
+
+    result, failure = _run_isolated(sample_id, evaluate, retries)
+    sample_study, cost = (None, None) if result is None else result
+    run_time = time.perf_counter() - started_at
+    return sample_id, sample_study, run_time, cost, failure
+
+
+def _handle_failure(
+    failure: SampleFailure,
+    failures: Optional[List[SampleFailure]],
+) -> None:
+    if failures is None:
+        raise SampleError(failure)
+    failures.append(failure)
+
+
+def _run_isolated(
+    sample_id: Any,
+    func: Callable[[], Any],
+    retries: int,
+) -> Tuple[Any, Optional[SampleFailure]]:
+    """
+    Calls ``func`` (at most ``retries`` times repeated if an exception is
+    raised), and returns its result, or a record of the failure.
+    """
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return func(), None
+        except Exception as error:
+            if attempts > retries:
+                return None, SampleFailure(
+                    sample_id,
+                    'error',
+                    type(error).__name__,
+                    str(error),
+                    traceback.format_exc(),
+                    attempts,
+                )
+
+
+def _imap_supervised(
+    num_workers: int,
+    timeout: Optional[float],
+    func: Callable[..., Any],
+    sample_ids: Sequence[Any],
+    args: Sequence[Any],
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Sequence[Any] = (),
+) -> Iterator[Any]:
+    """
+    Evaluates ``func(sample_id, *args)`` for each sample using a
+    :class:`_WorkerPool`, and yields the results in the order of completion.
+    """
+    with _WorkerPool(num_workers, timeout, initializer, initargs) as workers:
+        futures = [
+            workers.submit(func, sample_id, *args) for sample_id in sample_ids
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+# A sample submitted to a worker pool (see :class:`_WorkerPool`): the future
+# of the result, the sample identifier, the function, and its arguments
+_Task = Tuple[
+    concurrent.futures.Future,
+    Any,
+    Callable[..., Any],
+    Tuple[Any, ...],
+]
+
+
+class _Worker:
+    """
+    Worker process of a :class:`_WorkerPool`, which evaluates one sample at
+    a time.
+    """
+
+    def __init__(
+        self,
+        initializer: Optional[Callable[..., None]],
+        initargs: Sequence[Any],
+    ) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_run_worker,
+            args=(child_conn, initializer, initargs),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        # The future and the identifier of the sample which is evaluated,
+        # and when the evaluation was started
+        self.task: Optional[Tuple[concurrent.futures.Future, Any]] = None
+        self.started_at = 0.
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            with contextlib.suppress(OSError):
+                self.conn.send(None)
+        self.process.join()
+        self.conn.close()
+
+
+def _run_worker(
+    conn: multiprocessing.connection.Connection,
+    initializer: Optional[Callable[..., None]],
+    initargs: Sequence[Any],
+) -> None:
+    """
+    Main function of the process of a :class:`_Worker`.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # handled by the parent
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:  # the parent process died
+            break
+        if task is None:
+            break
+        func, args = task
+        conn.send(func(*args))
+
+
+class _WorkerPool:
+    """
+    Pool of worker processes, which are supervised by a thread of the
+    parent process.
+
+    Each worker evaluates a single sample at a time. If the evaluation of a
+    sample exceeds the ``timeout``, or if the worker dies (e.g., killed due
+    to lack of memory), the worker is terminated and replaced by a new one,
+    and the sample is recorded as failed (see :class:`SampleFailure`).
+    Since the workers are supervised from outside, this also takes effect
+    while a worker is running native code.
+
+    The functions submitted to the pool (see :meth:`submit`) must return
+    tuples of the sample identifier, the study, the run time, the cost, and
+    the failure record (like :func:`_evaluate_sample`).
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        timeout: Optional[float],
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Sequence[Any] = (),
+    ) -> None:
+        self.timeout = timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._lock = threading.Lock()
+        self._queue: Deque[_Task] = collections.deque()
+        self._shutdown = False
+        self._cancel = False
+        self._wakeup_reader, self._wakeup_writer = multiprocessing.Pipe(
+            duplex=False,
+        )
+        self._workers = [
+            _Worker(initializer, initargs) for _ in range(num_workers)
+        ]
+        self._supervisor = threading.Thread(
+            target=self._supervise,
+            daemon=True,
+        )
+        self._supervisor.start()
+
+    def __enter__(self) -> '_WorkerPool':
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        self.shutdown(cancel=exc_type is not None)
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        sample_id: Any,
+        *args: Any,
+    ) -> concurrent.futures.Future:
+        """
+        Schedules ``func(sample_id, *args)`` to be evaluated by the next
+        idle worker, and returns the future of its result.
+        """
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            assert not self._shutdown, 'pool was shut down'
+            self._queue.append((future, sample_id, func, (sample_id,) + args))
+            self._wakeup_writer.send(None)
+        return future
+
+    def shutdown(self, cancel: bool = False) -> None:
+        """
+        Stops the workers after all submitted samples were evaluated, or
+        immediately if ``cancel`` is ``True`` (the pending futures are
+        cancelled).
+        """
+        with self._lock:
+            self._shutdown = True
+            self._cancel = self._cancel or cancel
+            self._wakeup_writer.send(None)
+        self._supervisor.join()
+
+    def _supervise(self) -> None:
+        while True:
+            with self._lock:
+                if self._cancel or (self._shutdown and not self._queue and all(
+                    worker.task is None for worker in self._workers
+                )):
+                    break
+                for worker in self._workers:
+                    if worker.task is None and self._queue:
+                        self._dispatch(worker, *self._queue.popleft())
+
+            # Wait for results, crashes, the next deadline, or submissions
+            busy = [worker for worker in self._workers if worker.task]
+            wait_timeout = None
+            if self.timeout is not None and busy:
+                deadline = min(worker.started_at for worker in busy)
+                deadline += self.timeout
+                wait_timeout = max((deadline - time.perf_counter(), 0))
+            ready = multiprocessing.connection.wait(
+                [self._wakeup_reader]
+                + [worker.conn for worker in busy]
+                + [worker.process.sentinel for worker in busy],
+                wait_timeout,
+            )
+            if self._wakeup_reader in ready:
+                while self._wakeup_reader.poll():
+                    self._wakeup_reader.recv()
+            for worker in busy:
+                self._check(worker)
+
+        # Stop the workers, and cancel the remaining samples
+        for worker in self._workers:
+            if worker.task is not None:
+                worker.task[0].cancel()
+            worker.stop(kill=self._cancel)
+        with self._lock:
+            for task in self._queue:
+                task[0].cancel()
+            self._queue.clear()
+
+    def _dispatch(
+        self,
+        worker: _Worker,
+        future: concurrent.futures.Future,
+        sample_id: Any,
+        func: Callable[..., Any],
+        args: Tuple[Any, ...],
+    ) -> None:
+        worker.task = (future, sample_id)
+        worker.started_at = time.perf_counter()
+        try:
+            worker.conn.send((func, args))
+        except BrokenPipeError:  # the worker died (see _check)
+            pass
+        except Exception as error:  # the arguments cannot be pickled
+            worker.task = None
+            future.set_exception(error)
+
+    def _check(self, worker: _Worker) -> None:
+        """
+        Completes the sample of a busy worker if the result is available, or
+        if the worker died or exceeded the time limit (the worker is replaced
+        in the latter cases).
+        """
+        assert worker.task is not None
+        future, sample_id = worker.task
+        run_time = time.perf_counter() - worker.started_at
+        if worker.conn.poll():
+            try:
+                result = worker.conn.recv()
+            except (EOFError, OSError):
+                pass
+            else:
+                worker.task = None
+                future.set_result(result)
+                return
+        if worker.process.is_alive():
+            if self.timeout is None or run_time < self.timeout:
+                return
+            failure = SampleFailure(
+                sample_id,
+                'timeout',
+                'TimeoutError',
+                f'time limit of {self.timeout} seconds exceeded',
+                '',
+                1,
+            )
+        else:
+            failure = SampleFailure(
+                sample_id,
+                'crash',
+                'ChildProcessError',
+                f'worker exited with code {worker.process.exitcode}',
+                '',
+                1,
+            )
+        worker.task = None
+        worker.stop(kill=True)
+        self._workers[self._workers.index(worker)] = _Worker(
+            self._initializer,
+            self._initargs,
+        )
+        future.set_result((sample_id, None, run_time, None, failure))
 
 
 class _Sequence:
@@ -152,7 +1056,11 @@ class _fork:  # namespace
                 signal.SIGINT,
                 signal.SIG_IGN,
             )
-            pool = multiprocessing.Pool(processes=processes)
+            pool = multiprocessing.Pool(
+                processes=processes,
+                initializer=kwargs.get('initializer'),
+                initargs=kwargs.get('initargs', ()),
+            )
             signal.signal(signal.SIGINT, original_sigint_handler)
 
         _fork._forked = True
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import functools
+from typing import (
+    Any,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+import scipy.spatial
+
+from segmetrics import _cache
+from segmetrics.matching import assign_pairs
+from segmetrics.measure import MultiMeasure
+from segmetrics.typing import LabelImage
+
+MatchingMode = Literal[
+    'centroid',
+    'mask',
+]
+
+
+def object_centroids(image: LabelImage) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the labels and the centroids of the objects of a label image
+    (cached).
+
+    The centroids are computed in a single pass over the foreground pixels.
+
+    :returns:
+        Tuple of the object labels (sorted in ascending order) and the
+        centroids of the objects (one row per object).
+    """
+    def compute() -> Tuple[np.ndarray, np.ndarray]:
+        flat = image.reshape(-1)
+        foreground = np.flatnonzero(flat)
+        labels = flat[foreground].astype(np.intp)
+        areas = np.bincount(labels)
+        present = np.flatnonzero(areas)
+        centroids = np.empty((len(present), image.ndim))
+        coords = np.unravel_index(foreground, image.shape)
+        for dim, coord in enumerate(coords):
+            sums = np.bincount(labels, weights=coord, minlength=len(areas))
+            centroids[:, dim] = sums[present] / areas[present]
+        return present.astype(np.int64), centroids
+    return _cache.get((image,), 'centroids', compute)
+
+
+def match_points(
+    expected: np.ndarray,
+    actual: np.ndarray,
+    max_distance: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes an optimal one-to-one matching of two sets of points.
+
+    Only pairs of points within ``max_distance`` of each other are eligible
+    for matching. The candidate pairs are determined using k-d trees. Among
+    all one-to-one matchings of eligible pairs, a matching with the largest
+    number of pairs is chosen, and among those, the one with the smallest
+    total distance (see :func:`segmetrics.matching.assign_pairs`).
+
+    :param expected:
+        The ground truth points (one row per point).
+
+    :param actual:
+        The segmented points (one row per point).
+
+    :returns:
+        The indices of the matched ground truth points, the indices of the
+        corresponding segmented points, and the distance of each matched
+        pair.
+    """
+    if len(expected) == 0 or len(actual) == 0:
+        return np.zeros(0, np.intp), np.zeros(0, np.intp), np.zeros(0)
+    pairs = scipy.spatial.cKDTree(expected).sparse_distance_matrix(
+        scipy.spatial.cKDTree(actual),
+        max_distance,
+        output_type='ndarray',
+    )
+    ref = pairs['i'].astype(np.intp)
+    seg = pairs['j'].astype(np.intp)
+    distances = pairs['v'].astype(float)
+    selected = assign_pairs(ref, seg, _matching_weights(distances, ref, seg))
+    return ref[selected], seg[selected], distances[selected]
+
+
+def _matching_weights(
+    distances: np.ndarray,
+    ref: np.ndarray,
+    seg: np.ndarray,
+) -> np.ndarray:
+    """
+    Returns positive pair weights, so that a matching with the maximum total
+    weight has the largest number of pairs, and the smallest total distance
+    among those.
+    """
+    if len(distances) == 0:
+        return distances
+    max_pairs = min((len(np.unique(ref)), len(np.unique(seg))))
+    offset = (max_pairs + 1) * (distances.max() + 1)
+    return offset - distances
+
+
+class PointDetection(MultiMeasure):
+    r"""
+    Yields detection measures for ground truth point annotations (e.g.,
+    centroid clicks), which are matched to the segmented objects.
+
+    The ground truth points are set via
+    :meth:`segmetrics.study.Study.set_expected_points` (or by passing an
+    array of point coordinates with one row per point to
+    :meth:`set_expected`). The points are matched one-to-one to the
+    segmented objects, yielding the true positives :math:`\mathrm{TP}`
+    (matched points), the false positives :math:`\mathrm{FP}` (unmatched
+    segmented objects), and the false negatives :math:`\mathrm{FN}`
+    (unmatched points). The outputs are:
+
+    - ``TP``, ``FP``, and ``FN``: The numbers of true positives, false
+      positives, and false negatives.
+    - ``Precision``, ``Recall``, and ``F1``: The detection precision,
+      recall, and F1 score.
+    - ``Loc. error``: The mean distance between the matched points and the
+      centroids of the segmented objects (localization error).
+
+    The numbers are accumulated across all images by the postprocessing of
+    the outputs.
+
+    :param max_distance:
+        If ``mode`` is ``centroid``, a point and a segmented object are only
+        matched if the distance between the point and the centroid of the
+        object is at most ``max_distance`` (in pixels).
+
+    :param mode:
+        Whether points are matched to the centroids of the segmented objects
+        (``centroid``, using an optimal assignment which maximizes the number
+        of matches and then minimizes the total distance), or to the objects
+        they are located in (``mask``, the closest point is chosen for objects
+        which contain multiple points).
+    """
+
+    #: Indicates that the ground truth is given by points.
+    accepts_points = True
+
+    def __init__(
+        self,
+        max_distance: float = 5,
+        mode: MatchingMode = 'centroid',
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        assert mode in ('centroid', 'mask')
+        assert max_distance >= 0
+        self.max_distance = max_distance
+        self.mode = mode
+        self.add_output('TP', postprocess=self._postprocess('tp'))
+        self.add_output('FP', postprocess=self._postprocess('fp'))
+        self.add_output('FN', postprocess=self._postprocess('fn'))
+        self.add_output(
+            'Precision',
+            postprocess=self._postprocess('precision'),
+        )
+        self.add_output('Recall', postprocess=self._postprocess('recall'))
+        self.add_output('F1', postprocess=self._postprocess('f1'))
+        self.add_output(
+            'Loc. error',
+            postprocess=self._postprocess('error'),
+        )
+
+    def set_expected(self, expected: np.ndarray) -> None:
+        expected = np.asarray(expected, float)
+        assert expected.ndim == 2, 'points must be given as (n, ndim) array'
+        super().set_expected(expected)
+
+    def compute_outputs(
+        self,
+        actual: LabelImage,
+    ) -> Dict[str, List[Tuple[int, int, int, float]]]:
+        assert self.expected.shape[1] == actual.ndim, (
+            'points have wrong dimensions'
+        )
+        labels, centroids = object_centroids(actual)
+        if self.mode == 'centroid':
+            distances = match_points(
+                self.expected,
+                centroids,
+                self.max_distance,
+            )[2]
+        else:
+            distances = self._match_masks(actual, labels, centroids)
+        tp = len(distances)
+        fp = len(labels) - tp
+        fn = len(self.expected) - tp
+        counts = (tp, fp, fn, float(distances.sum()))
+        return {key: [counts] for key in self.outputs()}
+
+    def _match_masks(
+        self,
+        actual: LabelImage,
+        labels: np.ndarray,
+        centroids: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Matches the points to the objects they are located in, and returns
+        the distances of the matched points to the object centroids.
+        """
+        pixels = np.round(self.expected).astype(np.intp)
+        inside = np.all(
+            np.logical_and(pixels >= 0, pixels < actual.shape),
+            axis=1,
+        )
+        ref = np.flatnonzero(inside)
+        seg = actual[tuple(pixels[inside].T)].astype(np.intp)
+        ref, seg = ref[seg > 0], np.searchsorted(labels, seg[seg > 0])
+        distances = np.linalg.norm(
+            self.expected[ref] - centroids[seg],
+            axis=1,
+        )
+        selected = assign_pairs(
+            ref,
+            seg,
+            _matching_weights(distances, ref, seg),
+        )
+        return distances[selected]
+
+    @staticmethod
+    def _postprocess(value: str) -> Any:
+        return functools.partial(_postprocess_points, value)
+
+
+def _postprocess_points(
+    value: str,
+    values: List[Tuple[int, int, int, float]],
+) -> List[float]:
+    if len(values) == 0:
+        return list()
+    tp, fp, fn, distance_sum = (sum(c) for c in zip(*values))
+    return [_compute_point_value(value, tp, fp, fn, distance_sum)]
+
+
+def _compute_point_value(
+    value: str,
+    tp: int,
+    fp: int,
+    fn: int,
+    distance_sum: float,
+) -> float:
+    result: Optional[float] = dict(
+        tp=tp,
+        fp=fp,
+        fn=fn,
+    ).get(value)
+    if result is not None:
+        return result
+    if value == 'precision':
+        return tp / (tp + fp) if tp + fp > 0 else 1.
+    if value == 'recall':
+        return tp / (tp + fn) if tp + fn > 0 else 1.
+    if value == 'f1':
+        denominator = 2 * tp + fp + fn
+        return 2 * tp / denominator if denominator > 0 else 1.
+    if value == 'error':
+        return distance_sum / tp if tp > 0 else np.nan
+    raise ValueError(f'Unknown value: "{value}"')
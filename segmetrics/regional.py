@@ -1,19 +1,37 @@
+from __future__ import annotations
+
 import warnings
 from typing import (
+    Dict,
     List,
+    Literal,
     Optional,
+    Sequence,
     Set,
     Tuple,
 )
 
 import numpy as np
 import sklearn.metrics
-
+from skimage import morphology as morph
+
+from segmetrics import _cache
+from segmetrics._aux import (
+    compact_labels,
+    foreground,
+    foreground_counts,
+    object_index,
+)
 from segmetrics.measure import (
     AsymmetricMeasureMixin,
     CorrespondanceFunction,
     ImageMeasureMixin,
     Measure,
+    MultiMeasure,
+)
+from segmetrics.overlap import (
+    OverlapTable,
+    overlap_table,
 )
 from segmetrics.typing import (
     BinaryImage,
@@ -21,6 +39,53 @@ from segmetrics.typing import (
 )
 
 
+def _dice(ref: int, res: int, intersection: int) -> float:
+    denominator = ref + res
+    if denominator > 0:
+        return (2. * intersection) / denominator
+    else:
+        return 1.  # result of zero/zero division
+
+
+def _jaccard(ref: int, res: int, intersection: int) -> float:
+    numerator = float(intersection)
+    denominator = ref + res - numerator
+    if denominator > 0:
+        return numerator / denominator
+    else:
+        return 1.  # result of zero/zero division
+
+
+def _compute_rand_parts(
+    expected: LabelImage,
+    actual: LabelImage,
+) -> Tuple[float, float, float, float]:
+    ref, res, intersection = foreground_counts(expected, actual)
+    RS = np.empty((2, 2), np.float64)
+    RS[1, 1] = intersection
+    RS[1, 0] = ref - intersection
+    RS[0, 1] = res - intersection
+    RS[0, 0] = expected.size - ref - res + intersection
+    rows = RS.sum(axis=1, keepdims=True)
+    cols = RS.sum(axis=0, keepdims=True)
+    a = (RS * (RS - 1)).sum()
+    b = (RS * (cols - RS)).sum()
+    c = (RS * (rows - RS)).sum()
+    d = (RS * (expected.size - rows - cols + RS)).sum()
+    return a, b, c, d
+
+
+def _get_skeleton(image: LabelImage) -> BinaryImage:
+    """
+    Returns the skeleton of the foreground of a label image (cached).
+    """
+    return _cache.get(
+        (image,),
+        'skeleton',
+        lambda: morph.skeletonize(foreground(image)),
+    )
+
+
 class RegionalImageMeasure(ImageMeasureMixin, Measure):
     """
     Defines an image-level performance measure which is based on the regions
@@ -59,14 +124,10 @@ class Dice(RegionalImageMeasure):
     .. _F1 score: https://en.wikipedia.org/wiki/F-score
     """
 
+    crop_invariant = True
+
     def compute(self, actual: LabelImage) -> List[float]:
-        ref = self.expected > 0
-        res = actual        > 0
-        denominator = ref.sum() + res.sum()
-        if denominator > 0:
-            return [(2. * np.logical_and(ref, res).sum()) / denominator]
-        else:
-            return [1.]  # result of zero/zero division
+        return [_dice(*foreground_counts(self.expected, actual))]
 
 
 class JaccardCoefficient(RegionalImageMeasure):
@@ -91,18 +152,91 @@ class JaccardCoefficient(RegionalImageMeasure):
     :math:`\mathrm{DC}` values, but not for sums or mean values thereof.
     """
 
+    crop_invariant = True
+
+    def compute(self, actual: LabelImage) -> List[float]:
+        return [_jaccard(*foreground_counts(self.expected, actual))]
+
+    def default_name(self) -> str:
+        return 'Jaccard coef.'
+
+
+class CenterlineDice(RegionalImageMeasure):
+    r"""
+    Defines the centerline Dice coefficient (clDice).
+
+    Let :math:`R` be the set of all image pixels corresponding to the ground
+    truth segmentation, and :math:`S` the set of those corresponding to the
+    segmentation result. Moreover, let :math:`\operatorname{sk}(R)` and
+    :math:`\operatorname{sk}(S)` be the skeletons of :math:`R` and
+    :math:`S`. The topology precision :math:`T_P = \left|\operatorname{sk}(S)
+    \cap R\right| / \left|\operatorname{sk}(S)\right|` is the fraction of
+    the segmented skeleton within the ground truth, and the topology
+    sensitivity :math:`T_S = \left|\operatorname{sk}(R) \cap S\right| /
+    \left|\operatorname{sk}(R)\right|` is the fraction of the ground truth
+    skeleton within the segmentation. Then, the centerline Dice coefficient is
+    defined as
+
+    .. math:: \mathrm{clDice} = \frac
+        {2 \cdot T_P \cdot T_S}
+        {T_P + T_S}
+
+    and attains values between :math:`0` and :math:`1`. Higher values
+    correspond to better segmentation performance. The skeletons are
+    computed only once per image (including the reversed and symmetric
+    variants of other measures which use the same images).
+
+    References:
+
+    - S\. Shit, J. C. Paetzold, A. Sekuboyina, et al., "clDice - a novel
+      topology-preserving loss function for tubular structure segmentation,"
+      in Proc. IEEE Conf. Comput. Vis. Pattern Recognit., 2021,
+      pp. 16560-16569.
+    """
+
+    crop_invariant = True
+
+    state_attributes = RegionalImageMeasure.state_attributes + (
+        'expected_binary',
+        'expected_skeleton',
+        'expected_skeleton_size',
+    )
+
+    def set_expected(self, expected: LabelImage) -> None:
+        super().set_expected(expected)
+        self.expected_binary: BinaryImage = foreground(expected)
+        self.expected_skeleton = _get_skeleton(expected)
+        self.expected_skeleton_size = int(
+            np.count_nonzero(self.expected_skeleton),
+        )
+
     def compute(self, actual: LabelImage) -> List[float]:
-        ref = self.expected > 0
-        res = actual        > 0
-        numerator = np.logical_and(ref, res).sum().astype(np.float32)
-        denominator = ref.sum() + res.sum() - numerator
+        actual_skeleton = _get_skeleton(actual)
+        actual_skeleton_size = int(np.count_nonzero(actual_skeleton))
+        precision = self._fraction(
+            int(np.count_nonzero(self.expected_binary[actual_skeleton])),
+            actual_skeleton_size,
+        )
+        sensitivity = self._fraction(
+            int(np.count_nonzero(foreground(actual)[self.expected_skeleton])),
+            self.expected_skeleton_size,
+        )
+        if precision + sensitivity > 0:
+            return [
+                2 * precision * sensitivity / (precision + sensitivity)
+            ]
+        else:
+            return [0.]
+
+    @staticmethod
+    def _fraction(numerator: int, denominator: int) -> float:
         if denominator > 0:
-            return [numerator / denominator]
+            return numerator / denominator
         else:
-            return [1.]  # result of zero/zero division
+            return 1.  # result of zero/zero division
 
     def default_name(self) -> str:
-        return 'Jaccard coef.'
+        return 'clDice'
 
 
 class RandIndex(RegionalImageMeasure):
@@ -151,24 +285,7 @@ class RandIndex(RegionalImageMeasure):
         """
         Computes the values :math:`a`, :math:`b`, :math:`c`, :math:`d`.
         """
-        R: BinaryImage
-        S: BinaryImage
-        R, S = (self.expected > 0), (actual > 0)
-        a, b, c, d = 0., 0., 0., 0.
-        RS = np.empty((2, 2), np.uint64)
-        RS[0, 0] = ((R == 0) * (S == 0)).sum()
-        RS[0, 1] = ((R == 0) * (S == 1)).sum()
-        RS[1, 0] = ((R == 1) * (S == 0)).sum()
-        RS[1, 1] = ((R == 1) * (S == 1)).sum()
-        for rs in np.ndindex(RS.shape):
-            n : int = RS[rs]
-            Ri: int = rs[0]
-            Si: int = rs[1]
-            a += n * (np.sum((Ri == R) * (Si == S)) - 1)
-            b += n *  np.sum((Ri != R) * (Si == S))
-            c += n *  np.sum((Ri == R) * (Si != S))
-            d += n *  np.sum((Ri != R) * (Si != S))
-        return a, b, c, d
+        return _compute_rand_parts(self.expected, actual)
 
     def default_name(self) -> str:
         return 'Rand'
@@ -235,6 +352,240 @@ class JaccardIndex(RandIndex):
         return 'Jaccard index'
 
 
+class PixelOverlap(MultiMeasure):
+    """
+    Yields the Dice coefficient (output ``Dice``, see :class:`Dice`) and the
+    Jaccard coefficient (output ``Jaccard coef.``, see
+    :class:`JaccardCoefficient`) from a single count of the foreground
+    pixels.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.add_output('Dice')
+        self.add_output('Jaccard coef.')
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[float]]:
+        counts = foreground_counts(self.expected, actual)
+        return {
+            'Dice': [_dice(*counts)],
+            'Jaccard coef.': [_jaccard(*counts)],
+        }
+
+
+class PairCounting(MultiMeasure):
+    """
+    Yields the Rand index (output ``Rand``, see :class:`RandIndex`) and the
+    Jaccard index (output ``Jaccard index``, see :class:`JaccardIndex`) from
+    a single computation of the pair counts.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.add_output('Rand')
+        self.add_output('Jaccard index')
+
+    def compute_outputs(self, actual: LabelImage) -> Dict[str, List[float]]:
+        a, b, c, d = _compute_rand_parts(self.expected, actual)
+        return {
+            'Rand': [(a + d) / float(a + b + c + d)],
+            'Jaccard index': [(a + d) / float(b + c + d)],
+        }
+
+
+class OverlapTableMeasure(Measure):
+    """
+    Defines a performance measure which is derived from the sparse overlap
+    table of the ground truth and the segmented objects (see
+    :class:`~segmetrics.overlap.OverlapTable`), in :math:`O(n + m)` time
+    for :math:`n` pixels and :math:`m` overlapping label pairs.
+
+    The overlap table is the intermediate representation of the measure: the
+    tables of all images are merged by the :meth:`postprocess` method (see
+    :meth:`~segmetrics.overlap.OverlapTable.concatenate`), so that the
+    dataset-level values correspond to the concatenation of all images.
+    """
+
+    def compute(self, actual: LabelImage) -> List[OverlapTable]:
+        """
+        Computes the overlap table of the label images.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of overlap tables.
+        """
+        return [overlap_table(self.expected, actual)]
+
+    def postprocess(self, values: List[OverlapTable]) -> List[float]:
+        if len(values) == 0:
+            return list()
+        elif len(values) == 1:
+            return [self.compute_value(values[0])]
+        else:
+            return [self.compute_value(OverlapTable.concatenate(values))]
+
+    def compute_value(self, table: OverlapTable) -> float:
+        """
+        Computes the value of the measure from an overlap table.
+        """
+        return NotImplemented
+
+
+def _pair_counts(table: OverlapTable) -> Tuple[float, float, float, float]:
+    """
+    Returns the numbers of pixel pairs within the same object in both label
+    images, in the ground truth, in the segmentation result, and the total
+    number of pixel pairs.
+    """
+    def pairs(counts: np.ndarray) -> float:
+        counts = counts.astype(float)
+        return float((counts * (counts - 1)).sum() / 2)
+    n = float(table.counts.sum())
+    return (
+        pairs(table.counts),
+        pairs(table.ref_areas),
+        pairs(table.seg_areas),
+        n * (n - 1) / 2,
+    )
+
+
+def _xlogx(counts: np.ndarray) -> float:
+    r"""
+    Returns the sum of :math:`x \log_2 x` over all non-zero counts.
+    """
+    counts = counts[counts > 0].astype(float)
+    return float((counts * np.log2(counts)).sum())
+
+
+class InstanceRandIndex(OverlapTableMeasure):
+    """
+    Defines the Rand index of the object labels.
+
+    In contrast to :class:`RandIndex`, which only distinguishes the
+    foreground and the background, each object (and the background) is
+    regarded as a separate cluster of pixels. The Rand index is the fraction
+    of pixel pairs which are either within the same cluster or within
+    different clusters in both label images.
+    """
+
+    def compute_value(self, table: OverlapTable) -> float:
+        both, ref, seg, total = _pair_counts(table)
+        if total > 0:
+            return (total + 2 * both - ref - seg) / total
+        else:
+            return 1.  # result of zero/zero division
+
+    def default_name(self) -> str:
+        return 'Inst. Rand'
+
+
+class InstanceAdjustedRandIndex(OverlapTableMeasure):
+    """
+    Defines the adjusted Rand index of the object labels (see
+    :class:`InstanceRandIndex`), which is corrected for chance.
+
+    This yields the same values as :class:`AdjustedRandIndex`, but is
+    computed from the sparse overlap table.
+    """
+
+    def compute_value(self, table: OverlapTable) -> float:
+        both, ref, seg, total = _pair_counts(table)
+        expected_both = ref * seg / total if total > 0 else 0.
+        max_both = (ref + seg) / 2
+        if max_both == expected_both:
+            return 1.  # both label images consist of a single cluster
+        else:
+            return (both - expected_both) / (max_both - expected_both)
+
+    def default_name(self) -> str:
+        return 'Inst. ARI'
+
+
+class VariationOfInformation(OverlapTableMeasure):
+    r"""
+    Defines the variation of information (VI) proposed by Meilă (2007).
+
+    Let :math:`R` and :math:`S` be the object labels of the pixels in the
+    ground truth and the segmentation result (the background is regarded as
+    another object). Then, the variation of information is defined as
+
+    .. math:: \mathrm{VI} = \underbrace{H(S \mid R)}_{\text{split}}
+        + \underbrace{H(R \mid S)}_{\text{merge}},
+
+    where :math:`H` denotes the conditional entropy (in bits). The split
+    component measures over-segmentation, and the merge component measures
+    under-segmentation. Lower values correspond to better segmentation
+    performance.
+
+    :param component:
+        Whether the total variation of information (``total``), or only its
+        split (``split``) or merge (``merge``) component is computed.
+
+    References:
+
+    - M\. Meilă, "Comparing clusterings—an information based distance,"
+      Journal of Multivariate Analysis, vol. 98, no. 5, pp. 873–895, 2007.
+    """
+
+    def __init__(
+        self,
+        component: Literal['total', 'split', 'merge'] = 'total',
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        assert component in ('total', 'split', 'merge')
+        self.component = component
+
+    def compute_value(self, table: OverlapTable) -> float:
+        n = float(table.counts.sum())
+        if n == 0:
+            return 0.
+        joint = _xlogx(table.counts)
+        split = max(((_xlogx(table.ref_areas) - joint) / n, 0.))
+        merge = max(((_xlogx(table.seg_areas) - joint) / n, 0.))
+        if self.component == 'split':
+            return split
+        elif self.component == 'merge':
+            return merge
+        else:
+            return split + merge
+
+    def default_name(self) -> str:
+        if self.component == 'total':
+            return 'VI'
+        else:
+            return f'VI ({self.component})'
+
+
+def _get_seg_statistics(
+    expected: LabelImage,
+    actual: LabelImage,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the sizes of the ground truth objects and the Jaccard
+    coefficients of their matching segmented objects, ordered by the labels
+    of the ground truth objects (cached).
+
+    A segmented object is matching if it covers more than half of the ground
+    truth object. The Jaccard coefficient is 0 if there is no such object.
+
+    The areas of the objects are tabulated by label, so sparse labels (e.g.,
+    if :attr:`Study.relabel <segmetrics.study.Study.relabel>` is disabled) are
+    compacted first, which preserves the order of the objects.
+    """
+    def compute() -> Tuple[np.ndarray, np.ndarray]:
+        table = overlap_table(
+            compact_labels(expected),
+            compact_labels(actual),
+        ).objects()
+        matches = table.counts > 0.5 * table.ref_areas[table.ref]
+        jaccards = np.zeros(len(table.ref_areas))
+        ref, seg, iou = table.iou()
+        jaccards[ref[matches]] = iou[matches]
+        ref_labels = np.flatnonzero(table.ref_areas[1:]) + 1
+        return table.ref_areas[ref_labels], jaccards[ref_labels]
+    return _cache.get((expected, actual), 'seg_statistics', compute)
+
+
 class ISBIScore(AsymmetricMeasureMixin, Measure):
     r"""
     Defines the SEG performance measure (used in the ISBI Cell Tracking
@@ -271,35 +622,28 @@ class ISBIScore(AsymmetricMeasureMixin, Measure):
         self.min_ref_size = min_ref_size
 
     def compute(self, actual: LabelImage) -> List[float]:
-        results: List[float] = list()
-        for ref_label in range(1, self.expected.max() + 1):
-
-            # The reference connected component
-            ref_cc = (self.expected == ref_label)
-
-            ref_cc_size = ref_cc.sum()
-            ref_cc_half_size = 0.5 * ref_cc_size
+        ref_sizes, jaccards = _get_seg_statistics(self.expected, actual)
+        return jaccards[ref_sizes >= self.min_ref_size].tolist()
 
-            if ref_cc_size < self.min_ref_size:
-                continue
+    @classmethod
+    def sweep(cls, min_ref_sizes: Sequence[int], **kwargs) -> List[ISBIScore]:
+        """
+        Returns a SEG measure for each of the given ``min_ref_sizes``.
 
-            # The segmented object we compare the reference to
-            actual_cc = None
+        The sizes of the ground truth objects and the Jaccard coefficients of
+        their matching segmented objects are computed only once per sample
+        and are shared by all returned measures. Sharing relies on the cache
+        of intermediate results, which is tied to the images of a single call
+        of :meth:`Study.process <segmetrics.study.Study.process>`. Each
+        measure is reported under its own name when added to a
+        :class:`~segmetrics.study.Study`.
 
-            for actual_candidate_label in set(actual[ref_cc]) - {0}:
-                actual_candidate_cc = (actual == actual_candidate_label)
-                overlap = float(
-                    np.logical_and(actual_candidate_cc, ref_cc).sum()
-                )
-                if overlap > ref_cc_half_size:
-                    actual_cc = actual_candidate_cc
-                    break
-            if actual_cc is None:
-                jaccard = 0
-            else:
-                jaccard = overlap / np.logical_or(ref_cc, actual_cc).sum()
-            results.append(jaccard)
-        return results
+        Keyword arguments are passed through to the constructor.
+        """
+        return [
+            cls(min_ref_size=min_ref_size, **kwargs)
+            for min_ref_size in min_ref_sizes
+        ]
 
     def default_name(self) -> str:
         name = 'SEG'
@@ -340,26 +684,37 @@ class AggregatedJaccardCoefficient(AsymmetricMeasureMixin, Measure):
         The final performance values are obtained via the :meth:`postprocess`
         method for the list of numerator and denominator values.
         """
-        ref_labels = frozenset(self.expected.reshape(-1)) - {0}
-        seg_labels = frozenset(actual.reshape(-1)) - {0}
+        ref_index = object_index(self.expected)
+        seg_index = object_index(actual)
 
-        seg_used: Set[np.integer] = set()
+        seg_used: Set[int] = set()
         c, u = 0, 0
-        for ref_label in ref_labels:
+        for ref_label in ref_index.labels:
 
-            # The reference connected component
-            ref_cc = (self.expected == ref_label)
+            # The reference connected component (cropped to its bounding box)
+            ref_slice, ref_cc = ref_index.mask(ref_label)
+            ref_cc_size = ref_index.area(ref_label)
 
             # Determine the segmented object we compare the reference to
             jc_max = -np.inf
             jc_max_numerator = 0
-            jc_max_denominator = ref_cc.sum()
-            jc_max_label: Optional[np.integer] = None
-            for actual_candidate_label in frozenset(actual[ref_cc]) - {0}:
-                actual_candidate_cc = (actual == actual_candidate_label)
+            jc_max_denominator = ref_cc_size
+            jc_max_label: Optional[int] = None
+            candidate_labels, overlaps = np.unique(
+                actual[ref_slice][ref_cc],
+                return_counts=True,
+            )
+            for actual_candidate_label, overlap in zip(
+                candidate_labels,
+                overlaps,
+            ):
+                if actual_candidate_label == 0:
+                    continue
                 jc_numerator, jc_denominator = (
-                    np.logical_and(actual_candidate_cc, ref_cc).sum(),
-                    np.logical_or(actual_candidate_cc, ref_cc).sum(),
+                    overlap,
+                    ref_cc_size
+                    + seg_index.area(actual_candidate_label)
+                    - overlap,
                 )
                 jc = jc_numerator / jc_denominator
 
@@ -377,8 +732,9 @@ class AggregatedJaccardCoefficient(AsymmetricMeasureMixin, Measure):
             if jc_max_label is not None:
                 seg_used.add(jc_max_label)
 
-        for seg_label in seg_labels - seg_used:
-            u += (actual == seg_label).sum()
+        for seg_label in seg_index.labels:
+            if seg_label not in seg_used:
+                u += seg_index.area(seg_label)
 
         return [(c, u)]
 
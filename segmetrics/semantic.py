@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+from typing import (
+    Dict,
+    List,
+    Literal,
+    Union,
+)
+
+import numpy as np
+
+from segmetrics import _cache
+from segmetrics._aux import chunks
+from segmetrics.arena import scratch
+from segmetrics.measure import (
+    Measure,
+    MultiMeasure,
+)
+from segmetrics.typing import LabelImage
+
+AverageType = Union[Literal['micro', 'macro'], int]
+
+
+def confusion_matrix(
+    expected: LabelImage,
+    actual: LabelImage,
+    num_classes: int,
+) -> np.ndarray:
+    """
+    Returns the confusion matrix of two class label maps (cached).
+
+    The matrix is computed in a single pass using ``np.bincount`` (in chunks
+    along the first axis for large images). The rows correspond to the ground
+    truth classes, the columns to the classes of the segmentation result.
+
+    :param num_classes:
+        The number of classes (including the background class ``0``). The
+        class labels must range from ``0`` to ``num_classes - 1``.
+    """
+    assert expected.shape == actual.shape
+
+    def compute() -> np.ndarray:
+        assert expected.min(initial=0) >= 0 and actual.min(initial=0) >= 0
+        assert expected.max(initial=0) < num_classes, 'invalid class label'
+        assert actual.max(initial=0) < num_classes, 'invalid class label'
+        counts = np.zeros(num_classes ** 2, np.int64)
+        for chunk in chunks(expected.shape):
+            ref = expected[chunk].reshape(-1)
+            with scratch(ref.shape, np.intp) as keys:
+                np.multiply(
+                    ref,
+                    num_classes,
+                    out=keys,
+                    dtype=np.intp,
+                    casting='unsafe',
+                )
+                np.add(
+                    keys,
+                    actual[chunk].reshape(-1),
+                    out=keys,
+                    casting='unsafe',
+                )
+                counts += np.bincount(keys, minlength=num_classes ** 2)
+        return counts.reshape(num_classes, num_classes)
+    return _cache.get(
+        (expected, actual),
+        ('confusion_matrix', num_classes),
+        compute,
+    )
+
+
+class ConfusionMatrixMeasure(Measure):
+    """
+    Defines a performance measure for multi-class semantic segmentation,
+    which is derived from the confusion matrix of the class label maps.
+
+    The confusion matrix is the intermediate representation of the measure:
+    the matrices of all images are summed up by the :meth:`postprocess`
+    method, so that the dataset-level values correspond to micro averaging
+    over the images.
+
+    The images passed to :meth:`set_expected` and :meth:`compute` are class
+    label maps (not object label images). When used within a study, the
+    class labels are retained (the study does not relabel the images, see
+    :attr:`~segmetrics.study.Study.relabel`).
+
+    :param num_classes:
+        The number of classes (including the background class ``0``).
+
+    :param average:
+        Either the class label for which the measure is computed, or the
+        average over all classes (``macro``, classes which are absent from
+        both class label maps are skipped), or the measure computed from the
+        pooled pixels of all classes (``micro``).
+
+    :param include_background:
+        Whether the background class ``0`` is included in the averages.
+    """
+
+    retains_labels = True
+
+    def __init__(
+        self,
+        num_classes: int,
+        average: AverageType = 'macro',
+        include_background: bool = False,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        assert num_classes >= 2
+        assert average in ('micro', 'macro') or (
+            isinstance(average, int) and 0 <= average < num_classes
+        ), f'invalid average: {average}'
+        self.num_classes = num_classes
+        self.average = average
+        self.include_background = include_background
+
+    def compute(self, actual: LabelImage) -> List[np.ndarray]:
+        """
+        Computes the confusion matrix of the class label maps.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of confusion matrices.
+        """
+        return [confusion_matrix(self.expected, actual, self.num_classes)]
+
+    def postprocess(self, values: List[np.ndarray]) -> List[float]:
+        if len(values) == 0:
+            return list()
+        else:
+            return [self.compute_value(np.sum(values, axis=0))]
+
+    def compute_value(self, matrix: np.ndarray) -> float:
+        """
+        Computes the value of the measure from a confusion matrix.
+        """
+        tp = np.diagonal(matrix).astype(float)
+        fp = matrix.sum(axis=0) - tp
+        fn = matrix.sum(axis=1) - tp
+        if isinstance(self.average, int):
+            classes = [self.average]
+        elif self.include_background:
+            classes = list(range(self.num_classes))
+        else:
+            classes = list(range(1, self.num_classes))
+        tp, fp, fn = tp[classes], fp[classes], fn[classes]
+        if self.average == 'micro':
+            return self.compute_class_value(tp.sum(), fp.sum(), fn.sum())
+        present = self.is_class_present(tp, fp, fn)
+        if present.any():
+            return float(np.mean([
+                self.compute_class_value(*counts)
+                for counts in zip(tp[present], fp[present], fn[present])
+            ]))
+        else:
+            return 1.  # result of zero/zero division
+
+    def compute_class_value(self, tp: float, fp: float, fn: float) -> float:
+        """
+        Computes the value of the measure from the numbers of true positive,
+        false positive, and false negative pixels of a class (or of the
+        pooled pixels of all classes).
+        """
+        return NotImplemented
+
+    def is_class_present(
+        self,
+        tp: np.ndarray,
+        fp: np.ndarray,
+        fn: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Tells which classes are included in the macro average, given the
+        numbers of true positive, false positive, and false negative pixels
+        of the classes (by default, the classes which occur in the ground
+        truth or the segmentation result).
+        """
+        return (tp + fp + fn) > 0
+
+    def _name_suffix(self) -> str:
+        if isinstance(self.average, int):
+            return f'[{self.average}]'
+        else:
+            return f' ({self.average})'
+
+
+class MultiClassDice(ConfusionMatrixMeasure):
+    r"""
+    Defines the Dice coefficient for multi-class semantic segmentation.
+
+    For each class, the Dice coefficient is
+
+    .. math:: \mathrm{DC} = \frac
+        {2 \cdot \mathrm{TP}}
+        {2 \cdot \mathrm{TP} + \mathrm{FP} + \mathrm{FN}},
+
+    where :math:`\mathrm{TP}`, :math:`\mathrm{FP}`, and :math:`\mathrm{FN}`
+    are the numbers of true positive, false positive, and false negative
+    pixels of the class (see :class:`~segmetrics.regional.Dice`).
+    """
+
+    def compute_class_value(self, tp: float, fp: float, fn: float) -> float:
+        denominator = 2 * tp + fp + fn
+        if denominator > 0:
+            return float(2 * tp / denominator)
+        else:
+            return 1.  # result of zero/zero division
+
+    def default_name(self) -> str:
+        return f'Dice{self._name_suffix()}'
+
+
+class MultiClassIoU(ConfusionMatrixMeasure):
+    r"""
+    Defines the intersection over union (Jaccard coefficient) for
+    multi-class semantic segmentation.
+
+    For each class, the intersection over union is
+
+    .. math:: \mathrm{IoU} = \frac
+        {\mathrm{TP}}
+        {\mathrm{TP} + \mathrm{FP} + \mathrm{FN}},
+
+    where :math:`\mathrm{TP}`, :math:`\mathrm{FP}`, and :math:`\mathrm{FN}`
+    are the numbers of true positive, false positive, and false negative
+    pixels of the class (see
+    :class:`~segmetrics.regional.JaccardCoefficient`).
+    """
+
+    def compute_class_value(self, tp: float, fp: float, fn: float) -> float:
+        denominator = tp + fp + fn
+        if denominator > 0:
+            return float(tp / denominator)
+        else:
+            return 1.  # result of zero/zero division
+
+    def default_name(self) -> str:
+        return f'IoU{self._name_suffix()}'
+
+
+class MultiClassAccuracy(ConfusionMatrixMeasure):
+    r"""
+    Defines the pixel accuracy for multi-class semantic segmentation.
+
+    For each class, the accuracy is the fraction of the pixels of the class
+    which are classified correctly,
+
+    .. math:: \mathrm{Acc} = \frac
+        {\mathrm{TP}}
+        {\mathrm{TP} + \mathrm{FN}}.
+
+    The micro average is the overall pixel accuracy, and the macro average is
+    the balanced accuracy (averaged over the classes which occur in the
+    ground truth).
+    """
+
+    def compute_class_value(self, tp: float, fp: float, fn: float) -> float:
+        denominator = tp + fn
+        if denominator > 0:
+            return float(tp / denominator)
+        else:
+            return 1.  # result of zero/zero division
+
+    def is_class_present(
+        self,
+        tp: np.ndarray,
+        fp: np.ndarray,
+        fn: np.ndarray,
+    ) -> np.ndarray:
+        return (tp + fn) > 0
+
+    def default_name(self) -> str:
+        return f'Accuracy{self._name_suffix()}'
+
+
+class SemanticOverlap(MultiMeasure):
+    """
+    Yields the per-class, macro-averaged, and micro-averaged Dice
+    coefficients and IoU values (see :class:`MultiClassDice` and
+    :class:`MultiClassIoU`), and the overall pixel accuracy (see
+    :class:`MultiClassAccuracy`), from a single confusion matrix for each
+    image.
+
+    :param num_classes:
+        The number of classes (including the background class ``0``).
+
+    :param include_background:
+        Whether the results for the background class ``0`` are included.
+    """
+
+    retains_labels = True
+
+    def __init__(
+        self,
+        num_classes: int,
+        include_background: bool = False,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.num_classes = num_classes
+        first_class = 0 if include_background else 1
+        averages: List[AverageType] = ['macro', 'micro']
+        averages += list(range(first_class, num_classes))
+        measures: List[ConfusionMatrixMeasure] = list()
+        for average in averages:
+            measures.append(MultiClassDice(
+                num_classes, average, include_background,
+            ))
+            measures.append(MultiClassIoU(
+                num_classes, average, include_background,
+            ))
+        measures.append(MultiClassAccuracy(num_classes, 'micro', True))
+        for measure in measures:
+            self.add_output(
+                measure.default_name(),
+                postprocess=measure.postprocess,
+            )
+
+    def compute_outputs(
+        self,
+        actual: LabelImage,
+    ) -> Dict[str, List[np.ndarray]]:
+        matrix = confusion_matrix(self.expected, actual, self.num_classes)
+        return {key: [matrix] for key in self.outputs()}
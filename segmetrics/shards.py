@@ -0,0 +1,465 @@
+import ast
+import concurrent.futures
+import itertools
+import os
+import pickle
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from segmetrics.study import Study
+
+#: The version of the shard file format written by :func:`write_shard`.
+FORMAT_VERSION: int = 1
+
+PathLike = Union[str, os.PathLike]
+
+
+class _Column:
+    """
+    The results of a performance measure for a sequence of samples.
+
+    The values of all samples are concatenated. Scalar values are stored as
+    a single numeric array, and tuples of scalar values as one numeric array
+    per tuple element. Other values are stored as an object array.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        lengths: np.ndarray,
+        fields: List[np.ndarray],
+    ) -> None:
+        assert kind in ('scalar', 'tuple', 'object')
+        self.kind = kind
+        self.lengths = lengths
+        self.fields = fields
+
+    @property
+    def size(self) -> int:
+        return int(self.lengths.sum())
+
+    @staticmethod
+    def encode(results: Sequence[List[Any]]) -> '_Column':
+        """
+        Creates a column from the lists of values of the samples.
+        """
+        lengths = np.fromiter(
+            (len(values) for values in results), np.int64, len(results),
+        )
+        values = list(itertools.chain(*results))
+        if all(_is_scalar(value) for value in values):
+            field = _numeric_field(values)
+            if field is not None:
+                return _Column('scalar', lengths, [field])
+        elif all(isinstance(value, tuple) for value in values):
+            arity = len(values[0])
+            if all(
+                len(value) == arity and all(_is_scalar(x) for x in value)
+                for value in values
+            ):
+                fields = [
+                    _numeric_field([value[pos] for value in values])
+                    for pos in range(arity)
+                ]
+                if all(field is not None for field in fields):
+                    return _Column('tuple', lengths, fields)  # type: ignore
+        return _Column('object', lengths, [_object_field(values)])
+
+    def decode(self) -> List[Any]:
+        """
+        Returns the concatenated values of all samples.
+        """
+        if self.kind == 'tuple':
+            return list(zip(*[field.tolist() for field in self.fields]))
+        else:
+            return self.fields[0].tolist()
+
+    def to_object(self) -> '_Column':
+        return _Column('object', self.lengths, [_object_field(self.decode())])
+
+    def take(self, selection: np.ndarray) -> '_Column':
+        """
+        Returns the column of the selected samples (in the given order).
+        """
+        starts = np.cumsum(self.lengths) - self.lengths
+        lengths = self.lengths[selection]
+        offsets = np.cumsum(lengths) - lengths
+        indices = (
+            np.repeat(starts[selection] - offsets, lengths)
+            + np.arange(lengths.sum(), dtype=np.int64)
+        )
+        return _Column(
+            self.kind,
+            lengths,
+            [field[indices] for field in self.fields],
+        )
+
+    @staticmethod
+    def concat(columns: Sequence['_Column']) -> '_Column':
+        """
+        Concatenates the columns of several sequences of samples.
+        """
+        nonempty = [column for column in columns if column.size > 0]
+        layouts = {(column.kind, len(column.fields)) for column in nonempty}
+        if len(layouts) > 1:
+            nonempty = [column.to_object() for column in nonempty]
+        template = nonempty[0] if nonempty else columns[0]
+        return _Column(
+            template.kind,
+            np.concatenate([column.lengths for column in columns]),
+            [
+                np.concatenate([column.fields[pos] for column in nonempty])
+                if nonempty else field
+                for pos, field in enumerate(template.fields)
+            ],
+        )
+
+
+class Shard:
+    """
+    Columnar representation of the results of a study.
+
+    Shards are used to evaluate a large dataset on several nodes (e.g., of a
+    batch cluster). Each node evaluates a part of the dataset and writes its
+    study using :func:`write_shard`, and the shards are then combined using
+    :func:`reduce_shards`. In contrast to merging the studies one by one
+    (see :meth:`segmetrics.study.Study.merge`), shards are concatenated
+    column by column, and the per-sample lists of the study are only created
+    once for the combined results.
+
+    The performance measures are stored in pickled form, and are unpickled
+    only when a shard is converted back to a study (see :meth:`to_study`).
+    """
+
+    def __init__(
+        self,
+        sample_ids: List[Any],
+        num_objects: np.ndarray,
+        measures: bytes,
+        columns: Dict[str, _Column],
+    ) -> None:
+
+        #: The identifiers of the samples.
+        self.sample_ids = sample_ids
+
+        #: The numbers of objects in the ground truth of the samples.
+        self.num_objects = num_objects
+
+        #: The pickled performance measures (a dictionary which maps the
+        #: names of the measures to the measures).
+        self.measures = measures
+
+        self._columns = columns
+
+    def __len__(self) -> int:
+        return len(self.sample_ids)
+
+    @property
+    def measure_names(self) -> List[str]:
+        """
+        The names of the performance measures.
+        """
+        return list(self._columns.keys())
+
+    @staticmethod
+    def from_study(study: Study) -> 'Shard':
+        """
+        Creates a shard from the results of a study.
+        """
+        sample_ids = list(study._sample_ids)
+        return Shard(
+            sample_ids,
+            np.array(
+                [study._num_objects[sample_id] for sample_id in sample_ids],
+                np.int64,
+            ).reshape(-1),
+            pickle.dumps(study.measures),
+            {
+                measure_name: _Column.encode([
+                    study._results[measure_name][sample_id]
+                    for sample_id in sample_ids
+                ])
+                for measure_name in study.measures
+            },
+        )
+
+    def to_study(self) -> Study:
+        """
+        Creates a study from the results of this shard.
+        """
+        study = Study()
+        measures = pickle.loads(self.measures)
+        for measure_name in self.measure_names:
+            study.add_measure(measures[measure_name], name=measure_name)
+            column = self._columns[measure_name]
+            values = column.decode()
+            offsets = np.cumsum(column.lengths).tolist()
+            study._results[measure_name].update(zip(
+                self.sample_ids,
+                (
+                    values[start:stop]
+                    for start, stop in zip([0] + offsets, offsets)
+                ),
+            ))
+        study._num_objects = dict(
+            zip(self.sample_ids, self.num_objects.tolist()),
+        )
+        study._sample_ids = dict.fromkeys(self.sample_ids)
+        return study
+
+    @staticmethod
+    def concat(shards: Sequence['Shard'], replace: bool = True) -> 'Shard':
+        """
+        Concatenates several shards.
+
+        :param shards:
+            The shards to be concatenated (all shards must have the same
+            performance measures).
+
+        :param replace:
+            Whether samples which occur in several shards are to be replaced
+            by their last occurrence (``True``) or prohibited (``False``).
+            The order of the samples is determined by their first
+            occurrence.
+        """
+        assert len(shards) > 0
+        measure_names = shards[0].measure_names
+        for shard in shards[1:]:
+            if shard.measure_names != measure_names:
+                raise ValueError(
+                    'Shards with different performance measures cannot be'
+                    f' concatenated ({measure_names}, {shard.measure_names})'
+                )
+        sample_ids = list(itertools.chain(
+            *[shard.sample_ids for shard in shards]
+        ))
+        num_objects = np.concatenate([shard.num_objects for shard in shards])
+        columns = {
+            measure_name: _Column.concat([
+                shard._columns[measure_name] for shard in shards
+            ])
+            for measure_name in measure_names
+        }
+
+        # Determine the last occurrence of each sample (in the order of the
+        # first occurrences)
+        index: Dict[Any, int] = dict()
+        for pos, sample_id in enumerate(sample_ids):
+            index[sample_id] = pos
+        if len(index) < len(sample_ids):
+            if not replace:
+                raise ValueError('Shards with conflicting sample identifiers')
+            selection = np.fromiter(index.values(), np.int64, len(index))
+            sample_ids = list(index.keys())
+            num_objects = num_objects[selection]
+            columns = {
+                measure_name: column.take(selection)
+                for measure_name, column in columns.items()
+            }
+        return Shard(sample_ids, num_objects, shards[0].measures, columns)
+
+    def save(self, path: PathLike) -> None:
+        """
+        Writes this shard to a file (see :func:`write_shard`).
+        """
+        arrays: Dict[str, np.ndarray] = dict(
+            format_version=np.array(FORMAT_VERSION),
+            sample_ids=np.array(
+                list(map(_encode_sample_id, self.sample_ids)),
+                dtype=str,
+            ),
+            num_objects=self.num_objects,
+            measures=np.frombuffer(self.measures, np.uint8),
+            measure_names=np.array(self.measure_names, dtype=str),
+        )
+        for pos, measure_name in enumerate(self.measure_names):
+            column = self._columns[measure_name]
+            arrays[f'column{pos}_kind'] = np.array(column.kind)
+            arrays[f'column{pos}_lengths'] = column.lengths
+            if column.kind == 'object':
+                arrays[f'column{pos}_field0'] = np.frombuffer(
+                    pickle.dumps(column.decode()), np.uint8,
+                )
+            else:
+                for field_pos, field in enumerate(column.fields):
+                    arrays[f'column{pos}_field{field_pos}'] = field
+
+        # The shard is written to a temporary file first, so that an
+        # interrupted write does not leave an incomplete shard behind
+        temp_path = f'{os.fspath(path)}.tmp{os.getpid()}'
+        with open(temp_path, 'wb') as fout:
+            np.savez(fout, **arrays)  # type: ignore[arg-type]
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path: PathLike) -> 'Shard':
+        """
+        Reads a shard from a file (see :func:`read_shard`).
+        """
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data['format_version'])
+            if version > FORMAT_VERSION:
+                raise ValueError(
+                    f'Unsupported shard format version: {version} ({path})'
+                )
+            sample_ids = [
+                ast.literal_eval(text) for text in data['sample_ids'].tolist()
+            ]
+            columns: Dict[str, _Column] = dict()
+            for pos, measure_name in enumerate(data['measure_names'].tolist()):
+                kind = str(data[f'column{pos}_kind'])
+                fields: List[np.ndarray] = list()
+                while f'column{pos}_field{len(fields)}' in data:
+                    fields.append(data[f'column{pos}_field{len(fields)}'])
+                if kind == 'object':
+                    fields = [_object_field(pickle.loads(fields[0].tobytes()))]
+                columns[measure_name] = _Column(
+                    kind, data[f'column{pos}_lengths'], fields,
+                )
+            return Shard(
+                sample_ids,
+                data['num_objects'],
+                data['measures'].tobytes(),
+                columns,
+            )
+
+
+def write_shard(study: Study, path: PathLike) -> None:
+    """
+    Writes the results of a study to a shard file.
+
+    Shard files are NumPy ``.npz`` archives, which store the results of each
+    performance measure in columns (see :class:`Shard`). The sample
+    identifiers must be Python literals (e.g., strings, numbers, or tuples
+    thereof).
+
+    Shard files contain the pickled performance measures, so only shard
+    files from trusted sources should be read.
+    """
+    Shard.from_study(study).save(path)
+
+
+def read_shard(path: PathLike) -> Study:
+    """
+    Reads a study from a shard file (see :func:`write_shard`).
+    """
+    return Shard.load(path).to_study()
+
+
+def reduce_shards(
+    shards: Sequence[Union[PathLike, Shard]],
+    fanout: int = 16,
+    num_workers: Optional[int] = None,
+    replace: bool = True,
+) -> Study:
+    """
+    Combines the results of several shards into a single study.
+
+    The shards are combined in a tree-like fashion, where groups of
+    ``fanout`` shards are read and concatenated in parallel, until a single
+    shard remains (see :meth:`Shard.concat`).
+
+    :param shards:
+        The shard files (see :func:`write_shard`) or shards to be combined.
+
+    :param fanout:
+        The number of shards combined at once.
+
+    :param num_workers:
+        The number of processes used to combine the shards (defaults to the
+        number of CPUs). Use ``1`` to combine the shards in the current
+        process.
+
+    :param replace:
+        Whether samples which occur in several shards are to be replaced by
+        their last occurrence (``True``) or prohibited (``False``).
+    """
+    assert len(shards) > 0
+    assert fanout >= 2
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    level: List[Union[PathLike, Shard]] = list(shards)
+    executor = (
+        concurrent.futures.ProcessPoolExecutor(num_workers)
+        if num_workers >= 2 and len(level) > fanout else None
+    )
+    try:
+        while len(level) > 1 or not isinstance(level[0], Shard):
+            groups = [
+                (level[pos:pos + fanout], replace)
+                for pos in range(0, len(level), fanout)
+            ]
+            if executor is None or len(groups) == 1:
+                level = list(map(_reduce_group, groups))
+            else:
+                level = list(executor.map(_reduce_group, groups))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    assert isinstance(level[0], Shard)
+    return level[0].to_study()
+
+
+def _reduce_group(
+    args: Tuple[Sequence[Union[PathLike, Shard]], bool],
+) -> Shard:
+    group, replace = args
+    return Shard.concat(
+        [
+            shard if isinstance(shard, Shard) else Shard.load(shard)
+            for shard in group
+        ],
+        replace,
+    )
+
+
+def _is_scalar(value: Any) -> bool:
+    return isinstance(value, (bool, int, float, np.bool_, np.number)) and (
+        not isinstance(value, (complex, np.complexfloating))
+    )
+
+
+def _numeric_field(values: List[Any]) -> Optional[np.ndarray]:
+    try:
+        field = np.asarray(values)
+    except OverflowError:
+        return None
+    if len(values) == 0:
+        return field.astype(float)
+    return field if field.dtype.kind in 'biuf' else None
+
+
+def _object_field(values: List[Any]) -> np.ndarray:
+    field = np.empty(len(values), object)
+    for pos, value in enumerate(values):
+        field[pos] = value
+    return field
+
+
+def _encode_sample_id(sample_id: Any) -> str:
+    if isinstance(sample_id, np.generic):
+        sample_id = sample_id.item()
+    elif isinstance(sample_id, tuple):
+        sample_id = tuple(
+            value.item() if isinstance(value, np.generic) else value
+            for value in sample_id
+        )
+    text = repr(sample_id)
+    try:
+        valid = ast.literal_eval(text) == sample_id
+    except (ValueError, SyntaxError):
+        valid = False
+    if not valid:
+        raise ValueError(
+            f'Sample identifier is not a Python literal: {sample_id!r}'
+        )
+    return text
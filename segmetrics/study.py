@@ -1,26 +1,42 @@
 from __future__ import annotations
 
+import collections.abc
+import contextlib
 import csv
 import io
 import itertools
-import math
 import sys
 from collections.abc import Sequence
 from typing import (
     Any,
     Callable,
     Dict,
+    Iterable,
+    Iterator,
     List,
     Literal,
     Optional,
     TextIO,
+    Tuple,
 )
 
 import numpy as np
 import scipy.stats.mstats
-import skimage.measure
 
-from segmetrics.measure import MeasureProtocol
+from segmetrics import _cache
+from segmetrics._aux import (
+    chunks,
+    count_objects,
+)
+from segmetrics.arena import BufferArena
+from segmetrics.labeling import label
+from segmetrics.measure import (
+    MeasureProtocol,
+    MultiMeasureProtocol,
+    release,
+)
+from segmetrics.panoptic import set_object_classes
+from segmetrics.tracking import TrackingAccuracy
 from segmetrics.typing import (
     Image,
     LabelImage,
@@ -32,28 +48,80 @@ except ImportError:
     pass
 
 
-def _get_labeled(narray: Image, unique: bool, img_hint: str) -> LabelImage:
+def _get_labeled(
+    narray: Image,
+    unique: bool,
+    img_hint: str,
+    neighbors: int = 4,
+) -> LabelImage:
     if issubclass(narray.dtype.type, np.integer):
         return narray
     elif narray.dtype == bool:
         assert not unique, f'if unique=True, {img_hint} dtype must be integer'
-        return _label(narray)
+        return _label(narray, neighbors=neighbors)
     else:
         raise AssertionError(f'illegal {img_hint} dtype {narray.dtype}')
 
 
-def _get_skimage_measure_label_bg_label() -> int:
+def _evaluation_view(image: Image) -> Image:
     """
-    Determines the background label generated by the ``label`` function of
-    ``skimage.measure``.
+    Returns a new view of ``image`` (without copying the data).
 
-    The value of the background label varies from version to version.
+    Artifacts derived from images are cached by the identity of the image
+    objects (see :mod:`segmetrics._cache`). Each call of
+    :meth:`Study.set_expected` and :meth:`Study.process` evaluates a new view,
+    so that the cached artifacts are tied to that call, and are never re-used
+    by later calls (even if the caller modifies its image in-place).
     """
-    return skimage.measure.label(np.array([[1, 0]]), background=0).min()
+    return image.squeeze().view()
+
+
+def _relabel(
+    image: LabelImage,
+) -> Tuple[LabelImage, Optional[np.ndarray]]:
+    r"""
+    Maps the object labels of ``image`` to the dense range :math:`1, \dots,
+    n` using the smallest sufficient unsigned integer data type.
 
+    The image is returned unchanged if its labels already are dense (or if
+    it contains negative labels). The mapping is monotonic, so the order of
+    the objects is preserved.
 
-# This is 1 in older versions and 0 in newer
-_SKIMAGE_MEASURE_LABEL_OFFSET: int = _get_skimage_measure_label_bg_label()
+    :returns:
+        Tuple of the relabeled image and an array of the original labels
+        (the value at position ``i`` is the original label of the object
+        labeled ``i`` in the relabeled image, and 0 for the background), or
+        ``None`` if the image is returned unchanged.
+    """
+    if image.size == 0 or image.min() < 0:
+        return image, None
+    max_label = image.max()
+    if max_label <= image.size:
+        presence = np.zeros(int(max_label) + 1, bool)
+        presence[0] = True
+        for chunk in chunks(image.shape):
+            presence[image[chunk].reshape(-1)] = True
+        labels = np.flatnonzero(presence).astype(image.dtype)
+    else:
+        labels = np.union1d(np.unique(image), [0]).astype(image.dtype)
+
+    # Labels are dense, there is nothing to be done
+    if labels[-1] == len(labels) - 1:
+        return image, None
+
+    # Indexing converts the labels to the index data type, so the lookup is
+    # carried out in chunks too
+    dtype = np.min_scalar_type(len(labels) - 1)
+    relabeled = np.empty(image.shape, dtype)
+    if max_label <= image.size:
+        lut = np.zeros(int(max_label) + 1, dtype)
+        lut[labels] = np.arange(len(labels), dtype=dtype)
+        for chunk in chunks(image.shape):
+            relabeled[chunk] = lut[image[chunk]]
+    else:
+        for chunk in chunks(image.shape):
+            relabeled[chunk] = np.searchsorted(labels, image[chunk])
+    return relabeled, labels
 
 
 def _label(im: Image, background: int = 0, neighbors: int = 4) -> LabelImage:
@@ -62,13 +130,11 @@ def _label(im: Image, background: int = 0, neighbors: int = 4) -> LabelImage:
 
     Returns a labeled version of `im` where `background` is labeled with
     0 and all other connected components are labeled with values larger
-    than or equal to 1.
+    than or equal to 1 (see :func:`segmetrics.labeling.label`).
     """
-    assert neighbors in (4, 8)
-    connectivity = int(math.log2(neighbors)) - 1
-    return skimage.measure.label(
-        im, background=background, connectivity=connectivity
-    ) - _SKIMAGE_MEASURE_LABEL_OFFSET
+    if background != 0:
+        im = im != background
+    return label(im, neighbors=neighbors)
 
 
 def _aggregate(
@@ -92,6 +158,18 @@ def _aggregate(
         raise ValueError(f'Unknown aggregation: "{measure.aggregation}"')
 
 
+def _is_same_frame(previous: Optional[np.ndarray], frame: Image) -> bool:
+    """
+    Tells whether a frame of a time-lapse sequence has the same contents as
+    the (copy of the) previous frame.
+    """
+    return previous is not None and (
+        previous.shape == frame.shape
+        and previous.dtype == frame.dtype
+        and np.array_equal(previous, frame)
+    )
+
+
 class Study:
     """
     Computes different performance measures for different image data.
@@ -103,11 +181,67 @@ class Study:
         self.measures: Dict[str, MeasureProtocol] = dict()
         self.csv_sample_id_column_name: str = 'Sample'
 
+        #: Whether sparse object labels are mapped to a dense range before
+        #: evaluation (see :meth:`set_expected` and :meth:`process`). The
+        #: labels are always retained if any of the performance measures
+        #: requires so (e.g., the class labels used by
+        #: :class:`~segmetrics.semantic.ConfusionMatrixMeasure`, see
+        #: :attr:`~segmetrics.measure.Measure.retains_labels`).
+        self.relabel: bool = True
+
+        #: The connectivity used to determine the connected components of
+        #: images passed with ``unique=False`` (``4`` or ``8``, see
+        #: :func:`segmetrics.labeling.label`).
+        self.neighbors: int = 4
+
+        #: The arena which provides the scratch buffers used by the
+        #: performance measures, so that temporaries are reused across images
+        #: of the same shape (see :class:`segmetrics.arena.BufferArena`).
+        self.arena: BufferArena = BufferArena()
+
+        # The cache of the artifacts derived from the evaluated images, which
+        # is only used while evaluating (see :meth:`_activate`)
+        self._artifacts = _cache.Scope()
+
+        #: Whether the per-sample state of the performance measures (e.g.,
+        #: artifacts derived from the images, see
+        #: :class:`~segmetrics.measure.SampleStateMixin`) and the cached
+        #: artifacts of the segmentation result are released after each
+        #: evaluated sample. The ground truth is set again for the next
+        #: sample, if required (the cached artifacts of the ground truth are
+        #: kept until the next call of :meth:`set_expected`, or
+        #: :meth:`release`). Per-sample outputs (e.g.,
+        #: :attr:`segmetrics.detection.FalsePositive.result`) are kept.
+        self.release_state: bool = True
+
+        #: The original labels of the objects of the ground truth set by the
+        #: last call of :meth:`set_expected` (see :meth:`get_original_labels`),
+        #: or ``None`` if no relabeling was required.
+        self.expected_labels: Optional[np.ndarray] = None
+
+        #: The original labels of the objects of the segmentation result of
+        #: the last call of :meth:`process` (see :meth:`get_original_labels`),
+        #: or ``None`` if no relabeling was required.
+        self.actual_labels: Optional[np.ndarray] = None
+
+        # The ground truth set by the last call of :meth:`set_expected` (or
+        # :meth:`set_expected_points`), and whether it is set for the measures
+        self._expected: Optional[np.ndarray] = None
+        self._is_expected_set = False
+
         self._num_objects: Dict[Any, int] = dict()
-        self._sample_ids: List[Any] = list()
+        # The identifiers of the evaluated samples (the dictionary serves as
+        # an insertion-ordered, hashed set)
+        self._sample_ids: Dict[Any, None] = dict()
         self._results: Dict[str, Dict[Any, List[Any]]] = dict()
         self._results_cache: Dict[str, List[Any]] = dict()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['_expected'] = None
+        state['_is_expected_set'] = False
+        return state
+
     def merge(
         self,
         other: Study,
@@ -128,23 +262,25 @@ class Study:
             Whether conflicting identifiers are to be replaced (``True``) or
             prohibited (``False``).
         """
+        if sample_ids == 'all':
+            sample_ids = list(other._sample_ids)
+        assert replace or self._sample_ids.keys().isdisjoint(sample_ids)
         for measure_name in other.measures:
             if measure_name not in self.measures.keys():
                 self.add_measure(
                     other.measures[measure_name],
                     name=measure_name
                 )
-            measure_sample_ids = other._results[measure_name].keys() \
-                if sample_ids == 'all' else sample_ids
-            for sample_id in measure_sample_ids:
-                assert replace or sample_id not in self._results[measure_name]
-                assert replace or sample_id not in self._num_objects
-                self._results[measure_name][sample_id] = list(
-                    other._results[measure_name][sample_id]
-                )
-                self._num_objects[sample_id] = other._num_objects[sample_id]
-                if sample_id not in self._sample_ids:
-                    self._sample_ids.append(sample_id)
+            other_results = other._results[measure_name]
+            self._results[measure_name].update(
+                (sample_id, list(other_results[sample_id]))
+                for sample_id in sample_ids
+            )
+        self._num_objects.update(
+            (sample_id, other._num_objects[sample_id])
+            for sample_id in sample_ids
+        )
+        self._sample_ids.update(dict.fromkeys(sample_ids))
         self._results_cache.clear()
 
     def add_measure(
@@ -177,6 +313,43 @@ class Study:
         self._results[name] = {None: list()}
         return name
 
+    def add_multi_measure(
+        self,
+        measure: MultiMeasureProtocol,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        """
+        Adds the outputs of a performance measure which yields several named
+        results from a single computation to this study (see
+        :class:`~segmetrics.measure.MultiMeasure`).
+
+        Each output is added like a separate performance measure (see
+        :meth:`add_measure`), but the values of all outputs are computed
+        at once.
+
+        :param measure:
+            The performance measure whose outputs are to be added.
+
+        :param prefix:
+            Prefix of the names used for the outputs (separated by a
+            whitespace from the default names of the outputs), or ``None``.
+
+        :return:
+            The names used for the outputs.
+        """
+        if not isinstance(measure, MultiMeasureProtocol):
+            raise ValueError(
+                'Argument "measure" must implement MultiMeasureProtocol'
+                f' ({type(measure)}, {measure})'
+            )
+        names: List[str] = list()
+        for output in measure.outputs().values():
+            name = output.default_name()
+            if prefix is not None:
+                name = f'{prefix} {name}'
+            names.append(self.add_measure(output, name))
+        return names
+
     def reset(self) -> None:
         """Resets all results computed so far in this study.
         """
@@ -190,6 +363,7 @@ class Study:
         self,
         expected: Image,
         unique: bool = True,
+        classes: Optional[LabelImage] = None,
     ) -> None:
         """
         Sets the expected ground truth segmentation result.
@@ -204,6 +378,13 @@ class Study:
 
         The image ``expected`` must be a numpy array of integral data type. It
         is also allowed to be boolean if and only if ``unique=False`` is used.
+        Volumetric images (e.g., 3D stacks) are evaluated natively, so that
+        objects extending over multiple slices are treated as such.
+
+        If :attr:`relabel` is ``True`` (the default) and none of the
+        performance measures retains the labels, sparse object labels (e.g.,
+        32-bit object identifiers) are mapped to a dense range before
+        evaluation. The original labels are kept in :attr:`expected_labels`.
 
         :param expected:
             An image containing object masks corresponding to the ground truth.
@@ -212,20 +393,102 @@ class Study:
             Whether the individual object masks are uniquely labeled.
             Providing ``False`` assumes that connected components correspond
             to individual objects (components of different labels are not
-            connected).
+            connected, see :attr:`neighbors`).
+
+        :param classes:
+            A class map of the same shape, which assigns a class to each
+            object (e.g., cell types, see
+            :func:`segmetrics.panoptic.set_object_classes`). Required by
+            class-restricted measures (e.g.,
+            :class:`segmetrics.panoptic.ClassInstanceMeasures`).
         """
         assert expected.min() == 0, 'mis-labeled ground truth'
-        expected = expected.squeeze()
-        assert expected.ndim == 2, (
+        expected = _evaluation_view(expected)
+        assert expected.ndim >= 2, (
             f'ground truth has wrong dimensions ({expected.ndim})'
         )
-        expected = _get_labeled(expected, unique, 'ground truth')
-        self.expected_objects = len(
-            frozenset(expected.reshape(-1)) - frozenset([0])
+        expected = _get_labeled(
+            expected, unique, 'ground truth', self.neighbors,
         )
-        for measure_name in self.measures:
-            measure = self.measures[measure_name]
-            measure.set_expected(expected)
+        if self._is_relabeling():
+            expected, self.expected_labels = _relabel(expected)
+        else:
+            self.expected_labels = None
+        if classes is not None:
+            set_object_classes(expected, classes.squeeze())
+        self._replace_expected(expected)
+        with self._activate():
+            self.expected_objects = count_objects(expected)
+            self._set_expected()
+
+    def set_expected_points(self, points: np.ndarray) -> None:
+        """
+        Sets the expected ground truth as point annotations (e.g., centroid
+        clicks), instead of a label image.
+
+        Only performance measures which accept point annotations can be used
+        (e.g., :class:`segmetrics.points.PointDetection`).
+
+        :param points:
+            The coordinates of the annotated objects (one row per object, one
+            column per image axis).
+        """
+        points = np.asarray(points, float)
+        assert points.ndim == 2, 'points must be given as (n, ndim) array'
+        for measure_name, measure in self.measures.items():
+            if not getattr(measure, 'accepts_points', False):
+                raise ValueError(
+                    f'Measure "{measure_name}" does not accept points'
+                )
+        self.expected_labels = None
+        self.expected_objects = len(points)
+        self._replace_expected(points)
+        self._set_expected()
+
+    def _set_expected(self) -> None:
+        """
+        Sets the ground truth for all performance measures.
+        """
+        assert self._expected is not None, 'ground truth was not set'
+        self._is_expected_set = False
+        for measure in self.measures.values():
+            measure.set_expected(self._expected)
+        self._is_expected_set = True
+
+    def release(self) -> None:
+        """
+        Releases the ground truth, the per-sample state of the performance
+        measures (see :class:`~segmetrics.measure.SampleStateMixin`), and the
+        buffers kept by the :attr:`arena`, so that only the configuration and
+        the results of this study are kept.
+
+        The ground truth must be set again before the next segmentation
+        result is processed.
+        """
+        self._release_measures()
+        self._replace_expected(None)
+        self.arena.clear()
+
+    def _replace_expected(self, expected: Optional[np.ndarray]) -> None:
+        """
+        Replaces the ground truth, and drops the cached artifacts derived
+        from the previous ground truth.
+        """
+        if self._expected is not None:
+            self._artifacts.evict(self._expected)
+        self._expected = expected
+
+    def _release_measures(self, actual: Optional[LabelImage] = None) -> None:
+        """
+        Releases the per-sample state of the performance measures, and the
+        cached artifacts derived from the segmentation result ``actual``
+        (if given).
+        """
+        self._is_expected_set = False
+        for measure in self.measures.values():
+            release(measure)
+        if actual is not None:
+            self._artifacts.evict(actual)
 
     def process(
         self,
@@ -233,6 +496,7 @@ class Study:
         actual: Image,
         unique: bool = True,
         replace: bool = True,
+        classes: Optional[LabelImage] = None,
     ) -> Dict[str, List[float]]:
         """
         Evaluates a segmentation result based on the previously set expected
@@ -247,6 +511,11 @@ class Study:
         The image ``actual`` must be a numpy array of integral data type. It
         is also allowed to be boolean if and only if ``unique=False`` is used.
 
+        If :attr:`relabel` is ``True`` (the default) and none of the
+        performance measures retains the labels, sparse object labels are
+        mapped to a dense range before evaluation. The original labels are
+        kept in :attr:`actual_labels`.
+
         :param sample_id:
             An arbitrary indentifier of the segmentation image (e.g., the
             filename).
@@ -259,29 +528,220 @@ class Study:
             Whether the individual object masks are uniquely labeled.
             Providing ``False`` assumes that connected components correspond
             to individual objects (components of different labels are not
-            connected).
+            connected, see :attr:`neighbors`).
 
         :param replace:
             Whether previous results computed for the same ``sample_id``
             should be replaced (``True``) or forbidden (``False``).
+
+        :param classes:
+            A class map of the same shape, which assigns a class to each
+            object (see :meth:`set_expected`).
+        """
+        actual = self._prepare_actual(actual, unique)
+        if classes is not None:
+            set_object_classes(actual, classes.squeeze())
+        return self._evaluate(sample_id, actual, replace)
+
+    def process_sequence(
+        self,
+        sequence_id: Any,
+        expected: Iterable[Image],
+        actual: Iterable[Image],
+        unique: bool = True,
+        replace: bool = True,
+        expected_parents: Optional[Dict[int, int]] = None,
+        actual_parents: Optional[Dict[int, int]] = None,
+    ) -> None:
+        """
+        Evaluates the segmentation results of a time-lapse sequence.
+
+        The results for frame ``t`` are recorded under the sample identifier
+        ``(sequence_id, t)``. If a frame has the same contents as the
+        previous frame (of the ground truth or the segmentation result,
+        respectively), the previous frame is re-used, so that all artifacts
+        derived from it (e.g., object indices and overlap tables) are re-used
+        as well. The frames are compared by contents (using a copy of the
+        previous frames), so readers are free to re-use their output buffers
+        for consecutive frames.
+
+        The object labels are used as track labels by tracking measures
+        (e.g., :class:`segmetrics.tracking.TrackingAccuracy`).
+
+        :param sequence_id:
+            An arbitrary identifier of the sequence.
+
+        :param expected:
+            The ground truth frames (e.g., a stack with the time along the
+            first axis, or an iterable of frames). See :meth:`set_expected`.
+
+        :param actual:
+            The segmented frames. See :meth:`process`. A ``ValueError`` is
+            raised if the numbers of frames differ.
+
+        :param unique:
+            Whether the individual object masks are uniquely labeled (see
+            :meth:`set_expected` and :meth:`process`).
+
+        :param replace:
+            Whether previous results computed for the same sample identifiers
+            should be replaced (``True``) or forbidden (``False``).
+
+        :param expected_parents:
+            The parent track labels of the ground truth tracks (indexed by
+            track label), or ``None`` if there are no divisions.
+
+        :param actual_parents:
+            The parent track labels of the segmented tracks.
+        """
+        tracking_measures = [
+            measure for measure in self.measures.values()
+            if isinstance(measure, TrackingAccuracy)
+        ]
+        if (
+            isinstance(expected, collections.abc.Sized)
+            and isinstance(actual, collections.abc.Sized)
+            and len(expected) != len(actual)
+        ):
+            raise ValueError(
+                f'Numbers of frames differ ({len(expected)} != {len(actual)})'
+            )
+        for measure in tracking_measures:
+            measure.set_sequence(sequence_id, expected_parents, actual_parents)
+
+        # Copies of the previous frames, and the prepared segmentation result
+        previous_expected: Optional[np.ndarray] = None
+        previous_actual: Optional[np.ndarray] = None
+        prepared_actual: Optional[LabelImage] = None
+        actual_labels: Optional[np.ndarray] = None
+        try:
+            for t, (expected_frame, actual_frame) in enumerate(
+                itertools.zip_longest(expected, actual),
+            ):
+                if expected_frame is None or actual_frame is None:
+                    raise ValueError(f'Numbers of frames differ (frame {t})')
+                if not _is_same_frame(previous_expected, expected_frame):
+                    self.set_expected(expected_frame, unique)
+                    previous_expected = expected_frame.copy()
+                if prepared_actual is None or not _is_same_frame(
+                    previous_actual,
+                    actual_frame,
+                ):
+                    if prepared_actual is not None:
+                        self._artifacts.evict(prepared_actual)
+                    prepared_actual = self._prepare_actual(
+                        actual_frame,
+                        unique,
+                    )
+                    actual_labels = self.actual_labels
+                    previous_actual = actual_frame.copy()
+                self.actual_labels = actual_labels
+                for measure in tracking_measures:
+                    measure.set_frame(
+                        t,
+                        self.expected_labels,
+                        self.actual_labels,
+                    )
+                self._evaluate(
+                    (sequence_id, t),
+                    prepared_actual,
+                    replace,
+                    release_actual=False,
+                )
+        finally:
+            if prepared_actual is not None:
+                self._artifacts.evict(prepared_actual)
+
+    @contextlib.contextmanager
+    def _activate(self) -> Iterator[None]:
+        """
+        Activates the :attr:`arena` and the cache of the artifacts derived
+        from the evaluated images.
+        """
+        with self.arena.activate(), self._artifacts.activate():
+            yield
+
+    def _is_relabeling(self) -> bool:
+        """
+        Tells whether sparse labels are mapped to a dense range (see
+        :attr:`relabel`).
+        """
+        return self.relabel and not any(
+            getattr(measure, 'retains_labels', False)
+            for measure in self.measures.values()
+        )
+
+    def _prepare_actual(self, actual: Image, unique: bool) -> LabelImage:
+        """
+        Labels and relabels a segmentation result (see :meth:`process`).
+        """
+        actual = _evaluation_view(actual)
+        assert actual.ndim >= 2, 'image has wrong dimensions'
+        actual = _get_labeled(actual, unique, 'image', self.neighbors)
+        if self._is_relabeling():
+            actual, self.actual_labels = _relabel(actual)
+        else:
+            self.actual_labels = None
+        return actual
+
+    def _evaluate(
+        self,
+        sample_id: Any,
+        actual: LabelImage,
+        replace: bool,
+        release_actual: bool = True,
+    ) -> Dict[str, List[float]]:
+        """
+        Evaluates a prepared segmentation result (see :meth:`process`).
+
+        If ``release_actual`` is ``False``, the cached artifacts of the
+        segmentation result are kept (e.g., for the next frame of a sequence,
+        see :meth:`process_sequence`).
         """
-        actual = actual.squeeze()
-        assert actual.ndim == 2, 'image has wrong dimensions'
-        actual = _get_labeled(actual, unique, 'image')
         assert replace or sample_id not in self._sample_ids
 
+        # The results are only stored once all measures were computed, so
+        # that a failing measure leaves no partial results behind
+        results: Dict[str, List[Any]] = dict()
         intermediate_results: Dict[str, List[float]] = dict()
-        for measure_name in self.measures:
-            measure: MeasureProtocol = self.measures[measure_name]
-            result: List[Any] = measure.compute(actual)
+        with self._activate():
+            if not self._is_expected_set:
+                self._set_expected()
+            try:
+                for measure_name in self.measures:
+                    measure: MeasureProtocol = self.measures[measure_name]
+                    results[measure_name] = measure.compute(actual)
+                    intermediate_results[measure_name] = measure.postprocess(
+                        results[measure_name],
+                    )
+            finally:
+                if self.release_state:
+                    self._release_measures(actual if release_actual else None)
+        for measure_name, result in results.items():
             self._results[measure_name][sample_id] = result
-            intermediate_results[measure_name] = measure.postprocess(result)
 
         self._results_cache.clear()
-        self._sample_ids.append(sample_id)
+        self._sample_ids[sample_id] = None
         self._num_objects[sample_id] = self.expected_objects
         return intermediate_results
 
+    def get_original_labels(
+        self,
+        image: LabelImage,
+        expected: bool = False,
+    ) -> LabelImage:
+        """
+        Maps the object labels of a per-object output (e.g.,
+        :attr:`~segmetrics.detection.FalsePositive.result`) back to the
+        original labels of the last processed segmentation result (or of the
+        ground truth, if ``expected`` is ``True``).
+        """
+        labels = self.expected_labels if expected else self.actual_labels
+        if labels is None:
+            return image
+        else:
+            return labels[image]
+
     def __getitem__(self, measure: str) -> List[Any]:
         """Returns list of all values recorded for ``measure``.
         """
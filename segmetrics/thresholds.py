@@ -0,0 +1,410 @@
+from __future__ import annotations
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+from scipy import ndimage
+
+from segmetrics._aux import (
+    Slice,
+    foreground,
+    object_index,
+)
+from segmetrics.study import (
+    _get_labeled,
+    _relabel,
+)
+from segmetrics.typing import (
+    Image,
+    LabelImage,
+)
+
+try:
+    import pandas as pd
+except ImportError:
+    pass
+
+# Estimated costs of relabeling a component separately (in pixels), used to
+# decide whether components are relabeled separately or jointly
+_RELABEL_OVERHEAD = 1000
+
+
+def _threshold_indices(
+    probabilities: np.ndarray,
+    thresholds: np.ndarray,
+) -> np.ndarray:
+    """
+    Returns the number of thresholds below the probability of each pixel.
+
+    A pixel is foreground for the :math:`k`-th threshold (counting from 0) if
+    and only if its index is larger than :math:`k`.
+    """
+    return np.searchsorted(thresholds, probabilities, side='left')
+
+
+def _pixel_curves(
+    expected: LabelImage,
+    indices: np.ndarray,
+    num_thresholds: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the Dice and Jaccard coefficients for all thresholds.
+
+    The pixels are counted in a single pass using a histogram of the
+    threshold indices, split by ground truth foreground and background. The
+    numbers of foreground pixels of the binarized images are then obtained
+    by cumulative sums over the histogram.
+    """
+    keys = 2 * indices.reshape(-1)
+    np.add(keys, foreground(expected).reshape(-1), out=keys, casting='unsafe')
+    hist = np.bincount(keys, minlength=2 * (num_thresholds + 1))
+    hist = hist.reshape(num_thresholds + 1, 2)
+    above = np.cumsum(hist[::-1], axis=0)[::-1][1:]
+    ref = hist[:, 1].sum()
+    res = above[:, 0] + above[:, 1]
+    intersection = above[:, 1].astype(float)
+    dice = np.ones(num_thresholds)  # result of zero/zero division
+    jaccard = np.ones(num_thresholds)
+    np.divide(2 * intersection, ref + res, out=dice, where=ref + res > 0)
+    np.divide(
+        intersection, ref + res - intersection,
+        out=jaccard, where=ref + res - intersection > 0,
+    )
+    return dice, jaccard
+
+
+class _Components:
+    """
+    Connected components of the binarized probability map, which are updated
+    incrementally as the threshold rises.
+
+    Raising the threshold only removes pixels, so only the components which
+    lose pixels can change (they vanish, shrink, or split). These components
+    are relabeled within their bounding boxes, while all other components
+    keep their labels. The bounding boxes and areas of the components are
+    kept in arrays indexed by label.
+    """
+
+    def __init__(self, mask: np.ndarray, structure: np.ndarray) -> None:
+        self.structure = structure
+        self.labels = np.zeros(mask.shape, np.int64)
+        self.starts = np.zeros((0, mask.ndim), np.int64)
+        self.stops = np.zeros((0, mask.ndim), np.int64)
+        self.areas = np.zeros(0, np.int64)
+        self.next_label = 1
+        self._relabel(tuple(slice(0, n) for n in mask.shape), mask)
+
+    def remove(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Removes pixels (given by flat indices) from the components, and
+        returns the labels of the components which were affected.
+        """
+        flat = self.labels.reshape(-1)
+        affected, counts = np.unique(flat[pixels], return_counts=True)
+        flat[pixels] = 0
+
+        # Components which lose all their pixels simply vanish
+        remaining = affected[counts < self.areas[affected]]
+        self.areas[affected] = 0
+        if len(remaining) == 0:
+            return affected
+
+        # Relabel the remaining components either separately or jointly,
+        # depending on which requires less pixels to be processed
+        starts, stops = self.starts[remaining], self.stops[remaining]
+        separate_size = (
+            _RELABEL_OVERHEAD + np.prod(stops - starts, axis=1)
+        ).sum()
+        joint_size = np.prod(stops.max(axis=0) - starts.min(axis=0))
+        if separate_size < joint_size:
+            for label, start, stop in zip(remaining, starts, stops):
+                window = tuple(map(slice, start, stop))
+                self._relabel(window, self.labels[window] == label)
+        else:
+            window = tuple(map(slice, starts.min(axis=0), stops.max(axis=0)))
+            self._relabel(window, np.isin(self.labels[window], remaining))
+        return affected
+
+    def _relabel(self, window: Slice, mask: np.ndarray) -> None:
+        """
+        Assigns new labels to the connected components of ``mask`` (the
+        pixels within ``window`` which belong to the components).
+        """
+        sub_labels, num_labels = ndimage.label(mask, self.structure)
+        if num_labels == 0:
+            return
+        coords = np.nonzero(mask)
+        labels = sub_labels[coords] + (self.next_label - 1)
+        self.labels[window][coords] = labels
+        self.next_label += num_labels
+
+        # Grow the arrays if required
+        if len(self.areas) < self.next_label:
+            size = max((2 * len(self.areas), self.next_label))
+            self.areas = np.resize(self.areas, size)
+            self.starts = np.resize(self.starts, (size, mask.ndim))
+            self.stops = np.resize(self.stops, (size, mask.ndim))
+
+        # Compute the areas and bounding boxes of the new components
+        new_labels = slice(self.next_label - num_labels, self.next_label)
+        self.areas[new_labels] = np.bincount(sub_labels.reshape(-1))[1:]
+        self.starts[new_labels] = np.iinfo(np.int64).max
+        self.stops[new_labels] = 0
+        for dim, (coord, w) in enumerate(zip(coords, window)):
+            np.minimum.at(self.starts[:, dim], labels, coord + w.start)
+            np.maximum.at(self.stops[:, dim], labels, coord + w.start + 1)
+
+
+def _seg_curves(
+    expected: LabelImage,
+    indices: np.ndarray,
+    num_thresholds: int,
+    structure: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the sizes of the ground truth objects, and the Jaccard
+    coefficients of their matching segmented objects for all thresholds
+    (one row per ground truth object, one column per threshold).
+    """
+    ref_index = object_index(expected)
+    ref_sizes = np.array(
+        [ref_index.area(label) for label in ref_index.labels],
+        dtype=np.int64,
+    )
+    jaccards = np.zeros((len(ref_index), num_thresholds))
+    if num_thresholds == 0 or len(ref_index) == 0:
+        return ref_sizes, jaccards
+
+    components = _Components(indices > 0, structure)
+    matches = np.zeros(len(ref_index), np.int64)
+    current = np.zeros(len(ref_index))
+
+    def match(i: int) -> None:
+        sl, mask = ref_index.mask(int(ref_index.labels[i]))
+        counts = np.bincount(components.labels[sl][mask])
+        counts[0] = 0
+        label = int(counts.argmax())
+        if 2 * counts[label] > ref_sizes[i]:
+            union = ref_sizes[i] + components.areas[label] - counts[label]
+            matches[i] = label
+            current[i] = counts[label] / union
+        else:
+            matches[i] = 0
+            current[i] = 0
+
+    for i in range(len(ref_index)):
+        match(i)
+    jaccards[:, 0] = current
+
+    # Group the pixels by the threshold at which they are removed
+    flat = indices.reshape(-1)
+    pixels = np.flatnonzero(np.logical_and(flat > 0, flat < num_thresholds))
+    pixels = pixels[np.argsort(flat[pixels], kind='stable')]
+    bounds = np.searchsorted(flat[pixels], np.arange(num_thresholds + 1))
+
+    for k in range(1, num_thresholds):
+        removed = pixels[bounds[k]:bounds[k + 1]]
+        if len(removed) > 0:
+            affected = components.remove(removed)
+            for i in np.flatnonzero(np.isin(matches, affected)).tolist():
+                match(i)
+        jaccards[:, k] = current
+    return ref_sizes, jaccards
+
+
+class ThresholdSweep:
+    """
+    Evaluates probability maps for many binarization thresholds at once.
+
+    This yields the same results as evaluating the binarized probability maps
+    (i.e. the connected components of the pixels with a probability larger
+    than the threshold) for each threshold separately using a
+    :class:`~segmetrics.study.Study` with the measures
+    :class:`~segmetrics.regional.Dice`,
+    :class:`~segmetrics.regional.JaccardCoefficient`, and
+    :class:`~segmetrics.regional.ISBIScore`, but is much faster:
+
+    - The Dice and Jaccard coefficients are computed for all thresholds in a
+      single pass, using cumulative histograms of the probabilities split by
+      ground truth foreground and background.
+
+    - The connected components are updated incrementally as the threshold
+      rises, instead of labeling each binarized image from scratch. Only the
+      components which lose pixels are relabeled, and only the ground truth
+      objects matched by such components are re-evaluated for the SEG
+      measure.
+
+    :param thresholds:
+        The binarization thresholds (in strictly ascending order).
+
+    :param min_ref_size:
+        Ground truth objects smaller than ``min_ref_size`` pixels are skipped
+        by the SEG measure (see :class:`~segmetrics.regional.ISBIScore`).
+
+    :param neighbors:
+        The connectivity used to determine the connected components (``4``
+        or ``8``).
+    """
+
+    def __init__(
+        self,
+        thresholds: Sequence[float],
+        min_ref_size: int = 1,
+        neighbors: int = 4,
+    ) -> None:
+        #: The binarization thresholds.
+        self.thresholds: np.ndarray = np.asarray(thresholds, float)
+        assert self.thresholds.ndim == 1
+        assert np.all(np.diff(self.thresholds) > 0), (
+            'thresholds must be in strictly ascending order'
+        )
+        assert min_ref_size >= 1, 'min_ref_size must be 1 or larger'
+        assert neighbors in (4, 8)
+
+        #: Ground truth objects smaller than this are skipped by the SEG
+        #: measure.
+        self.min_ref_size = min_ref_size
+
+        self._neighbors = neighbors
+        self._connectivity = 1 if neighbors == 4 else 2
+        self._sample_ids: List[Any] = list()
+        self._results: Dict[Any, Dict[str, np.ndarray]] = dict()
+
+    def reset(self) -> None:
+        """Resets all results computed so far.
+        """
+        self._sample_ids.clear()
+        self._results.clear()
+
+    def set_expected(self, expected: Image, unique: bool = True) -> None:
+        """
+        Sets the expected ground truth segmentation result (see
+        :meth:`segmetrics.study.Study.set_expected`).
+        """
+        assert expected.min() == 0, 'mis-labeled ground truth'
+        expected = expected.squeeze()
+        assert expected.ndim >= 2, (
+            f'ground truth has wrong dimensions ({expected.ndim})'
+        )
+        expected = _get_labeled(
+            expected, unique, 'ground truth', self._neighbors,
+        )
+        self.expected, _ = _relabel(expected)
+        self._structure = ndimage.generate_binary_structure(
+            expected.ndim, self._connectivity,
+        )
+
+    def process(
+        self,
+        sample_id: Any,
+        probabilities: np.ndarray,
+        replace: bool = True,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Evaluates a probability map based on the previously set expected
+        result, for all thresholds.
+
+        :param sample_id:
+            An arbitrary indentifier of the probability map (e.g., the
+            filename).
+
+        :param probabilities:
+            The probability map (of the same shape as the ground truth).
+
+        :param replace:
+            Whether previous results computed for the same ``sample_id``
+            should be replaced (``True``) or forbidden (``False``).
+
+        :returns:
+            The values of the Dice coefficient, the Jaccard coefficient, and
+            the SEG measure (one per threshold) for this probability map.
+        """
+        probabilities = probabilities.squeeze()
+        assert probabilities.shape == self.expected.shape, (
+            'probability map has wrong shape'
+        )
+        assert replace or sample_id not in self._results
+        num_thresholds = len(self.thresholds)
+        indices = _threshold_indices(probabilities, self.thresholds)
+        dice, jaccard = _pixel_curves(self.expected, indices, num_thresholds)
+        ref_sizes, seg = _seg_curves(
+            self.expected,
+            indices,
+            num_thresholds,
+            self._structure,
+        )
+        seg = seg[ref_sizes >= self.min_ref_size]
+
+        if sample_id not in self._results:
+            self._sample_ids.append(sample_id)
+        self._results[sample_id] = {
+            'Dice': dice,
+            'Jaccard coef.': jaccard,
+            'SEG': seg,
+        }
+        return {
+            'Dice': dice,
+            'Jaccard coef.': jaccard,
+            'SEG': _mean(seg, num_thresholds),
+        }
+
+    def curves(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the values of the Dice coefficient, the Jaccard coefficient,
+        and the SEG measure (one per threshold), aggregated over all samples.
+
+        Like for a :class:`~segmetrics.study.Study`, the Dice and Jaccard
+        coefficients are averaged over the samples, whereas the SEG measure
+        is averaged over the ground truth objects of all samples.
+        """
+        num_thresholds = len(self.thresholds)
+        results = [self._results[sample_id] for sample_id in self._sample_ids]
+        return {
+            'Dice': _mean(
+                np.array([result['Dice'] for result in results]),
+                num_thresholds,
+            ),
+            'Jaccard coef.': _mean(
+                np.array([result['Jaccard coef.'] for result in results]),
+                num_thresholds,
+            ),
+            'SEG': _mean(
+                np.concatenate(
+                    [result['SEG'] for result in results],
+                ).reshape(-1, num_thresholds),
+                num_thresholds,
+            ),
+        }
+
+    def best_threshold(self, measure: str = 'SEG') -> float:
+        """
+        Returns the threshold which yields the best aggregated value of a
+        measure (``'Dice'``, ``'Jaccard coef.'``, or ``'SEG'``).
+        """
+        return float(self.thresholds[np.nanargmax(self.curves()[measure])])
+
+    def todf(self) -> pd.DataFrame:
+        """
+        Returns the aggregated curves as a pandas dataframe (one row per
+        threshold).
+        """
+        df = pd.DataFrame(self.curves())
+        df.insert(0, 'Threshold', self.thresholds)
+        return df
+
+
+def _mean(values: np.ndarray, num_thresholds: int) -> np.ndarray:
+    """
+    Returns the mean of ``values`` for each threshold (``NaN`` if there are
+    no values).
+    """
+    if len(values) == 0:
+        return np.full(num_thresholds, np.nan)
+    else:
+        return values.mean(axis=0)
@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from segmetrics import _cache
+from segmetrics.measure import Measure
+from segmetrics.overlap import overlap_table
+from segmetrics.typing import LabelImage
+
+#: Weights of the graph operations of the AOGM measure (splitting a vertex,
+#: adding a false negative vertex, deleting a false positive vertex,
+#: deleting an edge, adding an edge, changing the semantics of an edge), as
+#: used by the Cell Tracking Challenge.
+AOGM_WEIGHTS: Dict[str, float] = dict(
+    NS=5,
+    FN=10,
+    FP=1,
+    ED=1,
+    EA=1.5,
+    EC=1,
+)
+
+
+def _get_ctc_matching(
+    expected: LabelImage,
+    actual: LabelImage,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the labels of the ground truth objects, the labels of the
+    segmented objects, and the labels of the matching pairs of objects
+    (cached).
+
+    A segmented object is matching a ground truth object if it covers more
+    than half of the ground truth object (see
+    :class:`~segmetrics.regional.ISBIScore`). Thus, each ground truth object
+    is matched by at most one segmented object.
+    """
+    def compute() -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        table = overlap_table(expected, actual).objects()
+        matches = table.counts > 0.5 * table.ref_areas[table.ref]
+        return (
+            np.flatnonzero(table.ref_areas[1:]) + 1,
+            np.flatnonzero(table.seg_areas[1:]) + 1,
+            table.ref[matches],
+            table.seg[matches],
+        )
+    return _cache.get((expected, actual), 'ctc_matching', compute)
+
+
+def _count_vertex_errors(
+    num_seg_objects: int,
+    match_seg: np.ndarray,
+    num_ref_objects: int,
+) -> Tuple[int, int, int]:
+    """
+    Returns the numbers of required vertex splits, false negative vertices,
+    and false positive vertices.
+    """
+    matched_segs, matches_per_seg = np.unique(match_seg, return_counts=True)
+    ns = int((matches_per_seg - 1).sum())
+    fn = num_ref_objects - len(match_seg)
+    fp = num_seg_objects - len(matched_segs)
+    return ns, fn, fp
+
+
+class DetectionAccuracy(Measure):
+    r"""
+    Defines the DET performance measure (used in the ISBI Cell Tracking
+    Challenge).
+
+    The ground truth and the segmented objects are matched like for the
+    :class:`~segmetrics.regional.ISBIScore` measure. The DET measure is
+    based on the costs of the graph operations required to transform the
+    segmented objects into the ground truth objects,
+
+    .. math:: \mathrm{AOGM_D} = w_\mathrm{NS} \cdot \mathrm{NS}
+        + w_\mathrm{FN} \cdot \mathrm{FN} + w_\mathrm{FP} \cdot \mathrm{FP},
+
+    where :math:`\mathrm{NS}` is the number of required splits of segmented
+    objects which match multiple ground truth objects, :math:`\mathrm{FN}`
+    the number of ground truth objects without a match, and
+    :math:`\mathrm{FP}` the number of segmented objects without a match (see
+    :data:`AOGM_WEIGHTS`). Then, the DET measure is defined as
+
+    .. math:: \mathrm{DET} = 1 - \frac
+        {\min\left(\mathrm{AOGM_D}, \mathrm{AOGM_{D0}}\right)}
+        {\mathrm{AOGM_{D0}}},
+
+    where :math:`\mathrm{AOGM_{D0}} = w_\mathrm{FN} \cdot N_R` are the costs
+    of creating all :math:`N_R` ground truth objects from scratch. The
+    operations are counted for all images, so that the DET measure is
+    computed for the whole dataset (or time-lapse sequence). Higher values
+    correspond to better performance. See:
+    http://public.celltrackingchallenge.net/documents/DET.pdf
+
+    References:
+
+    - P\. Matula, M. Maška, D. V. Sorokin, et al., "Cell tracking accuracy
+      measurement based on comparison of acyclic oriented graphs," PLoS ONE,
+      vol. 10, no. 12, 2015.
+    """
+
+    def compute(self, actual: LabelImage) -> List[Tuple[int, int, int, int]]:
+        """
+        Computes the numbers of vertex splits, false negative vertices,
+        false positive vertices, and ground truth objects.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of those numbers.
+        """
+        ref_labels, seg_labels, _, match_seg = _get_ctc_matching(
+            self.expected,
+            actual,
+        )
+        ns, fn, fp = _count_vertex_errors(
+            len(seg_labels),
+            match_seg,
+            len(ref_labels),
+        )
+        return [(ns, fn, fp, len(ref_labels))]
+
+    def postprocess(
+        self,
+        values: List[Tuple[int, int, int, int]],
+    ) -> List[float]:
+        if len(values) == 0:
+            return list()
+        ns, fn, fp, num_ref_objects = (sum(c) for c in zip(*values))
+        aogm = (
+            AOGM_WEIGHTS['NS'] * ns
+            + AOGM_WEIGHTS['FN'] * fn
+            + AOGM_WEIGHTS['FP'] * fp
+        )
+        aogm0 = AOGM_WEIGHTS['FN'] * num_ref_objects
+        if aogm0 > 0:
+            return [1 - min((aogm, aogm0)) / aogm0]
+        else:
+            return [1. if aogm == 0 else 0.]
+
+    def default_name(self) -> str:
+        return 'DET'
+
+
+class _Frame:
+    """
+    The matching of the objects of a frame of a time-lapse sequence (the
+    intermediate representation of :class:`TrackingAccuracy`).
+    """
+
+    def __init__(
+        self,
+        sequence_id: Any,
+        t: int,
+        ref_labels: np.ndarray,
+        seg_labels: np.ndarray,
+        match_ref: np.ndarray,
+        match_seg: np.ndarray,
+        ref_parents: Dict[int, int],
+        seg_parents: Dict[int, int],
+    ) -> None:
+        self.sequence_id = sequence_id
+        self.t = t
+        self.ref_labels = ref_labels
+        self.seg_labels = seg_labels
+        self.match_ref = match_ref
+        self.match_seg = match_seg
+        self.ref_parents = ref_parents
+        self.seg_parents = seg_parents
+
+
+def _vertex_keys(labels: List[np.ndarray]) -> np.ndarray:
+    r"""
+    Returns the keys of the vertices of a tracking graph, given the track
+    labels of the objects in each frame. The key of the vertex for track
+    label :math:`l` in frame :math:`t` is :math:`l \cdot T + t`, where
+    :math:`T` is the number of frames (the frames must be consecutive).
+    """
+    return np.concatenate([np.zeros(0, np.int64)] + [
+        frame_labels * len(labels) + t
+        for t, frame_labels in enumerate(labels)
+    ])
+
+
+def _get_edges(
+    keys: np.ndarray,
+    num_frames: int,
+    parents: Dict[int, int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the edges of the tracking graph given by the vertex keys (see
+    :func:`_vertex_keys`), and the parents of the tracks.
+
+    Consecutive occurrences of a track label are linked by a regular edge.
+    The first occurrence of a track is linked to the last previous
+    occurrence of its parent track by a division edge.
+
+    :returns:
+        The keys of the source vertices, the keys of the target vertices,
+        and whether the edges are division edges.
+    """
+    keys = np.sort(keys)
+    tracks = keys // num_frames
+    same = tracks[1:] == tracks[:-1]
+
+    # Find the last previous occurrence of the parent of each track
+    first = np.ones(len(keys), bool)
+    first[1:] = ~same
+    children = keys[first]
+    parent_tracks = np.zeros(len(children), np.int64)
+    if len(parents) > 0:
+        child_tracks = np.array(list(parents.keys()), np.int64)
+        order = np.argsort(child_tracks)
+        child_tracks = child_tracks[order]
+        pos = np.searchsorted(child_tracks, tracks[first])
+        pos = np.minimum(pos, len(child_tracks) - 1)
+        has_parent = child_tracks[pos] == tracks[first]
+        parent_tracks[has_parent] = np.array(
+            list(parents.values()),
+            np.int64,
+        )[order][pos[has_parent]]
+    pos = np.searchsorted(
+        keys,
+        parent_tracks * num_frames + children % num_frames,
+    ) - 1
+    divisions = np.logical_and(parent_tracks > 0, pos >= 0)
+    divisions[divisions] = tracks[pos[divisions]] == parent_tracks[divisions]
+
+    return (
+        np.concatenate([keys[:-1][same], keys[pos[divisions]]]),
+        np.concatenate([keys[1:][same], children[divisions]]),
+        np.concatenate([
+            np.zeros(np.count_nonzero(same), bool),
+            np.ones(np.count_nonzero(divisions), bool),
+        ]),
+    )
+
+
+def _lookup(
+    keys: np.ndarray,
+    query: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Looks up the ``query`` keys in the ``keys`` (sorted in ascending order),
+    and returns the positions of the query keys and whether they were found.
+    """
+    pos = np.minimum(np.searchsorted(keys, query), max((len(keys) - 1, 0)))
+    found = keys[pos] == query if len(keys) > 0 else np.zeros(len(query), bool)
+    return pos, found
+
+
+class TrackingAccuracy(Measure):
+    r"""
+    Defines the TRA performance measure (used in the ISBI Cell Tracking
+    Challenge).
+
+    The TRA measure extends the :class:`DetectionAccuracy` measure by the
+    costs of the graph operations required to fix the links between the
+    objects of consecutive frames (edges). The objects of each frame are
+    identified by their track labels, and are linked to the next occurrence
+    of the same track label, or to the first occurrence of a child track
+    (division). The AOGM measure additionally accounts for the numbers of
+    edges to be deleted (:math:`\mathrm{ED}`), added (:math:`\mathrm{EA}`),
+    and with changed semantics (:math:`\mathrm{EC}`, i.e. a division edge
+    which corresponds to a regular edge, or vice versa). Then,
+
+    .. math:: \mathrm{TRA} = 1 - \frac
+        {\min\left(\mathrm{AOGM}, \mathrm{AOGM_0}\right)}
+        {\mathrm{AOGM_0}},
+
+    where :math:`\mathrm{AOGM_0}` are the costs of creating the ground truth
+    tracking graph from scratch (see :data:`AOGM_WEIGHTS`). Higher values
+    correspond to better performance. See:
+    http://public.celltrackingchallenge.net/documents/TRA.pdf
+
+    The TRA measure can only be computed for time-lapse sequences (see
+    :meth:`segmetrics.study.Study.process_sequence`). The original object
+    labels are used as track labels (see
+    :attr:`segmetrics.study.Study.expected_labels`).
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._sequence_id: Any = None
+        self._frame: Optional[Tuple[Any, int]] = None
+        self._labels: Tuple[Optional[np.ndarray], Optional[np.ndarray]]
+        self._labels = (None, None)
+        self._parents: Tuple[Dict[int, int], Dict[int, int]] = (
+            dict(),
+            dict(),
+        )
+
+    def set_sequence(
+        self,
+        sequence_id: Any,
+        expected_parents: Optional[Dict[int, int]] = None,
+        actual_parents: Optional[Dict[int, int]] = None,
+    ) -> None:
+        """
+        Starts the evaluation of a time-lapse sequence.
+
+        :param expected_parents:
+            The parent track labels of the ground truth tracks (indexed by
+            track label), or ``None`` if there are no divisions.
+
+        :param actual_parents:
+            The parent track labels of the segmented tracks.
+        """
+        self._sequence_id = sequence_id
+        self._parents = (
+            dict(expected_parents or dict()),
+            dict(actual_parents or dict()),
+        )
+
+    def set_frame(
+        self,
+        t: int,
+        expected_labels: Optional[np.ndarray] = None,
+        actual_labels: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Sets the index of the next frame to be evaluated, and the original
+        labels of the objects (``None`` if the labels are original).
+        """
+        self._frame = (self._sequence_id, t)
+        self._labels = (expected_labels, actual_labels)
+
+    def compute(self, actual: LabelImage) -> List[_Frame]:
+        """
+        Computes the matching of the objects of a frame.
+
+        The final performance values are obtained via the :meth:`postprocess`
+        method for the list of the matchings of all frames.
+        """
+        assert self._frame is not None, (
+            'TRA requires time-lapse sequences (see Study.process_sequence)'
+        )
+        ref_labels, seg_labels, match_ref, match_seg = _get_ctc_matching(
+            self.expected,
+            actual,
+        )
+        expected_labels, actual_labels = self._labels
+        if expected_labels is not None:
+            ref_labels = expected_labels[ref_labels]
+            match_ref = expected_labels[match_ref]
+        if actual_labels is not None:
+            seg_labels = actual_labels[seg_labels]
+            match_seg = actual_labels[match_seg]
+        return [
+            _Frame(
+                *self._frame,
+                ref_labels.astype(np.int64),
+                seg_labels.astype(np.int64),
+                match_ref.astype(np.int64),
+                match_seg.astype(np.int64),
+                *self._parents,
+            )
+        ]
+
+    def postprocess(self, values: List[_Frame]) -> List[float]:
+        if len(values) == 0:
+            return list()
+        sequences: Dict[Any, List[_Frame]] = dict()
+        for frame in values:
+            sequences.setdefault(frame.sequence_id, list()).append(frame)
+        counts = np.zeros(6, np.int64)
+        num_ref_objects, num_ref_edges = 0, 0
+        for frames in sequences.values():
+            frames = sorted(frames, key=lambda frame: frame.t)
+            sequence_counts, sequence_ref_edges = self._count_errors(frames)
+            counts += sequence_counts
+            num_ref_objects += sum(len(frame.ref_labels) for frame in frames)
+            num_ref_edges += sequence_ref_edges
+        aogm = sum(
+            AOGM_WEIGHTS[key] * int(count)
+            for key, count in zip(('NS', 'FN', 'FP', 'ED', 'EA', 'EC'), counts)
+        )
+        aogm0 = (
+            AOGM_WEIGHTS['FN'] * num_ref_objects
+            + AOGM_WEIGHTS['EA'] * num_ref_edges
+        )
+        if aogm0 > 0:
+            return [1 - min((aogm, aogm0)) / aogm0]
+        else:
+            return [1. if aogm == 0 else 0.]
+
+    def _count_errors(self, frames: List[_Frame]) -> Tuple[List[int], int]:
+        """
+        Returns the numbers of vertex splits, false negative vertices, false
+        positive vertices, deleted edges, added edges, and edges with changed
+        semantics, for the frames of a time-lapse sequence, and the number
+        of the ground truth edges.
+        """
+        # The vertex keys are based on the positions of the frames
+        t0 = frames[0].t
+        assert [frame.t for frame in frames] == list(
+            range(t0, t0 + len(frames)),
+        ), f'frames of sequence {frames[0].sequence_id} are not consecutive'
+        ns, fn, fp = 0, 0, 0
+        for frame in frames:
+            frame_ns, frame_fn, frame_fp = _count_vertex_errors(
+                len(frame.seg_labels),
+                frame.match_seg,
+                len(frame.ref_labels),
+            )
+            ns, fn, fp = ns + frame_ns, fn + frame_fn, fp + frame_fp
+
+        # Determine the vertices and edges of the tracking graphs
+        num_frames = len(frames)
+        seg_vertices = np.sort(
+            _vertex_keys([frame.seg_labels for frame in frames]),
+        )
+        ref_src, ref_dst, ref_divisions = _get_edges(
+            _vertex_keys([frame.ref_labels for frame in frames]),
+            num_frames,
+            frames[-1].ref_parents,
+        )
+        seg_src, seg_dst, seg_divisions = _get_edges(
+            seg_vertices,
+            num_frames,
+            frames[-1].seg_parents,
+        )
+
+        # Map the ground truth edges to the segmented vertices
+        match_ref = _vertex_keys([frame.match_ref for frame in frames])
+        match_seg = _vertex_keys([frame.match_seg for frame in frames])
+        order = np.argsort(match_ref)
+        match_ref, match_seg = match_ref[order], match_seg[order]
+        src_pos, src_found = _lookup(match_ref, ref_src)
+        dst_pos, dst_found = _lookup(match_ref, ref_dst)
+        mapped = np.logical_and(src_found, dst_found)
+
+        # Identify the edges by the indices of their vertices
+        def edge_codes(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+            return (
+                np.searchsorted(seg_vertices, src) * len(seg_vertices)
+                + np.searchsorted(seg_vertices, dst)
+            )
+        seg_codes = edge_codes(seg_src, seg_dst)
+        order = np.argsort(seg_codes)
+        seg_codes, seg_divisions = seg_codes[order], seg_divisions[order]
+        mapped_codes = edge_codes(
+            match_seg[src_pos[mapped]],
+            match_seg[dst_pos[mapped]],
+        )
+        pos, found = _lookup(seg_codes, mapped_codes)
+
+        # Each segmented edge corresponds to at most one ground truth edge
+        # (preferably, one with the same semantics)
+        changed = ref_divisions[mapped][found] != seg_divisions[pos[found]]
+        codes = mapped_codes[found]
+        order = np.lexsort((changed, codes))
+        first = np.ones(len(order), bool)
+        first[1:] = codes[order][1:] != codes[order][:-1]
+        num_matched = np.count_nonzero(first)
+        ec = np.count_nonzero(changed[order][first])
+        ea = len(ref_src) - num_matched
+        ed = len(seg_src) - num_matched
+        return [ns, fn, fp, int(ed), int(ea), int(ec)], len(ref_src)
+
+    def default_name(self) -> str:
+        return 'TRA'
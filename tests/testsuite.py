@@ -1,11 +1,15 @@
 # flake8: noqa
 
+import multiprocessing
 import os
 import pathlib
+import pickle
 import tempfile
+import threading
 import time
 import unittest
 import warnings
+from unittest import mock
 
 import numpy as np
 import numpy.testing as npt
@@ -89,10 +93,829 @@ class MeasureTest(unittest.TestCase):
         self.assertEqual(sm.Hausdorff().object_based().reversed().default_name(), 'Rev. Ob. HSD')
         self.assertEqual(sm.Hausdorff().object_based().symmetric().default_name(), 'Sym. Ob. HSD')
         self.assertEqual(sm.NSD().object_based().default_name(), 'Ob. NSD')
+        self.assertEqual(sm.Hausdorff().symmetric().default_name(), 'Sym. HSD')
         self.assertEqual(sm.FalseSplit().default_name(), 'Split')
         self.assertEqual(sm.FalseMerge().default_name(), 'Merge')
         self.assertEqual(sm.FalsePositive().default_name(), 'Spurious')
         self.assertEqual(sm.FalseNegative().default_name(), 'Missing')
+        self.assertEqual(sm.AveragePrecision().default_name(), 'mAP')
+        self.assertEqual(sm.AveragePrecision(iou_thresholds=[0.75]).default_name(), 'AP@0.75')
+        self.assertEqual(sm.F1Score().default_name(), 'F1@0.5')
+        self.assertEqual(sm.Precision(iou_threshold=0.75).default_name(), 'Precision@0.75')
+        self.assertEqual(sm.Recall().default_name(), 'Recall@0.5')
+        self.assertEqual(sm.PanopticQuality().default_name(), 'PQ@0.5')
+
+
+class AdapterTest(unittest.TestCase):
+
+    def test_reversed(self):
+        for measure in (sm.Hausdorff(), sm.NSD(), sm.Dice().object_based()):
+            with self.subTest(measure=measure.default_name()):
+                measure.set_expected(images[2])
+                expected = measure.compute(images[0])
+                reversed_measure = measure.reversed()
+                reversed_measure.set_expected(images[0])
+                npt.assert_almost_equal(reversed_measure.compute(images[2]), expected)
+
+    def test_object_crops(self):
+        # Measures which count the background pixels are computed using a crop for each pair of objects
+        for measure, expected in ((sm.RandIndex(), [1.0, 1.0, 0.633071775473]), (sm.AdjustedRandIndex(), [1.0, 1.0, 0.203191023781])):
+            with self.subTest(measure=measure.default_name()):
+                measure = measure.object_based()
+                measure.set_expected(images[2])
+                npt.assert_allclose(measure.compute(images[6]), expected)
+
+        # Measures which do not depend on the background yield the same values using a shared crop
+        for measure in (sm.Dice(), sm.Hausdorff(), sm.NSD(), sm.CenterlineDice()):
+            with self.subTest(measure=measure.default_name()):
+                self.assertTrue(measure.crop_invariant)
+                results = list()
+                for crop_invariant in (True, False):
+                    measure.crop_invariant = crop_invariant
+                    object_measure = measure.object_based()
+                    object_measure.set_expected(images[5])
+                    results.append(object_measure.compute(images[3]))
+                npt.assert_allclose(results[0], results[1])
+
+    def test_symmetric_shares_artifacts(self):
+        from segmetrics.contour import _get_contour_distance_map
+        measure = sm.Hausdorff().symmetric()
+        ref, seg = images[0].copy(), images[1].copy()
+        with sm._cache.Scope().activate():
+            measure.set_expected(ref)
+            self.assertIs(_get_contour_distance_map(ref), measure.measure1.expected_contour_distance_map)
+            results = measure.compute(seg)
+            self.assertNotIn('expected_contour_distance_map', vars(measure.measure2.measure))  # released after use
+            forward, backward = sm.Hausdorff(), sm.Hausdorff()
+            forward.set_expected(ref)
+            backward.set_expected(seg)
+            self.assertIs(_get_contour_distance_map(seg), backward.expected_contour_distance_map)
+            self.assertEqual(results, forward.compute(seg) + backward.compute(ref))
+
+    def test_modified_in_place(self):
+        study = sm.Study()
+        study.add_measure(sm.Dice(), 'Dice')
+        study.add_measure(sm.Hausdorff(), 'HSD')
+        study.add_measure(sm.ISBIScore(), 'SEG')
+        ref, seg = images[0].copy(), images[0].copy()
+        study.set_expected(ref)
+        study.process('a', seg)
+        ref[:], seg[:] = images[1], images[6]
+        study.set_expected(ref)
+        results = study.process('b', seg)
+        expected = sm.Study()
+        for measure_name, measure in study.measures.items():
+            expected.add_measure(type(measure)(), measure_name)
+        expected.set_expected(images[1].copy())
+        self.assertEqual(results, expected.process('b', images[6].copy()))
+        self.assertNotEqual(results['Dice'], [1.0])
+
+    def test_direct_use_modified_in_place(self):
+        from segmetrics.contour import _get_contour_distance_map
+        ref, seg = images[0].copy(), images[0].copy()
+        dice, hausdorff = sm.Dice(), sm.Hausdorff()
+        dice.set_expected(ref)
+        hausdorff.set_expected(ref)
+        self.assertEqual(dice.compute(seg), [1.0])
+        self.assertEqual(hausdorff.compute(seg), [0.0])
+        seg[:] = np.roll(images[0], 5, axis=1)
+        self.assertLess(dice.compute(seg)[0], 1.0)
+        self.assertGreater(hausdorff.compute(seg)[0], 0.0)
+        seg[:] = 0
+        self.assertEqual(dice.compute(seg), [0.0])
+        self.assertIsNot(_get_contour_distance_map(ref), _get_contour_distance_map(ref))  # no scope is active
+
+
+class ObjectIndexTest(unittest.TestCase):
+
+    def test(self):
+        from segmetrics._aux import ObjectIndex
+        index = ObjectIndex(images[5])
+        npt.assert_array_equal(index.labels, [1, 2, 3, 4])
+        self.assertEqual(index.slices[3], np.s_[100:250, 300:400])
+        self.assertEqual(index.area(4), 150 * 100)
+        sl, mask = index.mask(1)
+        self.assertEqual(mask.shape, (100, 100))
+        self.assertTrue(mask.all())
+        npt.assert_array_equal(index.coordinates(2).min(axis=0), [300, 100])
+
+
+class RelabelTest(unittest.TestCase):
+
+    def test_sparse_labels(self):
+        sparse_ids = np.array([0, 1_000_000, 1_000_007, 2_000_000, 4_000_000_000], np.uint32)
+        results = list()
+        for ref, seg in ((images[0], images[6]), (sparse_ids[images[0]], sparse_ids[images[6]])):
+            study = sm.Study()
+            study.add_measure(sm.ISBIScore(), 'SEG')
+            study.add_measure(sm.AggregatedJaccardCoefficient(), 'AJC')
+            study.add_measure(sm.FalsePositive(), 'FP')
+            study.set_expected(ref)
+            results.append(study.process('s1', seg))
+        self.assertEqual(results[0], results[1])
+        fp_result = study.measures['FP'].result
+        self.assertTrue(fp_result.any())
+        npt.assert_array_equal(study.get_original_labels(fp_result)[fp_result > 0], seg[fp_result > 0])
+        npt.assert_array_equal(study.expected_labels, sparse_ids)
+        self.assertEqual(study.actual_labels.tolist(), [0, 1_000_000, 1_000_007, 2_000_000])
+
+    def test_sparse_labels_without_relabel(self):
+        sparse_ids = np.array([0, 1_000_000, 1_000_007, 2_000_000, 4_000_000_000], np.uint32)
+        measure = sm.ISBIScore()
+        measure.set_expected(images[0])
+        expected = measure.compute(images[6])
+        measure.set_expected(sparse_ids[images[0]])
+        self.assertEqual(measure.compute(sparse_ids[images[6]]), expected)
+
+
+class SampleStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.study = sm.Study()
+        self.study.add_measure(sm.NSD().object_based().symmetric(), 'NSD')
+        self.study.add_measure(sm.Hausdorff().symmetric(), 'HSD')
+        self.study.add_measure(sm.FalsePositive(), 'FP')
+        self.study.add_multi_measure(sm.DetectionErrors())
+
+    def test_release(self):
+        self.study.set_expected(images[0])
+        self.study.process('s1', images[1])
+        self.assertIsNotNone(self.study.measures['FP'].result)
+        for measure in self.study.measures.values():
+            state = {name: value for name, value in vars(measure).items() if name not in measure.output_attributes}
+            self.assertFalse(any(isinstance(value, np.ndarray) and value.size > 100 for value in state.values()))
+        expected = self.study._expected
+        self.assertIsNotNone(self.study._artifacts.peek((expected,), 'foreground'))  # kept for the next sample
+        self.assertEqual(list(self.study._artifacts._entries), [(id(expected),)])  # artifacts of the segmentation are released
+        self.assertLess(len(pickle.dumps(self.study.measures)), 10_000)
+        self.study.release()
+        self.assertIsNone(self.study._artifacts.peek((expected,), 'foreground'))
+        self.assertLess(len(pickle.dumps(self.study)), 10_000)
+        with self.assertRaises(AssertionError):
+            self.study.process('s2', images[2])
+
+    def test_same_expected(self):
+        self.study.set_expected(images[0])
+        for sample_id in (1, 2, 3):
+            self.study.process(sample_id, images[sample_id])
+        expected = sm.Study()
+        for measure_name, measure in self.study.measures.items():
+            expected.add_measure(pickle.loads(pickle.dumps(measure)), measure_name)
+        for sample_id in (1, 2, 3):
+            expected.set_expected(images[0])
+            expected.process(sample_id, images[sample_id])
+        pd.testing.assert_frame_equal(self.study.todf(), expected.todf())
+
+    def test_expected_artifacts_reused(self):
+        self.study.set_expected(images[0])
+        self.study.process(1, images[1])
+        distance_map = self.study._artifacts.peek((self.study._expected,), ('contour_distance_map', None))
+        self.assertIsNotNone(distance_map)
+        self.study.process(2, images[2])
+        self.assertIs(self.study._artifacts.peek((self.study._expected,), ('contour_distance_map', None)), distance_map)
+        self.study.set_expected(images[3])
+        self.assertEqual(list(self.study._artifacts._entries), [(id(self.study._expected),)])  # previous ground truth dropped
+
+
+class PackedForegroundTest(unittest.TestCase):
+
+    def test_foreground_counts(self):
+        from segmetrics import _aux
+        ref, seg = images[0][:-3, :-5], images[6][:-3, :-5]
+        results = dict()
+        for packed_min_size in (None, 0):
+            with mock.patch.object(_aux, 'PACKED_MIN_SIZE', packed_min_size):
+                study = sm.Study()
+                study.add_measure(sm.Dice(), 'Dice')
+                study.add_measure(sm.JaccardCoefficient(), 'JC')
+                study.add_measure(sm.RandIndex(), 'Rand')
+                study.set_expected(ref.copy())
+                results[packed_min_size] = study.process('s1', seg.copy())
+        self.assertEqual(results[None], results[0])
+        self.assertEqual(_aux.foreground_counts(ref, seg), (40000, 64800, 32400))
+
+    def test_non_contiguous(self):
+        from segmetrics import _aux
+        image = images[1][1::2, ::3].T
+        expected = np.packbits(image.reshape(-1) > 0)
+        for pack_chunk_size in (_aux._PACK_CHUNK_SIZE, 1000, 1):
+            with mock.patch.object(_aux, '_PACK_CHUNK_SIZE', pack_chunk_size):
+                words = _aux.packed_foreground(image.view())
+            npt.assert_array_equal(words.view(np.uint8)[:len(expected)], expected)
+            self.assertEqual(_aux.popcount(words), np.count_nonzero(image))
+
+
+class AveragePrecisionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ref = np.array(
+            [
+                [1, 1, 1, 1],
+                [0, 0, 0, 0],
+                [2, 2, 0, 0],
+            ]
+        )
+        self.study = sm.Study()
+        self.study.add_measure(sm.AveragePrecision(iou_thresholds=[0.5, 0.7]), 'mAP')
+        self.study.set_expected(self.ref, unique=True)
+
+    def test__identity(self):
+        res = self.study.process('s1', self.ref.copy(), unique=True)
+        self.assertEqual(res, {'mAP': [1.0]})
+
+    def test__partial(self):
+        seg = np.array(
+            [
+                [1, 1, 1, 0],
+                [0, 0, 0, 0],
+                [0, 0, 0, 2],
+            ]
+        )
+        res = self.study.process('s1', seg, unique=True)
+        # IoU of object 1 is 0.75 (TP at both thresholds), object 2 is not matched
+        self.assertEqual(res, {'mAP': [(1 / 3 + 1 / 3) / 2]})
+
+    def test__multiple_images(self):
+        seg = np.array(
+            [
+                [1, 1, 1, 1],
+                [0, 0, 0, 0],
+                [0, 0, 0, 0],
+            ]
+        )
+        self.study.process('s1', seg, unique=True)
+        self.study.process('s2', self.ref.copy(), unique=True)
+        df = self.study.todf().set_index(['Sample'])
+        self.assertEqual(df.loc['s1', 'mAP'], 0.5)
+        self.assertEqual(df.loc['', 'mAP'], 3 / 4)
+
+
+class MatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ref = np.zeros((2, 20), int)
+        self.ref[0, :10] = 1
+        self.ref[0, 10:] = 2
+        self.seg = np.zeros((2, 20), int)
+        self.seg[0, 4:15] = 1
+        self.seg[0, :4] = 2
+
+    def test_match_objects(self):
+        from segmetrics.matching import match_objects
+        from segmetrics.overlap import OverlapTable
+        ref, seg, iou = match_objects(OverlapTable.compute(self.ref, self.seg))
+        order = np.argsort(ref)
+        npt.assert_array_equal(ref[order], [1, 2])
+        npt.assert_array_equal(seg[order], [2, 1])
+        npt.assert_almost_equal(iou[order], [4 / 10, 5 / 16])
+
+    def test_measures(self):
+        study = sm.Study()
+        study.add_measure(sm.F1Score(iou_threshold=0), 'F1')
+        study.add_measure(sm.Precision(iou_threshold=0.35), 'Precision')
+        study.add_measure(sm.Recall(iou_threshold=0.35), 'Recall')
+        study.add_measure(sm.PanopticQuality(iou_threshold=0), 'PQ')
+        study.add_measure(sm.PanopticQuality(), 'PQ@0.5')
+        study.set_expected(self.ref)
+        res = study.process('s1', self.seg)
+        self.assertEqual(res['F1'], [1.0])
+        self.assertEqual(res['Precision'], [1 / 2])
+        self.assertEqual(res['Recall'], [1 / 2])
+        npt.assert_almost_equal(res['PQ'], [(4 / 10 + 5 / 16) / 2])
+        self.assertEqual(res['PQ@0.5'], [0.0])
+
+
+class SweepTest(unittest.TestCase):
+
+    def test_sweep(self):
+        quantiles = [0.5, 0.9, 1]
+        min_ref_sizes = [1, 2, 20000]
+        sweep_study, single_study = sm.Study(), sm.Study()
+        for measure in sm.Hausdorff.sweep(quantiles) + sm.ISBIScore.sweep(min_ref_sizes):
+            sweep_study.add_measure(measure)
+        for quantile in quantiles:
+            single_study.add_measure(sm.Hausdorff(quantile=quantile))
+        for min_ref_size in min_ref_sizes:
+            single_study.add_measure(sm.ISBIScore(min_ref_size=min_ref_size))
+        for study in (sweep_study, single_study):
+            for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+                study.set_expected(ref)
+                study.process(sample_id, seg)
+        df = sweep_study.todf()
+        self.assertEqual(
+            list(df.columns),
+            ['Sample', 'HSD (Q=0.5)', 'HSD (Q=0.9)', 'HSD', 'SEG', 'SEG (min_ref_size=2)', 'SEG (min_ref_size=20000)'],
+        )
+        self.assertTrue(df.equals(single_study.todf()))
+
+
+class BoundaryTest(unittest.TestCase):
+
+    def test_boundary_measures(self):
+        import scipy.ndimage as ndi
+        import skimage.morphology as morph
+        for sample_id, ref, seg in CrossSampler(images[:2], images[3:5]).all():
+            contours, bands = list(), list()
+            for image in (ref, seg):
+                contour = np.logical_and(ndi.binary_dilation(image > 0, morph.disk(1)), image == 0)
+                distances = ndi.distance_transform_edt(~contour)
+                contours.append((contour, distances))
+                bands.append(np.logical_and(image > 0, distances <= 3))
+            precision = np.mean(contours[0][1][contours[1][0]] <= 2)
+            recall = np.mean(contours[1][1][contours[0][0]] <= 2)
+            bf1 = sm.BoundaryF1()
+            bf1.set_expected(ref)
+            self.assertAlmostEqual(bf1.compute(seg)[0], 2 * precision * recall / (precision + recall))
+            biou = sm.BoundaryIoU(3)
+            biou.set_expected(ref)
+            intersection = np.logical_and(*bands).sum()
+            self.assertAlmostEqual(biou.compute(seg)[0], intersection / np.logical_or(*bands).sum())
+
+    def test_object_based(self):
+        study = sm.Study()
+        study.add_measure(sm.BoundaryF1().object_based())
+        study.add_measure(sm.BoundaryIoU().object_based())
+        study.add_measure(sm.BoundaryIoU(3))
+        study.set_expected(images[0])
+        study.process(0, images[0])
+        df = study.todf()
+        self.assertEqual(list(df.columns), ['Sample', 'Ob. BF1', 'Ob. BIoU', 'BIoU (d=3)'])
+        self.assertTrue(np.allclose(df.iloc[0, 1:].astype(float), 1))
+
+
+class CenterlineDiceTest(unittest.TestCase):
+
+    def test_cldice(self):
+        import skimage.morphology as morph
+        for sample_id, ref, seg in CrossSampler(images[:2], images[3:5]).all():
+            ref_skeleton, seg_skeleton = morph.skeletonize(ref > 0), morph.skeletonize(seg > 0)
+            precision = (seg_skeleton & (ref > 0)).sum() / seg_skeleton.sum()
+            sensitivity = (ref_skeleton & (seg > 0)).sum() / ref_skeleton.sum()
+            measure = sm.CenterlineDice()
+            measure.set_expected(ref)
+            self.assertAlmostEqual(measure.compute(seg)[0], 2 * precision * sensitivity / (precision + sensitivity))
+
+    def test_object_based(self):
+        study = sm.Study()
+        study.add_measure(sm.CenterlineDice())
+        study.add_measure(sm.CenterlineDice().object_based())
+        study.set_expected(images[0])
+        study.process(0, images[0])
+        npt.assert_allclose(study.todf().iloc[0, 1:].astype(float), [1, 1])
+
+
+class VolumeTest(unittest.TestCase):
+
+    def test_stacked_volumes(self):
+        study2d, study3d = sm.Study(), sm.Study()
+        for study in (study2d, study3d):
+            study.add_measure(sm.Dice())
+            study.add_measure(sm.ISBIScore())
+            study.add_measure(sm.AggregatedJaccardCoefficient())
+            study.add_measure(sm.FalseSplit())
+            study.add_measure(sm.FalseMerge())
+            study.add_measure(sm.Dice().object_based())
+        for sample_id, ref, seg in CrossSampler(images[:2], images[3:5]).all():
+            study2d.set_expected(ref)
+            study2d.process(sample_id, seg)
+            study3d.set_expected(np.stack([ref] * 3))
+            study3d.process(sample_id, np.stack([seg] * 3))
+        self.assertTrue(study2d.todf().equals(study3d.todf()))
+
+    def test_chunks(self):
+        results = list()
+        for chunk_size in (sm._aux.CHUNK_SIZE, 1000):
+            with mock.patch.object(sm._aux, 'CHUNK_SIZE', chunk_size):
+                study = sm.Study()
+                for measure in (sm.Dice(), sm.ISBIScore(), sm.AggregatedJaccardCoefficient(), sm.FalseSplit(), sm.NSD()):
+                    study.add_measure(measure)
+                for sample_id, ref, seg in CrossSampler(images[:2], images[3:5]).all():
+                    study.set_expected(np.stack([ref, ref[::-1]]) * 3)
+                    study.process(sample_id, np.stack([seg, seg]) * 5)
+                results.append(study.todf())
+        self.assertEqual(list(results[0].columns), list(results[1].columns))
+        npt.assert_allclose(results[0].iloc[:, 1:].astype(float), results[1].iloc[:, 1:].astype(float))
+
+    def test_spacing(self):
+        import scipy.ndimage as ndi
+        import scipy.spatial
+        spacing = (3., 1., 0.5)
+        ref = np.stack([images[0], images[0], images[1]])
+        seg = np.stack([images[3], images[4], images[4]])
+        contours = [
+            np.argwhere(ndi.binary_dilation(im > 0, ndi.generate_binary_structure(3, 1)) & (im == 0)) * spacing
+            for im in (ref, seg)
+        ]
+        distances = scipy.spatial.cKDTree(contours[0]).query(contours[1])[0]
+        measure = sm.Hausdorff(spacing=spacing)
+        measure.set_expected(ref)
+        self.assertAlmostEqual(measure.compute(seg)[0], distances.max())
+
+
+class LabelingTest(unittest.TestCase):
+
+    def test_tiled_labeling(self):
+        import scipy.ndimage as ndi
+        np.random.seed(0)
+        for ndim, neighbors, connectivity in ((2, 4, 1), (2, 8, 2), (3, 4, 1), (3, 8, 2)):
+            image = np.random.uniform(size=(30,) * ndim) > 0.55
+            expected = ndi.label(image, ndi.generate_binary_structure(ndim, connectivity))[0]
+            for num_threads in (1, 2, 7, 30):
+                with mock.patch.object(sm.labeling, 'MIN_TILE_SIZE', 1):
+                    actual = sm.labeling.label(image, neighbors, num_threads=num_threads)
+                self.assertEqual(actual.dtype, np.min_scalar_type(expected.max()))
+                npt.assert_array_equal(actual, expected)
+
+    def test_tiles(self):
+        self.assertEqual(len(sm.labeling._tiles((30, 30), 4)), 1)
+        with mock.patch.object(sm.labeling, 'MIN_TILE_SIZE', 200):
+            tiles = sm.labeling._tiles((30, 30), 8)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual([tile.stop - tile.start for tile in tiles], [7, 8, 7, 8])
+        self.assertEqual(len(sm.labeling._tiles((4, 2 ** 20), 8)), 4)
+
+    def test_study_neighbors(self):
+        image = np.eye(10, dtype=bool)
+        study = sm.Study()
+        study.add_measure(sm.FalseSplit())
+        study.set_expected(image.astype(np.uint8))
+        study.process(0, image, unique=False)
+        study.neighbors = 8
+        study.process(1, image, unique=False)
+        npt.assert_array_equal(study['Split'], [1, 0])
+
+
+class ArenaTest(unittest.TestCase):
+
+    def test_reuse(self):
+        import pickle
+        studies = [sm.Study(), sm.Study()]
+        studies[1].arena.max_bytes = 0
+        for study in studies:
+            study.add_measure(sm.ISBIScore())
+            study.add_measure(sm.Hausdorff())
+            study.add_measure(sm.BoundaryIoU())
+            for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+                study.set_expected(ref.copy())
+                study.process(sample_id, seg.copy())
+        self.assertTrue(studies[0].todf().equals(studies[1].todf()))
+        stats = studies[0].arena.stats()
+        self.assertGreater(stats['hits'], 10 * stats['allocations'])
+        self.assertEqual(stats['in_use_bytes'], 0)
+        self.assertEqual(stats['pooled_bytes'], stats['peak_bytes'])
+        self.assertEqual(studies[1].arena.stats()['hits'], 0)
+        arena = pickle.loads(pickle.dumps(studies[0].arena))
+        self.assertEqual(arena.stats()['pooled_bytes'], 0)
+        studies[0].release()
+        self.assertEqual(studies[0].arena.stats()['pooled_bytes'], 0)
+
+    def test_max_bytes(self):
+        arena = sm.arena.BufferArena(max_bytes=1000)
+        with arena.activate():
+            with sm.arena.scratch((10, 50), bool) as buffer1:
+                with sm.arena.scratch((10, 50), bool) as buffer2:
+                    self.assertIsNot(buffer1, buffer2)
+            with sm.arena.scratch((10, 50), bool) as buffer3:
+                self.assertIs(buffer3, buffer1)
+            with sm.arena.scratch((2000,), bool):
+                pass
+        stats = arena.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['allocations'], 3)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['pooled_bytes'], 1000)
+        self.assertIsNone(sm.arena.active_arena())
+
+
+class ThresholdSweepTest(unittest.TestCase):
+
+    def test_threshold_sweep(self):
+        from scipy import ndimage
+        np.random.seed(0)
+        thresholds = np.linspace(0.1, 0.9, 17)
+        sweep = sm.ThresholdSweep(thresholds, min_ref_size=2)
+        studies = [sm.Study() for _ in thresholds]
+        for study in studies:
+            study.add_measure(sm.Dice())
+            study.add_measure(sm.JaccardCoefficient())
+            study.add_measure(sm.ISBIScore(min_ref_size=2))
+        for sample_id, ref in enumerate(images[:3]):
+            probabilities = ndimage.gaussian_filter((ref > 0) * 1., 8)
+            probabilities += np.random.uniform(-0.2, 0.2, ref.shape)
+            sweep.set_expected(ref)
+            sweep.process(sample_id, probabilities)
+            for study, threshold in zip(studies, thresholds):
+                study.set_expected(ref)
+                study.process(sample_id, probabilities > threshold, unique=False)
+        df = sweep.todf()
+        self.assertEqual(list(df.columns), ['Threshold', 'Dice', 'Jaccard coef.', 'SEG'])
+        for row, study in zip(df.itertuples(index=False), studies):
+            expected = study.todf().iloc[-1]
+            npt.assert_almost_equal(row[1:], [expected['Dice'], expected['Jaccard coef.'], expected['SEG (min_ref_size=2)']])
+        self.assertIn(sweep.best_threshold(), thresholds)
+
+
+class MultiMeasureTest(unittest.TestCase):
+
+    def test_multi_measure(self):
+        multi_study, single_study = sm.Study(), sm.Study()
+        names  = multi_study.add_multi_measure(sm.PixelOverlap())
+        names += multi_study.add_multi_measure(sm.PairCounting())
+        names += multi_study.add_multi_measure(sm.DetectionErrors(aggregation='object-mean'), prefix='Obj.')
+        self.assertEqual(
+            names,
+            ['Dice', 'Jaccard coef.', 'Rand', 'Jaccard index', 'Obj. Split', 'Obj. Merge', 'Obj. Spurious', 'Obj. Missing'],
+        )
+        single_study.add_measure(sm.Dice())
+        single_study.add_measure(sm.JaccardCoefficient())
+        single_study.add_measure(sm.RandIndex())
+        single_study.add_measure(sm.JaccardIndex())
+        single_study.add_measure(sm.FalseSplit(aggregation='object-mean'), 'Obj. Split')
+        single_study.add_measure(sm.FalseMerge(aggregation='object-mean'), 'Obj. Merge')
+        single_study.add_measure(sm.FalsePositive(aggregation='object-mean'), 'Obj. Spurious')
+        single_study.add_measure(sm.FalseNegative(aggregation='object-mean'), 'Obj. Missing')
+        for study in (multi_study, single_study):
+            for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+                study.set_expected(ref)
+                study.process(sample_id, seg)
+        self.assertTrue(multi_study.todf().equals(single_study.todf()))
+
+    def test_single_computation(self):
+        class CountingMeasure(sm.PixelOverlap):
+            calls = 0
+            def compute_outputs(self, actual):
+                CountingMeasure.calls += 1
+                return super().compute_outputs(actual)
+        study = sm.Study()
+        study.add_multi_measure(CountingMeasure())
+        study.set_expected(images[0])
+        study.process(0, images[1])
+        self.assertEqual(CountingMeasure.calls, 1)
+        self.assertRaises(ValueError, study.add_multi_measure, sm.Dice())
+
+
+class SemanticTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.expected = [np.random.randint(0, 4, (30, 40)) for _ in range(3)]
+        self.actual = [np.where(np.random.rand(30, 40) < 0.7, ref, np.random.randint(0, 4, (30, 40))) for ref in self.expected]
+        self.actual[0][self.actual[0] == 3] = 2
+
+    def test_confusion_matrix(self):
+        matrix = sm.semantic.confusion_matrix(self.expected[0], self.actual[0], 4)
+        for i in range(4):
+            for j in range(4):
+                self.assertEqual(matrix[i, j], np.logical_and(self.expected[0] == i, self.actual[0] == j).sum())
+
+    def test_measures(self):
+        study = sm.Study()
+        names = study.add_multi_measure(sm.SemanticOverlap(4))
+        self.assertEqual(names[:5], ['Dice (macro)', 'IoU (macro)', 'Dice (micro)', 'IoU (micro)', 'Dice[1]'])
+        self.assertEqual(names[-1], 'Accuracy (micro)')
+        for sample_id, (ref, seg) in enumerate(zip(self.expected, self.actual)):
+            study.set_expected(ref)
+            study.process(sample_id, seg)
+        df = study.todf().iloc[-1]
+
+        # Compare with binary measures on the pooled pixels
+        ref = np.concatenate(self.expected)
+        seg = np.concatenate(self.actual)
+        dice = [sm.regional._dice((ref == c).sum(), (seg == c).sum(), ((ref == c) & (seg == c)).sum()) for c in range(1, 4)]
+        iou = [sm.regional._jaccard((ref == c).sum(), (seg == c).sum(), ((ref == c) & (seg == c)).sum()) for c in range(1, 4)]
+        for c in range(1, 4):
+            self.assertAlmostEqual(df[f'Dice[{c}]'], dice[c - 1])
+            self.assertAlmostEqual(df[f'IoU[{c}]'], iou[c - 1])
+        self.assertAlmostEqual(df['Dice (macro)'], np.mean(dice))
+        self.assertAlmostEqual(df['IoU (macro)'], np.mean(iou))
+        tp = sum(((ref == c) & (seg == c)).sum() for c in range(1, 4))
+        self.assertAlmostEqual(df['Dice (micro)'], 2 * tp / ((ref > 0).sum() + (seg > 0).sum()))
+        self.assertAlmostEqual(df['Accuracy (micro)'], (ref == seg).mean())
+
+    def test_class_labels_retained(self):
+        ref, seg = self.expected[0].copy(), self.actual[0].copy()
+        ref[ref == 2] = 1  # class 2 is absent, relabeling would swap 3 for 2
+        seg[seg == 2] = 1
+        study = sm.Study()
+        study.add_measure(sm.MultiClassDice(4, average=3), 'Dice[3]')
+        study.set_expected(ref)
+        result = study.process(0, seg)['Dice[3]']
+        tp = ((ref == 3) & (seg == 3)).sum()
+        self.assertAlmostEqual(result[0], 2 * tp / ((ref == 3).sum() + (seg == 3).sum()))
+        self.assertIsNone(study.expected_labels)
+
+    def test_absent_class(self):
+        measure = sm.MultiClassDice(5)
+        measure.set_expected(self.expected[0])
+        self.assertEqual(
+            measure.postprocess(measure.compute(self.expected[0])), [1.0],
+        )
+
+    def test_balanced_accuracy(self):
+        matrix = np.array([[0, 0, 0], [0, 50, 50], [0, 0, 0]])  # class 2 is predicted, but absent
+        self.assertEqual(sm.MultiClassAccuracy(3).compute_value(matrix), 0.5)
+        self.assertEqual(sm.MultiClassDice(3).compute_value(matrix), (100 / 150 + 0) / 2)
+
+
+class PanopticTest(unittest.TestCase):
+
+    def test_class_instance_measures(self):
+        study = sm.Study()
+        names = study.add_multi_measure(sm.ClassInstanceMeasures([1, 2]))
+        self.assertEqual(names, ['PQ@0.5[1]', 'SEG[1]', 'AJC[1]', 'PQ@0.5[2]', 'SEG[2]', 'AJC[2]'])
+        masked_studies = {c: sm.Study() for c in (1, 2)}
+        for c, masked_study in masked_studies.items():
+            masked_study.add_measure(sm.PanopticQuality(), f'PQ@0.5[{c}]')
+            masked_study.add_measure(sm.ISBIScore(), f'SEG[{c}]')
+            masked_study.add_measure(sm.AggregatedJaccardCoefficient(), f'AJC[{c}]')
+        np.random.seed(0)
+        for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+            ref_classes = np.random.randint(1, 3, ref.max() + 1)[ref] * (ref > 0)
+            seg_classes = np.random.randint(1, 3, seg.max() + 1)[seg] * (seg > 0)
+            study.set_expected(ref, classes=ref_classes)
+            study.process(sample_id, seg, classes=seg_classes)
+            for c, masked_study in masked_studies.items():
+                masked_study.set_expected(ref * (ref_classes == c))
+                masked_study.process(sample_id, seg * (seg_classes == c))
+        df = study.todf()
+        for c, masked_study in masked_studies.items():
+            masked_df = masked_study.todf()
+            for name in masked_df.columns[1:]:
+                npt.assert_allclose(df[name].astype(float), masked_df[name].astype(float))
+
+    def test_missing_class_map(self):
+        measure = sm.ClassInstanceMeasures([1])
+        measure.set_expected(images[0].copy())
+        self.assertRaises(ValueError, measure.compute_outputs, images[1].copy())
+
+
+class InstancePairCountingTest(unittest.TestCase):
+
+    def test_measures(self):
+        import skimage.metrics
+        import sklearn.metrics
+        study = sm.Study()
+        study.add_measure(sm.InstanceRandIndex())
+        study.add_measure(sm.InstanceAdjustedRandIndex())
+        study.add_measure(sm.VariationOfInformation())
+        study.add_measure(sm.VariationOfInformation('split'))
+        study.add_measure(sm.VariationOfInformation('merge'))
+        refs, segs = list(), list()
+        for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+            study.set_expected(ref)
+            study.process(sample_id, seg)
+
+            # Concatenate the images with distinct object labels
+            refs.append(np.where(ref > 0, ref.astype(int) + sum(int(r.max()) for r in refs), 0))
+            segs.append(np.where(seg > 0, seg.astype(int) + sum(int(s.max()) for s in segs), 0))
+
+        ref, seg = np.concatenate(refs).ravel(), np.concatenate(segs).ravel()
+        split, merge = skimage.metrics.variation_of_information(ref, seg)
+        df = study.todf().iloc[-1]
+        self.assertAlmostEqual(df['Inst. Rand'], sklearn.metrics.rand_score(ref, seg), places=6)
+        self.assertAlmostEqual(df['Inst. ARI'], sklearn.metrics.adjusted_rand_score(ref, seg), places=6)
+        self.assertAlmostEqual(df['VI (split)'], split, places=6)
+        self.assertAlmostEqual(df['VI (merge)'], merge, places=6)
+        self.assertAlmostEqual(df['VI'], split + merge, places=6)
+
+    def test_identity(self):
+        measure = sm.VariationOfInformation()
+        measure.set_expected(images[0])
+        self.assertEqual(measure.postprocess(measure.compute(images[0])), [0.0])
+        measure = sm.InstanceAdjustedRandIndex()
+        measure.set_expected(images[0])
+        self.assertEqual(measure.postprocess(measure.compute(images[0])), [1.0])
+
+
+class PointsTest(unittest.TestCase):
+
+    def test_match_points(self):
+        import itertools
+        np.random.seed(0)
+        for _ in range(20):
+            expected, actual = np.random.rand(6, 2) * 10, np.random.rand(5, 2) * 10
+            ref, seg, dist = sm.points.match_points(expected, actual, 3)
+            self.assertEqual(len(set(ref)), len(ref))
+            self.assertEqual(len(set(seg)), len(seg))
+
+            # Brute force: largest number of pairs, then smallest total distance
+            d = np.linalg.norm(expected[:, None] - actual[None], axis=2)
+            best = (0, 0.)
+            for perm in itertools.permutations(range(len(expected)), len(actual)):
+                pairs = [(i, j) for j, i in enumerate(perm) if d[i, j] <= 3]
+                best = min(best, (-len(pairs), sum(d[i, j] for i, j in pairs)))
+            self.assertEqual(len(dist), -best[0])
+            self.assertAlmostEqual(dist.sum(), best[1])
+
+    def test_point_detection(self):
+        for mode in ('centroid', 'mask'):
+            study = sm.Study()
+            names = study.add_multi_measure(sm.PointDetection(5, mode=mode))
+            self.assertEqual(names, ['TP', 'FP', 'FN', 'Precision', 'Recall', 'F1', 'Loc. error'])
+            tp, fp = 0, 0
+            for sample_id, ref, seg in CrossSampler(images[:3], images[3:]).all():
+                labels, centroids = sm.points.object_centroids(ref)
+                study.set_expected_points(centroids[:-1] + 1)
+                study.process(sample_id, ref)
+                tp += len(labels) - 1
+                fp += 1
+            df = study.todf().iloc[-1]
+            self.assertEqual((df['TP'], df['FP'], df['FN']), (tp, fp, 0))
+            self.assertAlmostEqual(df['F1'], 2 * tp / (2 * tp + fp))
+            self.assertAlmostEqual(df['Loc. error'], np.sqrt(2))
+
+    def test_pickle(self):
+        study = sm.Study()
+        study.add_multi_measure(sm.PointDetection(5))
+        labels, centroids = sm.points.object_centroids(images[0])
+        study.set_expected_points(centroids)
+        study.process('a', images[0])
+        restored = pickle.loads(pickle.dumps(study))
+        pd.testing.assert_frame_equal(restored.todf(), study.todf())
+
+    def test_invalid_measure(self):
+        study = sm.Study()
+        study.add_measure(sm.Dice())
+        self.assertRaises(ValueError, study.set_expected_points, np.zeros((1, 2)))
+
+
+class TrackingTest(unittest.TestCase):
+
+    def test_sequence(self):
+        expected = np.stack([images[0]] * 3)
+        actual = expected.copy()
+        actual[2] = np.choose(actual[2], [0, 2, 1, 3, 4])  # swap tracks 1 and 2
+        study = sm.Study()
+        study.add_measure(sm.DetectionAccuracy())
+        study.add_measure(sm.TrackingAccuracy())
+        study.process_sequence('seq', expected, list(actual))
+        self.assertEqual(study.todf()['Sample'].tolist()[:3], [str(('seq', t)) for t in range(3)])
+        results = study.todf().iloc[-1]
+        self.assertAlmostEqual(results['DET'], 1)
+        self.assertAlmostEqual(results['TRA'], 1 - (2 * 1.5 + 2 * 1) / (10 * 12 + 1.5 * 8))
+
+    def test_reused_buffer(self):
+        def read(frames):
+            buffer = np.empty_like(frames[0])
+            for frame in frames:
+                buffer[...] = frame
+                yield buffer
+        expected = np.stack([images[0]] * 3)
+        actual = expected.copy()
+        actual[2] = np.choose(actual[2], [0, 2, 1, 3, 4])
+        results = list()
+        for reader in (list, read):
+            study = sm.Study()
+            study.add_measure(sm.TrackingAccuracy())
+            study.add_measure(sm.ISBIScore())
+            study.process_sequence('seq', reader(expected), reader(actual))
+            results.append(study.todf())
+        self.assertTrue(results[0].equals(results[1]))
+
+    def test_reused_frames(self):
+        expected = np.stack([images[0]] * 3)
+        study = sm.Study()
+        study.add_measure(sm.DetectionAccuracy())
+        study.add_measure(sm.TrackingAccuracy())
+        with mock.patch.object(study, 'set_expected', wraps=study.set_expected) as set_expected, \
+                mock.patch('segmetrics.tracking.overlap_table', wraps=sm.tracking.overlap_table) as overlap_table:
+            study.process_sequence('seq', expected, list(expected))
+        self.assertEqual(set_expected.call_count, 1)
+        self.assertEqual(overlap_table.call_count, 1)
+        self.assertAlmostEqual(study.todf().iloc[-1]['TRA'], 1)
+
+    def test_mismatched_lengths(self):
+        study = sm.Study()
+        study.add_measure(sm.TrackingAccuracy())
+        expected = np.stack([images[0]] * 3)
+        with self.assertRaises(ValueError):
+            study.process_sequence('seq', expected, expected[:2])
+        with self.assertRaises(ValueError):
+            study.process_sequence('seq', iter(expected), iter(expected[:2]))
+
+    def test_incomplete_frames(self):
+        measure = sm.TrackingAccuracy()
+        measure.set_expected(images[0])
+        measure.set_sequence('seq')
+        values = list()
+        for t in (0, 2):
+            measure.set_frame(t)
+            values += measure.compute(images[0])
+        with self.assertRaises(AssertionError):
+            measure.postprocess(values)
+
+    def test_division(self):
+        frames = np.zeros((2, 20, 20), np.uint8)
+        frames[0, 2:18, 2:18] = 1
+        frames[1, 2:8, 2:18] = 2
+        frames[1, 12:18, 2:18] = 3
+        results = list()
+        for actual_parents in ({2: 1, 3: 1}, None):
+            study = sm.Study()
+            study.add_measure(sm.TrackingAccuracy())
+            study.process_sequence(0, frames, frames, expected_parents={2: 1, 3: 1}, actual_parents=actual_parents)
+            results.append(study.todf().iloc[-1]['TRA'])
+        npt.assert_allclose(results, [1, 1 - 2 * 1.5 / (10 * 3 + 1.5 * 2)])
 
 
 class ObjMeanTest(unittest.TestCase):
@@ -141,6 +964,12 @@ class FullStudyTest(unittest.TestCase):
         sm.parallel.process_all(self.study, lambda sid: self.sampler.img2(sid), lambda sid: self.sampler.img1(sid), self.sampler.sample_ids, num_forks=2, is_actual_unique=True, is_expected_unique=True)
         compare_study(self, self.study, 'tests/full-study-test.csv', 'parallel')
 
+    def test_pipeline(self):
+        sm.parallel.pipeline_all(self.study, lambda sid: self.sampler.img2(sid), lambda sid: self.sampler.img1(sid), self.sampler.sample_ids, num_workers=2)
+        df = self.study.todf()
+        df = pd.concat([df.iloc[:-1].sort_values('Sample'), df.iloc[-1:]], ignore_index=True)
+        compare_dataframe(self, df, 'tests/full-study-test.csv', 'pipeline')
+
     @classmethod
     def setUpClass(cls):
         cls.times = dict()
@@ -152,6 +981,248 @@ class FullStudyTest(unittest.TestCase):
             print(f'  {test_id}: {duration} sec')
 
 
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = CrossSampler(images[:3], images[3:])
+        self.studies = [sm.Study(), sm.Study()]
+        for study in self.studies:
+            study.add_measure(sm.ISBIScore())
+            study.add_measure(sm.FalseSplit())
+            study.add_multi_measure(sm.PixelOverlap())
+        for sample_id, ref, seg in self.sampler.all():
+            self.studies[0].set_expected(ref)
+            self.studies[0].process(sample_id, seg)
+
+    def test_threads(self):
+        sample_ids = list(sm.parallel.pipeline(self.studies[1], self.sampler.img2, self.sampler.img1, self.sampler.sample_ids, num_workers=3, use_threads=True))
+        self.assertCountEqual(sample_ids, self.sampler.sample_ids)
+        expected, actual = (study.todf().sort_values('Sample', ignore_index=True) for study in self.studies)
+        self.assertEqual(list(actual['Sample']), list(expected['Sample']))
+        npt.assert_allclose(actual.iloc[:, 1:].astype(float), expected.iloc[:, 1:].astype(float))
+
+    def test_backpressure(self):
+        sample_bytes = self.sampler.img1(self.sampler.sample_ids[0]).nbytes + self.sampler.img2(self.sampler.sample_ids[0]).nbytes
+        for use_threads, max_pending_bytes, max_in_flight in ((True, 1, 1), (True, 3 * sample_bytes, 3), (False, 3 * sample_bytes, 1)):
+            in_flight = list()
+            progress = [0]
+
+            def load(sample_id):
+                in_flight.append(len(in_flight) + 1 - progress[0])
+                return self.sampler.img1(sample_id)
+
+            sm.parallel.pipeline_all(
+                sm.Study(),
+                self.sampler.img2,
+                load,
+                self.sampler.sample_ids,
+                num_workers=2,
+                num_loaders=2,
+                max_pending_bytes=max_pending_bytes,
+                use_threads=use_threads,
+                callback=lambda num_processed, num_samples: progress.__setitem__(0, num_processed),
+            )
+            self.assertLessEqual(max(in_flight), max_in_flight)
+            self.assertEqual(len(in_flight), len(self.sampler.sample_ids))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_longest_first(self):
+        sampler = CrossSampler(images[:3], images[3:])
+        costs = np.random.RandomState(0).permutation(len(sampler.sample_ids))
+        scheduler = sm.parallel.CostScheduler(costs)
+        study = sm.Study()
+        study.add_measure(sm.ISBIScore())
+        sample_ids = list(sm.parallel.process(study, sampler.img2, sampler.img1, sampler.sample_ids, num_forks=1, scheduler=scheduler))
+        self.assertEqual(sample_ids, [sampler.sample_ids[idx] for idx in np.argsort(-costs)])
+        df = scheduler.todf()
+        self.assertEqual(list(df.columns), ['Sample', 'Cost', 'Predicted time', 'Actual time'])
+        self.assertEqual(list(df['Sample']), sample_ids)
+        self.assertTrue(np.isnan(df['Predicted time'].iloc[0]))
+        for idx in range(1, len(df)):
+            rate = df['Actual time'].iloc[:idx].sum() / df['Cost'].iloc[:idx].sum()
+            self.assertAlmostEqual(df['Predicted time'].iloc[idx], rate * df['Cost'].iloc[idx])
+
+    def test_image_cost(self):
+        self.assertEqual(sm.parallel.image_cost(images[5]), images[5].size + 4 * sm.parallel.OBJECT_COST)
+        sparse = np.zeros((10, 10), np.uint32)
+        sparse[:2], sparse[5:] = 10 ** 6, 2 * 10 ** 6
+        self.assertEqual(sm.parallel.image_cost(sparse), 100 + 2 * sm.parallel.OBJECT_COST)
+
+    def test_load_order(self):
+        sampler = CrossSampler(images[:3], images[3:])
+        scheduler = sm.parallel.CostScheduler()
+        self.assertEqual(scheduler.order(sampler.sample_ids), sampler.sample_ids)
+        study = sm.Study()
+        study.add_measure(sm.ISBIScore())
+        self.assertTrue(np.isnan(list(scheduler.sample_costs.values())).all())
+        sample_ids = list(sm.parallel.process(study, sampler.img2, sampler.img1, sampler.sample_ids, num_forks=1, scheduler=scheduler))
+        self.assertEqual(sample_ids, list(sampler.sample_ids))
+        df = scheduler.todf()
+        for sample_id, cost in zip(df['Sample'], df['Cost']):
+            self.assertEqual(cost, sm.parallel.image_cost(sampler.img1(sample_id)))
+        self.assertTrue(np.isnan(df['Predicted time'].iloc[0]))
+        self.assertFalse(df['Predicted time'].iloc[1:].isna().any())
+
+
+class FailureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = CrossSampler(images[:3], images[3:])
+        self.study = sm.Study()
+        self.study.add_measure(sm.ISBIScore())
+
+    def load(self, sample_id):
+        if sample_id == 'sample-1-0':
+            raise ValueError('corrupted file')
+        if sample_id == 'sample-2-1':
+            time.sleep(10)
+        return self.sampler.img1(sample_id)
+
+    def test_isolation(self):
+        for num_forks in (1, 2):
+            with self.subTest(num_forks=num_forks):
+                failures = list()
+                study = sm.Study()
+                study.add_measure(sm.ISBIScore())
+                sample_ids = list(sm.parallel.process(study, self.sampler.img2, self.load, self.sampler.sample_ids, num_forks=num_forks, timeout=1, failures=failures))
+                self.assertCountEqual(sample_ids, self.sampler.sample_ids)
+                failures = {failure.sample_id: failure for failure in failures}
+                self.assertEqual(set(failures), {'sample-1-0', 'sample-2-1'})
+                self.assertEqual(failures['sample-1-0'].kind, 'error')
+                self.assertEqual(failures['sample-1-0'].error_type, 'ValueError')
+                self.assertEqual(failures['sample-1-0'].message, 'corrupted file')
+                self.assertEqual(failures['sample-2-1'].kind, 'timeout')
+                self.assertEqual(len(study.todf()), len(self.sampler.sample_ids) - 2 + 1)
+
+    def test_raise(self):
+        with self.assertRaises(sm.parallel.SampleError) as context:
+            sm.parallel.process_all(self.study, self.sampler.img2, self.load, self.sampler.sample_ids, num_forks=1)
+        self.assertEqual(context.exception.failure.sample_id, 'sample-1-0')
+        self.assertEqual(len(self.study['SEG']), 4)  # results of sample-0-0
+
+    def test_retries(self):
+        sampler = self.sampler
+        with tempfile.TemporaryDirectory() as tempdir:
+
+            # The loading function is serialized, so the attempts are counted
+            # using files
+            def load(sample_id):
+                with open(f'{tempdir}/{sample_id}', 'a+') as fp:
+                    fp.write('.')
+                    if fp.tell() < 3:
+                        raise OSError('temporarily unavailable')
+                return sampler.img1(sample_id)
+
+            failures = list()
+            sample_ids = sampler.sample_ids[:2]
+            sm.parallel.process_all(self.study, sampler.img2, load, sample_ids, num_forks=1, retries=1, failures=failures)
+            self.assertEqual([failure.attempts for failure in failures], [2, 2])
+            sm.parallel.process_all(self.study, sampler.img2, load, sample_ids, num_forks=1, retries=1, failures=failures)
+            self.assertEqual(len(failures), 2)
+            self.assertEqual(list(self.study.todf()['Sample'][:-1]), sample_ids)
+
+
+    def test_timeout_in_thread(self):
+        failures = list()
+        kwargs = dict(num_forks=1, timeout=1, failures=failures)
+        thread = threading.Thread(target=sm.parallel.process_all, args=(self.study, self.sampler.img2, self.load, self.sampler.sample_ids), kwargs=kwargs)
+        thread.start()
+        thread.join()
+        self.assertEqual({(failure.sample_id, failure.kind) for failure in failures}, {('sample-1-0', 'error'), ('sample-2-1', 'timeout')})
+
+    def test_crash(self):
+        sample_ids = self.sampler.sample_ids
+
+        def crash(load):
+            return lambda sample_id: np.zeros((7, 7), int) if sample_id == 'sample-1-0' else load(sample_id)
+
+        for run in (
+            lambda study, failures: sm.parallel.process_all(study, crash(self.sampler.img2), crash(self.sampler.img1), sample_ids, num_forks=2, failures=failures),
+            lambda study, failures: sm.parallel.pipeline_all(study, crash(self.sampler.img2), crash(self.sampler.img1), sample_ids, num_workers=2, failures=failures),
+        ):
+            failures = list()
+            study = sm.Study()
+            study.add_measure(CrashingMeasure(), 'SEG')
+            run(study, failures)
+            self.assertEqual([(failure.sample_id, failure.kind) for failure in failures], [('sample-1-0', 'crash')])
+            self.assertEqual(len(study.todf()), len(sample_ids) - 1 + 1)
+
+
+class CrashingMeasure(sm.ISBIScore):
+
+    def compute(self, actual):
+        if actual.shape == (7, 7):
+            os._exit(1)
+        return super().compute(actual)
+
+
+def write_shard_part(args):
+    path, sample_ids = args
+    sampler = CrossSampler(images[:3], images[3:])
+    study = create_full_study()
+    for sample_id in sample_ids:
+        study.set_expected(sampler.img1(sample_id))
+        study.process(sample_id, sampler.img2(sample_id))
+    sm.shards.write_shard(study, path)
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = CrossSampler(images[:3], images[3:])
+        self.study = create_full_study()
+        for sample_id, ref, seg in self.sampler.all():
+            self.study.set_expected(ref)
+            self.study.process(sample_id, seg)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write_shards(self, num_shards):
+        paths = [f'{self.tempdir.name}/shard-{idx}.npz' for idx in range(num_shards)]
+        with multiprocessing.Pool(2) as pool:
+            pool.map(write_shard_part, [(path, self.sampler.sample_ids[idx::num_shards]) for idx, path in enumerate(paths)])
+        return paths
+
+    def assert_study_equal(self, actual, expected):
+        expected, actual = (study.todf().sort_values('Sample', ignore_index=True) for study in (expected, actual))
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def test_reduce(self):
+        paths = self.write_shards(5)
+        for num_workers in (1, 2):
+            with self.subTest(num_workers=num_workers):
+                study = sm.shards.reduce_shards(paths, fanout=2, num_workers=num_workers)
+                self.assert_study_equal(study, self.study)
+
+    def test_replace(self):
+        paths = self.write_shards(2)
+        study = sm.shards.reduce_shards(paths + paths[:1], num_workers=1)
+        self.assertEqual(list(study._sample_ids), self.sampler.sample_ids[0::2] + self.sampler.sample_ids[1::2])
+        self.assert_study_equal(study, self.study)
+        with self.assertRaises(ValueError):
+            sm.shards.reduce_shards(paths + paths[:1], num_workers=1, replace=False)
+
+    def test_merge(self):
+        study = sm.Study()
+        for path in self.write_shards(3):
+            study.merge(sm.shards.read_shard(path), sample_ids='all')
+        self.assert_study_equal(study, self.study)
+        with self.assertRaises(AssertionError):
+            study.merge(self.study, sample_ids=self.sampler.sample_ids[:1], replace=False)
+
+    def test_cli(self):
+        paths = self.write_shards(2)
+        result_path = f'{self.tempdir.name}/results.csv'
+        os.system(f'python -m segmetrics reduce {result_path} {" ".join(paths)} --num-workers 1 >/dev/null')
+        actual_df = pd.read_csv(result_path, sep=',', keep_default_na=False)
+        self.assertEqual(len(actual_df), len(self.sampler.sample_ids) + 1)
+        npt.assert_allclose(actual_df.iloc[-1, 1:].astype(float), self.study.todf().iloc[-1, 1:].astype(float))
+
+
 class SEGTest(unittest.TestCase):
 
     env_password_var = 'ISBI_EVALUATION_SOFTWARE_PASSWORD'